@@ -84,11 +84,27 @@ class ArchitectureConfig:  # for encoder, only AUDIO
 
 
 class VisionArchitectureConfig:
-    def __init__(self, predict_distributions: bool, model_splits: int, train_module: int, resnet_type: int):
+    def __init__(self, predict_distributions: bool, model_splits: int, train_module: int, resnet_type: int,
+                 share_negatives: bool = False, fused_contrastive_loss: bool = True, patch_mode: str = "reshape",
+                 patch_chunk_size: int = 16, training_mode: str = "full"):
         self.predict_distributions = predict_distributions
         self.model_splits = model_splits
         self.train_module = train_module
         self.modules: List[int] = [0] * model_splits  # [0, 0, 0, 0, 0], dummy variable needed in `logger.py`
+        # InfoNCE: draw the negatives once and reuse the draw for all k prediction steps (instead of once per k)
+        self.share_negatives = share_negatives
+        # InfoNCE: log-softmax + nll in one `F.cross_entropy` call. False: softmax followed by log(p + 1e-11),
+        # as in the original implementation (for reproducing older runs)
+        self.fused_contrastive_loss = fused_contrastive_loss
+        # first module: "reshape" copies all overlapping patches at once, "chunked" patchifies + encodes
+        # `patch_chunk_size` images at a time (checkpointed during training, lower activation memory)
+        assert patch_mode in ["reshape", "chunked"], f"Unknown patch_mode: {patch_mode}"
+        self.patch_mode = patch_mode
+        self.patch_chunk_size = patch_chunk_size
+        # "full": all modules run every step, "cached_prefix": outputs of the frozen modules before train_module are
+        # computed once, "pipelined": all modules are trained concurrently (see `vision/models/greedy_training.py`)
+        assert training_mode in ["full", "cached_prefix", "pipelined"], f"Unknown training_mode: {training_mode}"
+        self.training_mode = training_mode
 
         self._resnet_type = None
         self.hidden_dim = None
@@ -112,7 +128,10 @@ class VisionArchitectureConfig:
     def __str__(self):
         return (f"VisionArchitectureConfig(predict_distributions={self.predict_distributions}, "
                 f"model_splits={self.model_splits}, "
-                f"train_module={self.train_module}, resnet_type={self.resnet_type})")
+                f"train_module={self.train_module}, resnet_type={self.resnet_type}, "
+                f"share_negatives={self.share_negatives}, "
+                f"fused_contrastive_loss={self.fused_contrastive_loss}, patch_mode={self.patch_mode}, "
+                f"patch_chunk_size={self.patch_chunk_size}, training_mode={self.training_mode})")
 
 
 class DecoderArchitectureConfig:
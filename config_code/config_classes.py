@@ -39,7 +39,8 @@ class DataSetConfig:
     def __init__(self, dataset: Dataset, batch_size, labels: Optional[str] = None,
                  limit_train_batches: Optional[float] = 1.0, limit_validation_batches: Optional[float] = 1.0,
                  grayscale: Optional[bool] = False, split_in_syllables: Optional[bool] = False,
-                 num_workers: Optional[int] = 0):
+                 num_workers: Optional[int] = 0, streaming: Optional[bool] = False,
+                 batched_augmentation: Optional[bool] = False, use_resized_cache: Optional[bool] = False):
         self.data_input_dir = './datasets/'
         self.dataset: Dataset = dataset
         self.split_in_syllables = split_in_syllables
@@ -63,6 +64,22 @@ class DataSetConfig:
         self.limit_validation_batches = limit_validation_batches
         self.grayscale = grayscale
 
+        # shapes3d: read the images from the h5 file on the fly instead of loading all of them in memory
+        assert not streaming or dataset in [Dataset.SHAPES_3D, Dataset.SHAPES_3D_SUBSET], \
+            "streaming is only supported for the shapes3d dataset"
+        self.streaming = streaming
+
+        # shapes3d and awa2: flip/crop/grayscale on uint8 batches after collation instead of per image with PIL
+        assert not batched_augmentation or dataset in [Dataset.SHAPES_3D, Dataset.SHAPES_3D_SUBSET,
+                                                       Dataset.ANIMAL_WITH_ATTRIBUTES], \
+            "batched_augmentation is only supported for the shapes3d and animals with attributes datasets"
+        self.batched_augmentation = batched_augmentation
+
+        # awa2: decode + resize all images once to a memory-mapped uint8 array (see `animals_with_attributes_dataset`)
+        assert not use_resized_cache or dataset == Dataset.ANIMAL_WITH_ATTRIBUTES, \
+            "use_resized_cache is only supported for the animals with attributes dataset"
+        self.use_resized_cache = use_resized_cache
+
     def __copy__(self):
         return DataSetConfig(
             dataset=self.dataset,
@@ -147,15 +164,20 @@ class PostHocModel:  # Classifier or Decoder
 
 class ClassifierConfig(PostHocModel):
     def __init__(self, num_epochs, learning_rate, dataset: DataSetConfig, encoder_num: str,
-                 bias: Optional[bool] = True, encoder_module: Optional[int] = -1, encoder_layer: Optional[int] = -1):
+                 bias: Optional[bool] = True, encoder_module: Optional[int] = -1, encoder_layer: Optional[int] = -1,
+                 precompute_features: Optional[bool] = False):
         super().__init__(num_epochs, learning_rate, dataset, encoder_num, encoder_module, encoder_layer)
         self.bias = bias
+        # vision: encode the dataset once (memory-mapped in model_path/feature_store, deterministic encoder)
+        # instead of every classifier epoch
+        self.precompute_features = precompute_features
 
     # to string
     def __str__(self):
         return f"ClassifierConfig(num_epochs={self.num_epochs}, learning_rate={self.learning_rate}, " \
                f"dataset={self.dataset}, encoder_num={self.encoder_num}, bias={self.bias}, " \
-               f"encoder_module={self.encoder_module}, encoder_layer={self.encoder_layer})"
+               f"encoder_module={self.encoder_module}, encoder_layer={self.encoder_layer}, " \
+               f"precompute_features={self.precompute_features})"
 
 
 class DecoderLoss(Enum):
@@ -166,18 +188,40 @@ class DecoderLoss(Enum):
     MSE_FFT = 4
     MEL = 5
     MSE_MEL = 6
+    MSE_MR_STFT = 7  # multi-resolution STFT
 
 
 class DecoderConfig(PostHocModel):
     def __init__(self, num_epochs, learning_rate, dataset: DataSetConfig, encoder_num: str,
                  architectures: Union[List[DecoderArchitectureConfig], List[VisionDecoderArchitectureConfig]],
                  decoder_loss: DecoderLoss,
-                 encoder_module: Optional[int] = -1, encoder_layer: Optional[int] = -1):
+                 encoder_module: Optional[int] = -1, encoder_layer: Optional[int] = -1,
+                 precompute_latents: Optional[bool] = False, cache_target_spectrograms: Optional[bool] = False,
+                 accelerator: Optional[str] = "gpu", devices: Optional[str] = "1", strategy: Optional[str] = "auto",
+                 precision: Optional[str] = "32-true"):
         super().__init__(num_epochs, learning_rate, dataset, encoder_num, encoder_module, encoder_layer)
 
         self.architectures: Union[
             List[DecoderArchitectureConfig], List[VisionDecoderArchitectureConfig]] = architectures
         self.decoder_loss: DecoderLoss = decoder_loss
+        # encode the dataset once (memory-mapped in model_path/latent_store) instead of every training step
+        self.precompute_latents = precompute_latents
+        # spectral losses compute the spectrogram of each target once and keep it in memory (keyed by filename)
+        self.cache_target_spectrograms = cache_target_spectrograms
+
+        # Lightning trainer settings (audio decoder), eg: accelerator=cpu devices=4 strategy=ddp_gloo precision=bf16-mixed
+        self.accelerator = accelerator
+        self.devices = devices  # nb of devices, for the cpu: nb of processes
+        self.strategy = strategy  # ddp_gloo: multi-process ddp with the gloo backend (cpu)
+        self.precision = precision
+        self.check_trainer_settings()
+
+    def check_trainer_settings(self):
+        # also called before creating the trainer, as `--overrides` are applied after __init__
+        assert self.accelerator in ["gpu", "cpu", "auto"], f"Unknown accelerator: {self.accelerator}"
+        assert self.strategy in ["auto", "ddp", "ddp_gloo"], f"Unknown strategy: {self.strategy}"
+        assert self.precision in ["32-true", "16-mixed", "bf16-mixed", "bf16-true", "64-true"], \
+            f"Unknown precision: {self.precision}"
 
     def retrieve_correct_decoder_architecture(self) -> DecoderArchitectureConfig:
         # There are 3 architectures, one of each cnn module. (However, CPC works with single module,
@@ -199,6 +243,40 @@ class DecoderConfig(PostHocModel):
                 raise ValueError(f"A decoder architecture for module {module_idx} and layer {layer_idx} does not exist")
 
 
+class ExtractConfig:
+    """Settings for `encoder.extract`, which writes encoder embeddings of a dataset split to sharded .npy files."""
+
+    def __init__(self, dataset: DataSetConfig, encoder_num: int, split: Optional[str] = "test",
+                 targets: Optional[str] = None, shard_size: Optional[int] = 1024,
+                 num_processes: Optional[int] = 1):
+        assert split in ["train", "test"], f"split must be 'train' or 'test'. Got {split}"
+
+        self.dataset = dataset
+        self.encoder_num = encoder_num  # checkpoint to load, eg: model_{encoder_num}.ckpt
+        self.split = split
+
+        # comma separated "module:layer" pairs. layer=-1 is the final layer of the module. The index of the
+        # autoregressor module (eg 3) gives the output of the full model (regression layer included).
+        # None: the final layer of every module
+        self.targets = targets
+        self.shard_size = shard_size  # number of files per shard
+        self.num_processes = num_processes  # worker processes, each handles every n-th shard
+
+    def get_targets(self, nb_modules: int) -> List[tuple]:
+        """:param nb_modules: nb of modules of the encoder, eg: `len(opt.encoder_config.architecture.modules)`"""
+        if self.targets is None:
+            return [(module_idx, -1) for module_idx in range(nb_modules)]
+        targets = []
+        for target in self.targets.split(","):
+            module_idx, layer_idx = target.split(":")
+            targets.append((int(module_idx), int(layer_idx)))
+        return targets
+
+    def __str__(self):
+        return f"ExtractConfig(dataset={self.dataset}, encoder_num={self.encoder_num}, split={self.split}, " \
+               f"targets={self.targets}, shard_size={self.shard_size}, num_processes={self.num_processes})"
+
+
 class OptionsConfig:
     def __init__(self, config_file, seed, validate, loss: Loss, encoder_config, experiment,
                  save_dir,
@@ -207,9 +285,16 @@ class OptionsConfig:
                  syllables_classifier_config: Optional[ClassifierConfig],
                  decoder_config: Optional[DecoderConfig],
                  vision_classifier_config: Optional[ClassifierConfig],
+                 extract_config: Optional[ExtractConfig] = None,
                  # two params used for local development. Not used in the cluster
                  use_wandb: Optional[bool] = True,
                  train: Optional[bool] = True,
+                 # log to wandb without network access, sync afterwards with `wandb sync`
+                 wandb_offline: Optional[bool] = False,
+                 # checkpoints: keep the last x epochs + the epoch with the lowest validation loss (see Logger)
+                 num_checkpoints_to_keep: Optional[int] = 1,
+                 keep_best_checkpoint: Optional[bool] = True,
+                 async_checkpoints: Optional[bool] = True,
                  ):
         root_logs = r"./sim_logs/"
 
@@ -237,8 +322,14 @@ class OptionsConfig:
         self.decoder_config: Optional[DecoderConfig] = decoder_config
 
         self.vision_classifier_config: Optional[ClassifierConfig] = vision_classifier_config
+        self.extract_config: Optional[ExtractConfig] = extract_config
         self.use_wandb = use_wandb
         self.train = train
+        self.wandb_offline = wandb_offline
+        self.num_checkpoints_to_keep = num_checkpoints_to_keep
+        self.keep_best_checkpoint = keep_best_checkpoint
+        self.async_checkpoints = async_checkpoints
+        assert num_checkpoints_to_keep > 0, "Dont delete all models!!!"
 
     def __str__(self):
         return f"OptionsConfig(model_type={self.model_type}, seed={self.seed}, validate={self.validate}, " \
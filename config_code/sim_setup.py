@@ -2,7 +2,7 @@ from typing import Optional
 
 from config_code.architecture_config import ArchitectureConfig, ModuleConfig, DecoderArchitectureConfig
 from config_code.config_classes import EncoderConfig, DataSetConfig, Dataset, OptionsConfig, Loss, ClassifierConfig, \
-    DecoderConfig, DecoderLoss
+    DecoderConfig, DecoderLoss, ExtractConfig
 
 
 class SIMSetup:
@@ -173,6 +173,17 @@ class SIMSetup:
             decoder_loss=DecoderLoss.MSE_MEL
         )
 
+        self.EXTRACT_CONFIG = ExtractConfig(
+            dataset=DataSetConfig(
+                dataset=dataset,
+                split_in_syllables=False,
+                batch_size=64,
+                num_workers=1
+            ),
+            encoder_num=self.ENCODER_CONFIG.num_epochs - 1,
+            split="test",
+        )
+
     def get_options(self, experiment_name) -> OptionsConfig:
         options = OptionsConfig(
             config_file=self.config_file,
@@ -187,7 +198,8 @@ class SIMSetup:
             speakers_classifier_config=self.CLASSIFIER_CONFIG_SPEAKERS,
             syllables_classifier_config=self.CLASSIFIER_CONFIG_SYLLABLES,
             decoder_config=self.DECODER_CONFIG,
-            vision_classifier_config=None
+            vision_classifier_config=None,
+            extract_config=self.EXTRACT_CONFIG
         )
 
         return options
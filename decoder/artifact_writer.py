@@ -0,0 +1,90 @@
+"""
+Writes decoded audio (WAV files + waveform plots) from a background thread, so that the training loop doesn't wait
+on audio serialization. The training thread only copies the tensors to the cpu and puts them in a queue.
+
+Example:
+    writer = AsyncArtifactWriter(f"{opt.log_path}/artifacts")
+    writer.submit("epoch_10/std normal samples", audio_samples)  # (nb_files, 1, nb_samples) tensor or array
+    ...
+    written = writer.close()  # waits until everything is on disk, {key: [wav paths]}
+"""
+
+import os
+import queue
+import threading
+from typing import Dict, List
+
+import numpy as np
+import soundfile as sf
+import torch
+from matplotlib.figure import Figure
+
+_STOP = None  # sentinel that ends the worker thread
+
+
+class AsyncArtifactWriter:
+    def __init__(self, out_dir: str, sample_rate: int = 16_000, max_queue_size: int = 32, plot: bool = True):
+        self.out_dir = out_dir
+        self.sample_rate = sample_rate
+        self.plot = plot
+        self.written: Dict[str, List[str]] = {}  # key -> wav paths, only read after `close`
+
+        self._queue = queue.Queue(maxsize=max_queue_size)  # bounded, such that a slow disk can't fill the memory
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="AsyncArtifactWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, key: str, audios, captions: List[str] = None):
+        """
+        :param key: eg "epoch_10/std normal samples", used as sub directory
+        :param audios: (nb_files, 1, nb_samples) or (nb_files, nb_samples)
+        """
+        assert self._thread.is_alive(), f"Writer is closed or crashed: {self._error}"
+        if isinstance(audios, torch.Tensor):
+            audios = audios.detach().float().cpu().numpy()  # the only work done on the training thread
+        audios = np.asarray(audios, dtype=np.float32).reshape(len(audios), -1)
+        self._queue.put((key, audios, captions))
+
+    def close(self) -> Dict[str, List[str]]:
+        """Waits until all submitted artifacts are written. :return: key -> wav paths"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if self._error is not None:
+            print(f"AsyncArtifactWriter: failed to write artifacts: {self._error}")
+        return self.written
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:  # don't kill the training because of a failing plot
+                self._error = e
+
+    def _write(self, key: str, audios: np.ndarray, captions: List[str]):
+        directory = os.path.join(self.out_dir, key.replace(" ", "_"))
+        os.makedirs(directory, exist_ok=True)
+
+        paths = []
+        for idx, audio in enumerate(audios):
+            name = f"{idx}"
+            if captions is not None:  # eg: "0_babugu_1"
+                name += f"_{os.path.splitext(os.path.basename(str(captions[idx])))[0]}"
+            path = os.path.join(directory, f"{name}.wav")
+            sf.write(path, audio, self.sample_rate)
+            paths.append(path)
+        self.written.setdefault(key, []).extend(paths)
+
+        if self.plot:
+            # Figure instead of pyplot: pyplot is not thread safe
+            fig = Figure(figsize=(8, 1.5 * len(audios)))
+            axes = fig.subplots(len(audios), 1, squeeze=False)[:, 0]
+            for idx, (ax, audio) in enumerate(zip(axes, audios)):
+                ax.plot(audio, linewidth=0.5)
+                ax.set_title(f"{idx}" if captions is None else str(captions[idx]), fontsize=8)
+                ax.set_xticks([])
+            fig.tight_layout()
+            fig.savefig(os.path.join(directory, "waveforms.png"), dpi=100)
@@ -1,4 +1,5 @@
-from typing import Dict
+import os
+from typing import Dict, Optional
 
 import lightning as L
 import torch
@@ -6,14 +7,21 @@ from lightning.pytorch.loggers import WandbLogger
 from wandb import Audio
 
 from config_code.config_classes import OptionsConfig
-from data import get_dataloader
+from decoder.artifact_writer import AsyncArtifactWriter
 from decoder.interpolation_contribution_score import InterpolationContributionScore
 from decoder.lit_decoder import LitDecoder
 from utils.utils import get_audio_decoder_key
 
 
 class CustomCallback(L.Callback):
-    def __init__(self, opt: OptionsConfig, plot_ever_n_epoch, z_dim, nb_frames, wandb_logger: WandbLogger, loss_enum):
+    """
+    Generates audio (std normal samples every `plot_ever_n_epoch` epochs, reconstructions of the test set at the end
+    of training). The files are written to `{log_path}/artifacts` by a background thread (`AsyncArtifactWriter`) and,
+    if a wandb logger is given, uploaded in one go at the end of training instead of once per epoch.
+    """
+
+    def __init__(self, opt: OptionsConfig, plot_ever_n_epoch, z_dim, nb_frames, wandb_logger: Optional[WandbLogger],
+                 loss_enum):
         super().__init__()
         self.opt = opt
         self.plot_ever_n_epoch = plot_ever_n_epoch
@@ -21,54 +29,58 @@ class CustomCallback(L.Callback):
         self.nb_frames = nb_frames
         self.wandb_logger = wandb_logger
         self.loss_enum = loss_enum
+        self.nb_files = 10
+        self.writer: Optional[AsyncArtifactWriter] = None
+
+    def setup(self, trainer: L.Trainer, pl_module: LitDecoder, stage: str):
+        if stage == "fit" and trainer.is_global_zero:  # with ddp, only one process writes
+            self.writer = AsyncArtifactWriter(os.path.join(self.opt.log_path, "artifacts"))
 
     def on_train_epoch_end(self, trainer: L.Trainer, pl_module: LitDecoder):  # log generated audio (std normal samples)
-        # Every 10th epoch, generate some images
-        if trainer.current_epoch % self.plot_ever_n_epoch == 0:
+        # Every 10th epoch, generate some audio
+        if self.writer is not None and trainer.current_epoch % self.plot_ever_n_epoch == 0:
             pl_module.eval()
-
-            nb_files = 10
-
-            gen_z = torch.randn((nb_files, self.z_dim, self.nb_frames), requires_grad=False, device=pl_module.device)
-            audio_samples = pl_module.decoder(gen_z)  # shape: (100, 1, 2505)
-            # remove 1 channel
-            audio_samples = audio_samples.squeeze(1)
-            audio_samples = audio_samples.contiguous().cpu().data.numpy()
-
-            ten_audio_sammples = [audio_sample for audio_sample in audio_samples[:nb_files]]
-            section = get_audio_decoder_key(self.opt.decoder_config, self.loss_enum)
-            self.wandb_logger.log_audio(key=f"{section}/std normal samples",
-                                        audios=ten_audio_sammples,
-                                        sample_rate=[16_000] * nb_files)
-
+            with torch.no_grad():
+                gen_z = torch.randn((self.nb_files, self.z_dim, self.nb_frames), device=pl_module.device)
+                audio_samples = pl_module.decoder(gen_z)  # shape: (10, 1, 2505)
+            self.writer.submit(f"{self._section()}/std normal samples/epoch_{trainer.current_epoch}", audio_samples)
             pl_module.train()
 
-    def on_train_end(self, trainer, pl_module: LitDecoder):  # log encoded + decoded audio vs gt audio
+    def on_train_end(self, trainer: L.Trainer, pl_module: LitDecoder):  # log encoded + decoded audio vs gt audio
+        if self.writer is None:
+            return
         pl_module.eval()
-        nb_files = 10
 
-        _, _, test_loader, _ = get_dataloader.get_dataloader(self.opt.decoder_config.dataset)
-        for i, (audio, _, label, _) in enumerate(test_loader):
-            audio = audio.to(pl_module.device)  # shape: (100, 1, 2505)
-            z = pl_module.encode(audio)
-            x_reconstructed = pl_module.decoder(z)  # shape: (100, 1, 2505)
-            x_reconstructed = x_reconstructed.squeeze(1)
-            x_reconstructed = x_reconstructed.contiguous().cpu().data.numpy()
+        # first batch of the test loader that the trainer already uses (raw audio or precomputed latents)
+        batch = next(iter(trainer.datamodule.test_dataloader()))
+        batch = pl_module.transfer_batch_to_device(batch, pl_module.device, 0)
+        with torch.no_grad():
+            audio, z, sample_ids = pl_module._unpack(batch, "test")
+            x_reconstructed = pl_module.decoder(z)  # shape: (batch_size, 1, 2505)
+
+        filenames = [sample_id.split("/", 1)[1] for sample_id in sample_ids[:self.nb_files]]
+        section = self._section()
+        self.writer.submit(f"{section}/encode + decode test set", x_reconstructed[:self.nb_files], filenames)
+        self.writer.submit(f"{section}/gt test set", audio[:self.nb_files], filenames)
 
-            ten_audio_sammples = [audio_sample for audio_sample in x_reconstructed[:nb_files]]
-            audio = [audio_sample.squeeze(0).cpu().numpy() for audio_sample in audio[:nb_files]]
+        written = self.writer.close()  # wait for the background thread
+        self.writer = None
+        if self.wandb_logger is not None:
+            for key, paths in written.items():
+                self.wandb_logger.log_audio(key=key, audios=paths, sample_rate=[16_000] * len(paths))
 
-            section = get_audio_decoder_key(self.opt.decoder_config, self.loss_enum)
-            self.wandb_logger.log_audio(
-                key=f"{section}/encode + decode test set",
-                audios=ten_audio_sammples, sample_rate=[16_000] * nb_files)
+    def teardown(self, trainer: L.Trainer, pl_module: LitDecoder, stage: str):
+        if self.writer is not None:  # eg: training was interrupted
+            self.writer.close()
+            self.writer = None
 
-            self.wandb_logger.log_audio(
-                key=f"{section}/gt test set", audios=audio, sample_rate=[16_000] * nb_files)
-            break
+    def _section(self) -> str:
+        return get_audio_decoder_key(self.opt.decoder_config, self.loss_enum)
 
     def on_test_end(self, trainer, pl_module: LitDecoder) -> None:
         """Do interpolation experiments."""
+        if self.wandb_logger is None:
+            return
         pl_module.eval()
 
         decoder_utils = InterpolationContributionScore(self.opt, self.z_dim, pl_module)
@@ -5,30 +5,71 @@ import torch.fft as fft
 import torchaudio.transforms as T
 
 
+class TargetCache:
+    """
+    Caches a transform (eg: spectrogram) of the targets per sample id, such that it is computed once per dataset
+    instead of once per step. Only valid if the target of a sample id never changes (no random crops/augmentation),
+    and ids must be unique across splits (eg: "train/bagigi_1").
+
+    The transformed targets are kept in cpu memory (copied to the device per batch), at most `max_entries` of them;
+    once full, the targets of new ids are computed every step as without cache. Memory cost per entry: eg. a power
+    spectrogram with n_fft=1024 of a 1s clip at 16kHz is 513 x 63 float32 values, ~130KB (10k entries: ~1.3GB).
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._cache = {}
+
+    def get(self, sample_ids, batch_targets, transform):
+        missing = [i for i, sample_id in enumerate(sample_ids) if sample_id not in self._cache]
+        if len(missing) == 0:
+            return torch.stack([self._cache[sample_id] for sample_id in sample_ids]).to(batch_targets.device)
+
+        with torch.no_grad():  # targets don't need gradients
+            computed = transform(batch_targets[torch.tensor(missing, device=batch_targets.device)])
+        batch = {i: computed[k] for k, i in enumerate(missing)}
+        for k, i in enumerate(missing):
+            if len(self._cache) >= self.max_entries:
+                break
+            # own cpu copy: not a view that keeps the whole `computed` batch alive on the device
+            self._cache[sample_ids[i]] = computed[k].detach().cpu().clone()
+        return torch.stack([batch[i] if i in batch else self._cache[sample_id].to(batch_targets.device)
+                            for i, sample_id in enumerate(sample_ids)])
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def _transform_targets(target_cache, sample_ids, batch_targets, transform):
+    if target_cache is None or sample_ids is None:
+        return transform(batch_targets)
+    return target_cache.get(sample_ids, batch_targets, transform)
+
+
 class SpectralLoss(nn.Module):
-    def __init__(self, n_fft=1024):  # should be higher than signal length
+    def __init__(self, n_fft=1024, cache_targets=False):  # should be higher than signal length
         super(SpectralLoss, self).__init__()
         self.n_fft = n_fft
-        self.window = torch.hann_window(window_length=self.n_fft, periodic=True, dtype=None, layout=torch.strided,
-                                        requires_grad=False).cuda()
+        # buffer, so it follows the device of the module (not stored in the state dict)
+        self.register_buffer("window", torch.hann_window(window_length=self.n_fft, periodic=True), persistent=False)
         self.loss = nn.MSELoss()
+        self.target_cache = TargetCache() if cache_targets else None
 
-    def forward(self, batch_inputs, batch_targets):
-        assert batch_inputs.shape == batch_targets.shape
-
-        batch_inputs = batch_inputs.squeeze(1)  # (batch_size, length)
-        batch_targets = batch_targets.squeeze(1)  # (batch_size, length)
+    def _power_spectrogram(self, batch):
+        batch = batch.squeeze(1)  # (batch_size, length)
 
         # n_fft = bin size (number of frequency bins) -> if 16khz, each bin roughly 15hz
-
-        input_spectograms = torch.stft(
-            batch_inputs, self.n_fft, window=self.window, return_complex=True)  # returns complex tensor
-        target_spectograms = torch.stft(
-            batch_targets, self.n_fft, window=self.window, return_complex=True)  # returns complex tensor
+        spectograms = torch.stft(batch, self.n_fft, window=self.window, return_complex=True)  # complex tensor
 
         # Convert complex tensor to real tensor using torch.view_as_real
-        input_spectograms = torch.view_as_real(input_spectograms).pow(2).sum(-1)
-        target_spectograms = torch.view_as_real(target_spectograms).pow(2).sum(-1)
+        return torch.view_as_real(spectograms).pow(2).sum(-1)
+
+    def forward(self, batch_inputs, batch_targets, sample_ids=None):
+        assert batch_inputs.shape == batch_targets.shape
+
+        input_spectograms = self._power_spectrogram(batch_inputs)
+        target_spectograms = _transform_targets(self.target_cache, sample_ids, batch_targets,
+                                                self._power_spectrogram)
 
         return self.loss(input_spectograms, target_spectograms)
 
@@ -38,38 +79,42 @@ class MSE_Loss(nn.Module):
         super(MSE_Loss, self).__init__()
         self.mse_loss = nn.MSELoss()
 
-    def forward(self, batch_inputs, batch_targets):
+    def forward(self, batch_inputs, batch_targets, sample_ids=None):
         assert batch_inputs.shape == batch_targets.shape
         return self.mse_loss(batch_inputs, batch_targets)
 
 
 class MSE_AND_SPECTRAL_LOSS(nn.Module):
-    def __init__(self, n_fft=1024, lambd=1):
+    def __init__(self, n_fft=1024, lambd=1, cache_targets=False):
         super(MSE_AND_SPECTRAL_LOSS, self).__init__()
         self.mse_loss = nn.MSELoss()
-        self.spectral_loss = SpectralLoss(n_fft)
+        self.spectral_loss = SpectralLoss(n_fft, cache_targets=cache_targets)
         self.lambd = lambd
 
-    def forward(self, batch_inputs, batch_targets):
+    def forward(self, batch_inputs, batch_targets, sample_ids=None):
         assert batch_inputs.shape == batch_targets.shape
         return self.mse_loss(batch_inputs, batch_targets) + (
-                self.lambd * self.spectral_loss(batch_inputs, batch_targets))
+                self.lambd * self.spectral_loss(batch_inputs, batch_targets, sample_ids))
 
 
 class FFTLoss(nn.Module):
     # generated via chat gpt
-    def __init__(self, fft_size=10240):
+    def __init__(self, fft_size=10240, cache_targets=False):
         super(FFTLoss, self).__init__()
         # The value of the FFT size should be chosen based on the properties of your signal, such as its sample rate and the frequency content you are interested in analyzing. In general, the FFT size determines the frequency resolution of the analysis, and a larger FFT size will provide better frequency resolution at the expense of time resolution.
         # For a signal with a sample rate of 16,000 Hz, you could choose an FFT size that is a power of two and is equal to or greater than the length of your signal. A common choice for audio signals is 2048 or 4096 samples, which would correspond to a frequency resolution of approximately 8 or 4 Hz, respectively. However, you may need to experiment with different FFT sizes to determine the best choice for your particular application.
         # In addition to the FFT size, the choice of window function can also affect the quality of the spectral analysis. The Hann window used in the example I provided is a good default choice, but you may want to try other window functions such as the Blackman-Harris or Kaiser windows to see if they improve the accuracy of your analysis.
         self.fft_size = fft_size
-        self.window = torch.hann_window(fft_size, periodic=True).cuda()
+        self.register_buffer("window", torch.hann_window(fft_size, periodic=True), persistent=False)
+        self.target_cache = TargetCache() if cache_targets else None
+
+    def _fft(self, signal):
+        return fft.rfft(signal * self.window)
 
-    def forward(self, output, target):
+    def forward(self, output, target, sample_ids=None):
         # Compute FFT of output and target signals
-        output_fft = fft.rfft(output * self.window)
-        target_fft = fft.rfft(target * self.window)
+        output_fft = self._fft(output)
+        target_fft = _transform_targets(self.target_cache, sample_ids, target, self._fft)
 
         # Compute magnitude and phase of FFT coefficients
         output_mag, output_phase = torch.abs(output_fft), torch.angle(output_fft)
@@ -84,25 +129,28 @@ class FFTLoss(nn.Module):
 
 
 class MSE_AND_FFT_LOSS(nn.Module):
-    def __init__(self, fft_size=10240, lambd=1):
+    def __init__(self, fft_size=10240, lambd=1, cache_targets=False):
         super(MSE_AND_FFT_LOSS, self).__init__()
         self.mse_loss = nn.MSELoss()
-        self.fft_loss = FFTLoss(fft_size)
+        self.fft_loss = FFTLoss(fft_size, cache_targets=cache_targets)
         self.lambd = lambd
 
-    def forward(self, batch_inputs, batch_targets):
+    def forward(self, batch_inputs, batch_targets, sample_ids=None):
         assert batch_inputs.shape == batch_targets.shape
-        return self.mse_loss(batch_inputs, batch_targets) + (self.lambd * self.fft_loss(batch_inputs, batch_targets))
+        return self.mse_loss(batch_inputs, batch_targets) + (
+                self.lambd * self.fft_loss(batch_inputs, batch_targets, sample_ids))
 
 
 class MEL_LOSS(nn.Module):
     # https://pytorch.org/audio/main/tutorials/audio_feature_extractions_tutorial.html#melspectrogram
-    def __init__(self, n_fft=4096, sr=16000):
+    def __init__(self, n_fft=4096, sr=16000, cache_targets=False):
         super().__init__()
 
         hop_length = n_fft // 2
 
         self.criterion = nn.MSELoss()
+        self.target_cache = TargetCache() if cache_targets else None
+        # submodule, so its window and filterbank buffers follow the device of the loss
         self.compute_mel_spectr = T.MelSpectrogram(
             sample_rate=sr,
             n_fft=n_fft,
@@ -112,7 +160,7 @@ class MEL_LOSS(nn.Module):
             power=2.0,
             norm="slaney",
             mel_scale="htk",
-        ).cuda()
+        )
 
     def power_to_db(self, melspec):
         # todo: check if can just call librosa.power_to_db(melspec, ref=1.0, amin=1e-10, top_db=80.0)
@@ -126,31 +174,91 @@ class MEL_LOSS(nn.Module):
         log_spec -= 10.0 * torch.log10(torch.maximum(amin, ref_value))
         return log_spec
 
-    def forward(self, batch_inputs, batch_targets):
-        assert batch_inputs.shape == batch_targets.shape
-        inp_mel = self.compute_mel_spectr(batch_inputs)
-        tar_mel = self.compute_mel_spectr(batch_targets)
-
+    def _db_mel_spectrogram(self, batch):
         # to decibel scale
-        inp_mel = self.power_to_db(inp_mel)
-        tar_mel = self.power_to_db(tar_mel)
+        return self.power_to_db(self.compute_mel_spectr(batch))
+
+    def forward(self, batch_inputs, batch_targets, sample_ids=None):
+        assert batch_inputs.shape == batch_targets.shape
+        inp_mel = self._db_mel_spectrogram(batch_inputs)
+        tar_mel = _transform_targets(self.target_cache, sample_ids, batch_targets, self._db_mel_spectrogram)
         # tar_mel = 10 * torch.log10(tar_mel)
 
         return self.criterion(inp_mel, tar_mel)
 
 
 class MSE_AND_MEL_LOSS(nn.Module):
-    def __init__(self, lambd=1):
+    def __init__(self, lambd=1, cache_targets=False):
         super(MSE_AND_MEL_LOSS, self).__init__()
         self.mse_loss = nn.MSELoss()
-        self.mel_loss = MEL_LOSS()
+        self.mel_loss = MEL_LOSS(cache_targets=cache_targets)
         self.lambd = lambd
 
-    def forward(self, batch_inputs, batch_targets):
+    def forward(self, batch_inputs, batch_targets, sample_ids=None):
         assert batch_inputs.shape == batch_targets.shape
         mse = self.mse_loss(batch_inputs, batch_targets)
-        mel = self.mel_loss(batch_inputs, batch_targets)
+        mel = self.mel_loss(batch_inputs, batch_targets, sample_ids)
         return mse + (self.lambd * mel)
 
 
+class MultiResolutionSTFTLoss(nn.Module):
+    """
+    Spectral convergence + log magnitude loss, averaged over several STFT resolutions (as in Parallel WaveGAN).
+    Per resolution, inputs and targets are stacked in a single STFT call, and the magnitudes are shared by both
+    loss components. With `cache_targets`, only the inputs are transformed.
+    """
+
+    def __init__(self, fft_sizes=(512, 1024, 2048), hop_sizes=(128, 256, 512), cache_targets=False):
+        super().__init__()
+        assert len(fft_sizes) == len(hop_sizes)
+        self.fft_sizes = fft_sizes
+        self.hop_sizes = hop_sizes
+        for n_fft in fft_sizes:
+            self.register_buffer(f"window_{n_fft}", torch.hann_window(n_fft, periodic=True), persistent=False)
+        self.target_cache = TargetCache() if cache_targets else None
+
+    def _magnitudes(self, batch):
+        # batch: (batch_size, 1, length) -> list of (batch_size, n_fft // 2 + 1, nb_frames), one per resolution
+        batch = batch.squeeze(1)
+        return [torch.stft(batch, n_fft, hop_length=hop, window=getattr(self, f"window_{n_fft}"),
+                           return_complex=True).abs().clamp(min=1e-7)
+                for n_fft, hop in zip(self.fft_sizes, self.hop_sizes)]
+
+    def forward(self, batch_inputs, batch_targets, sample_ids=None):
+        assert batch_inputs.shape == batch_targets.shape
+        batch_size = batch_inputs.shape[0]
+
+        if self.target_cache is None or sample_ids is None:
+            mags = self._magnitudes(torch.cat([batch_inputs, batch_targets], dim=0))
+            input_mags = [mag[:batch_size] for mag in mags]
+            target_mags = [mag[batch_size:] for mag in mags]
+        else:
+            input_mags = self._magnitudes(batch_inputs)
+            # cache stores all resolutions of a sample as one flattened vector
+            flat_targets = self.target_cache.get(
+                sample_ids, batch_targets,
+                lambda targets: torch.cat([mag.flatten(1) for mag in self._magnitudes(targets)], dim=1))
+            sizes = [mag[0].numel() for mag in input_mags]
+            target_mags = [flat.reshape(mag.shape) for flat, mag in
+                           zip(torch.split(flat_targets, sizes, dim=1), input_mags)]
+
+        loss = 0
+        for input_mag, target_mag in zip(input_mags, target_mags):
+            spectral_convergence = torch.norm(target_mag - input_mag, p="fro") / torch.norm(target_mag, p="fro")
+            log_magnitude = F.l1_loss(torch.log(input_mag), torch.log(target_mag))
+            loss = loss + spectral_convergence + log_magnitude
+        return loss / len(self.fft_sizes)
+
+
+class MSE_AND_MR_STFT_LOSS(nn.Module):
+    def __init__(self, lambd=1, cache_targets=False):
+        super(MSE_AND_MR_STFT_LOSS, self).__init__()
+        self.mse_loss = nn.MSELoss()
+        self.mr_stft_loss = MultiResolutionSTFTLoss(cache_targets=cache_targets)
+        self.lambd = lambd
 
+    def forward(self, batch_inputs, batch_targets, sample_ids=None):
+        assert batch_inputs.shape == batch_targets.shape
+        mse = self.mse_loss(batch_inputs, batch_targets)
+        mr_stft = self.mr_stft_loss(batch_inputs, batch_targets, sample_ids)
+        return mse + (self.lambd * mr_stft)
@@ -3,7 +3,6 @@ import torch.nn as nn
 
 from config_code.architecture_config import DecoderArchitectureConfig
 from config_code.config_classes import OptionsConfig
-from options import get_options
 
 
 class Decoder(nn.Module):
@@ -34,6 +33,8 @@ class Decoder(nn.Module):
 
 
 if __name__ == "__main__":
+    from options import get_options  # parses sys.argv, so only when run as a script
+
     # de boer:
 
     x = torch.rand((64, 1, 10240))  # (b, c, t)
@@ -1,6 +1,7 @@
 """
-Legacy code to evaluate the decoder. This code is not used anymore, but kept for reference.
-Relevant parts were moved to `interpolation_contributions_score.py` and `callbacks.py`.
+Evaluates the decoder on the full test set: interpolations, masked and preserved dimensions are decoded as
+one batch (see `decoder.latent_manipulation`) and written to `{log_path}/latent_manipulations`.
+The contribution score lives in `interpolation_contribution_score.py` and `callbacks.py`.
 """
 
 # eg: for 512 dimensions
@@ -12,32 +13,29 @@ Relevant parts were moved to `interpolation_contributions_score.py` and `callbac
 # full_pipeline_bart_32_16/audio_FULL_PIPELINE_sim_de_boer_32dim_SIM=trueKLD=0.001
 # full_pipeline_bart_32_16/audio_FULL_PIPELINE_sim_de_boer_32dim_SIM=falseKLD=0
 
+import os
+
 import numpy as np
 import torch
 
-from config_code.config_classes import OptionsConfig
-from data import get_dataloader
+from arg_parser import arg_parser
+from config_code.config_classes import OptionsConfig, DecoderConfig
+from decoder.latent_cache import get_latent_cache
+from decoder.latent_manipulation import InterpolationSpec, MaskSpec, PreserveSpec, decode_specs
 from decoder.lit_decoder import LitDecoder
 from decoder.decoderr import Decoder
 from models import load_audio_model
-from utils.utils import set_seed
+from utils.utils import set_seed, get_audio_decoder_key
 import wandb
 
 
-def _get_data(opt: OptionsConfig, context_model: torch.nn.Module, decoder: Decoder):
-    print("Loading data... SHUFFLE IS OFF!")
-    _, _, test_loader, _ = get_dataloader.get_dataloader(opt.decoder_config.dataset, shuffle=False)
-
-    with torch.no_grad():
-        for batch in test_loader:
-            (x, filename, label, _) = batch
-            x = x.to(opt.device)
-            full_model = context_model.module
-            z = full_model.forward_through_all_cnn_modules(x)
-            z = z.detach()
-            x_reconstructed = decoder(z)
-            break
-    return x_reconstructed, x, z, filename
+def _get_data(opt: OptionsConfig, lit_decoder: LitDecoder):
+    # the full test set is encoded + decoded once and cached (see `decoder.latent_cache`)
+    cache = get_latent_cache()
+    entry = cache.get(opt, lit_decoder.encode, split="test")
+    decoder_key = cache.make_decoder_key(opt.decoder_config, opt.decoder_config.decoder_loss)
+    x_reconstructed = cache.get_reconstructions(entry, lit_decoder.decoder, decoder_key, opt.device)
+    return x_reconstructed, entry.x, entry.z, entry.filenames  # on cpu
 
 
 def _reconstruct_audio(z: torch.Tensor, decoder: Decoder):
@@ -46,9 +44,14 @@ def _reconstruct_audio(z: torch.Tensor, decoder: Decoder):
 
 
 def _get_models(opt: OptionsConfig):
+    decoder_config: DecoderConfig = opt.decoder_config
+
+    # same log path as in train_decoder.py, which is where the decoder checkpoint is stored
+    arg_parser.create_log_path(opt, get_audio_decoder_key(decoder_config, decoder_config.decoder_loss.value))
+
     context_model, _ = load_audio_model.load_model_and_optimizer(
         opt,
-        opt.decoder_config,
+        decoder_config,
         reload_model=True,
         calc_accuracy=False,
         num_GPU=1,
@@ -56,11 +59,14 @@ def _get_models(opt: OptionsConfig):
     context_model.eval()
     context_model = context_model.to(opt.device)
 
-    assert False, "load_decoder was updated, this code is outdated. See commit 20/06/2024. msg: 'train_decoder.py load in audio model if no training done'"
-    decoder: Decoder = load_audio_model.load_decoder(opt)
+    architecture = decoder_config.retrieve_correct_decoder_architecture()
+    decoder: Decoder = load_audio_model.load_decoder(opt, Decoder(architecture))
     decoder.eval()
     decoder = decoder.to(opt.device)
-    return context_model, decoder
+
+    lit_decoder = LitDecoder(decoder_config, context_model, decoder, decoder_config.learning_rate,
+                             decoder_config.decoder_loss)
+    return context_model, decoder, lit_decoder
 
 
 def _log_audio(key: str, audios: torch.Tensor, nb_files: int):
@@ -79,51 +85,6 @@ def _init_wandb(opt: OptionsConfig):
         wandb.config[key] = value
 
 
-def _interpolate(z1, z2, decoder, nb_interpolations):
-    vals = np.linspace(0, 1, nb_interpolations)
-    z_interpolated = torch.stack([z1 * val + z2 * (1 - val) for val in vals])
-    x_interpolated = _reconstruct_audio(z_interpolated, decoder)
-    return x_interpolated
-
-
-def interpolate(z, filename, decoder, nb_interpolations=10):
-    for x in range(20):
-        z_sample_1 = z[x]
-        z_sample_2 = z[x + 1]
-        x_interpolated = _interpolate(z_sample_1, z_sample_2, decoder, nb_interpolations)
-        _log_audio(f"{x} {filename[x]} to {filename[x + 1]}/interpolated", x_interpolated, nb_interpolations)
-
-
-def zero_z(decoder, shape, device):
-    z = torch.zeros(shape, device=device)
-    x = _reconstruct_audio(z, decoder)
-    _log_audio("zero_z", x, 10)
-
-
-def mask_indices(z, decoder, indices, filenames):
-    z_masked = z.clone()
-    z_masked = z_masked.to(z.device)
-    z_masked[:, indices, :] = 0
-    x_masked = _reconstruct_audio(z_masked, decoder)
-    for index in indices:
-        _log_audio(f"masked/indices_{indices}/{filenames[index]}", x_masked[index], 1)
-
-    return x_masked
-
-
-def mask_all_but_indices(z, decoder, indices, filenames):
-    z_masked = z.clone()
-    z_masked = z_masked.to(z.device)
-    z_masked[:, indices, :] = 0
-    z_masked = z_masked * 0.0
-    z_masked[:, indices, :] = z[:, indices, :]
-    x_masked = _reconstruct_audio(z_masked, decoder)
-    for index in indices:
-        _log_audio(f"preserved/indices_{indices}/{filenames[index]}", x_masked[index], 1)
-
-    return x_masked
-
-
 def log_z_vals(z, filenames, device):
     # log first 10 z's, and their respective filenames as a table
     z = z.to(device)
@@ -142,28 +103,39 @@ def main():
     set_seed(opt.seed)
     _init_wandb(opt)
 
-    context_model, decoder = _get_models(opt)
-
-    # Load the data
-    x_reconstructed, x, z, filename = _get_data(opt, context_model, decoder)
-    batch_size, dims, nb_frames = z.shape
-    np.save("z.npy", z.cpu().numpy())
-    np.save("filename.npy", filename)
+    context_model, decoder, lit_decoder = _get_models(opt)
 
-    x_randn = _reconstruct_audio(torch.randn_like(z), decoder)
-    x_zeros = _reconstruct_audio(torch.zeros_like(z), decoder)
+    # Load the data (full test set)
+    x_reconstructed, x, z, filename = _get_data(opt, lit_decoder)
+    nb_files, dims, nb_frames = z.shape
+    np.save(os.path.join(opt.log_path, "z.npy"), z.numpy())
+    np.save(os.path.join(opt.log_path, "filename.npy"), filename)
 
-    interpolate(z, filename, decoder)
-    zero_z(decoder, z.shape, opt.device)
+    with torch.no_grad():
+        x_randn = _reconstruct_audio(torch.randn_like(z[:10]).to(opt.device), decoder)
+        x_zeros = _reconstruct_audio(torch.zeros_like(z[:10]).to(opt.device), decoder)
 
+    # all manipulations are decoded as one batch and written to disk
     # 10 rnd indices between 0 and dims-1
     rnd_indices = np.random.choice(dims, 10, replace=False)
-    mask_indices(z, decoder, rnd_indices, filename)
-    mask_all_but_indices(z, decoder, rnd_indices, filename)
-
     important_indices = np.array([4, 9, 10, 13, 15, 21, 23, 25, 33]) - 2
-    mask_indices(z, decoder, important_indices, filename)
-    mask_all_but_indices(z, decoder, important_indices, filename)
+    nb_interpolations = 10
+    specs = [InterpolationSpec(i, i + 1, nb_interpolations) for i in range(nb_files - 1)]
+    specs += [MaskSpec(rnd_indices), PreserveSpec(rnd_indices),
+              MaskSpec(important_indices), PreserveSpec(important_indices)]
+    decoded, rows = decode_specs(specs, z, filename, decoder, opt.device, f"{opt.log_path}/latent_manipulations")
+
+    # log a few of the results to wandb
+    decoded = torch.from_numpy(np.asarray(decoded)).unsqueeze(1)  # (nb_rows, 1, nb_samples)
+    row = 0
+    for spec in specs:
+        nb_rows = nb_interpolations if isinstance(spec, InterpolationSpec) else nb_files
+        if isinstance(spec, InterpolationSpec) and spec.idx1 < 20:
+            _log_audio(f"{spec.idx1} {filename[spec.idx1]} to {filename[spec.idx2]}/interpolated",
+                       decoded[row: row + nb_rows], nb_interpolations)
+        elif not isinstance(spec, InterpolationSpec):
+            _log_audio(f"{spec.kind}/indices_{spec.dims.tolist()}", decoded[row: row + nb_rows], 10)
+        row += nb_rows
 
     # log_z_vals(z, filename, opt.device)
 
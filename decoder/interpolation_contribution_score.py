@@ -1,18 +1,21 @@
 from typing import Dict
 import numpy as np
 import torch
-from data import get_dataloader
 from config_code.config_classes import OptionsConfig
+from decoder.latent_cache import get_latent_cache
 from decoder.lit_decoder import LitDecoder
 
 
 class InterpolationContributionScore:
-    def __init__(self, opt: OptionsConfig, nb_dims: int, lit_decoder: LitDecoder):
+    NB_MOST_IMPORTANT_DIMS = [2, 4, 8, 16, 32, 64, 128, 256, 512]
+
+    def __init__(self, opt: OptionsConfig, nb_dims: int, lit_decoder: LitDecoder, pair_batch_size: int = 256):
         self.opt = opt
         self.nb_dims = nb_dims
         self.latent_nb_frames = (
             opt.decoder_config.retrieve_correct_decoder_architecture()).expected_nb_frames_latent_repr
         self.lit_decoder = lit_decoder
+        self.pair_batch_size = pair_batch_size  # nb of (i, j) file pairs that are decoded at once
 
     def _get_two_zs(self, z, filenames, idx1, idx2, print_names: bool = True) -> (np.ndarray, np.ndarray, str, str):
         assert idx1 != idx2
@@ -47,7 +50,8 @@ class InterpolationContributionScore:
         # z_interpolated = torch.from_numpy(z_interpolated).float().to(self.opt.device)
         # return z_interpolated
 
-    def _dist_after_interpol_important_dims(self, z1, z2, nb_dims_important_dims, max_err: bool = False):
+    def _dist_after_interpol_important_dims(self, z1, z2, nb_dims_important_dims, max_err: bool = False,
+                                            x2_target=None):
         assert nb_dims_important_dims <= self.nb_dims
 
         z_1_single_timeframe = z1.mean(axis=2)  # (1, 32)
@@ -67,7 +71,9 @@ class InterpolationContributionScore:
 
         x2_partial = self.lit_decoder.decoder(z2_partial).squeeze()
         # z2 = torch.from_numpy(z2).float().to(self.opt.device)  # to tensor
-        x2_target = self.lit_decoder.decoder(z2).squeeze()
+        if x2_target is None:
+            x2_target = self.lit_decoder.decoder(z2)
+        x2_target = x2_target.squeeze()
 
         # MSE
         dist = torch.mean((x2_partial - x2_target) ** 2)
@@ -78,68 +84,78 @@ class InterpolationContributionScore:
         return dist
 
     def _get_all_data(self, opt: OptionsConfig, lit_decoder: LitDecoder):
-        print("Loading data... SHUFFLE IS OFF!")
-        _, _, test_loader, _ = get_dataloader.get_dataloader(opt.decoder_config.dataset, shuffle=False)
-
-        all_x_reconstructed = []
-        all_x = []
-        all_z = []
-        all_filename = []
-
-        with torch.no_grad():
-            for batch in test_loader:
-                (x, filename, label, _) = batch
-                x = x.to(opt.device)
-                z = lit_decoder.encode(x)
-                x_reconstructed = lit_decoder.decoder(z)
-
-                all_x_reconstructed.append(x_reconstructed)
-                all_x.append(x)
-                all_z.append(z)
-                all_filename.append(filename)
-
-        return (torch.cat(all_x_reconstructed),
-                torch.cat(all_x),
-                torch.cat(all_z),
-                np.concatenate(all_filename))
+        # encoded + decoded once per (checkpoint, split), shared with the other decoder analyses
+        cache = get_latent_cache()
+        entry = cache.get(opt, lit_decoder.encode, split="test")
+        decoder_key = cache.make_decoder_key(opt.decoder_config, lit_decoder.loss_enum)
+        x_reconstructed = cache.get_reconstructions(entry, lit_decoder.decoder, decoder_key, opt.device)
+
+        return (x_reconstructed.to(opt.device),
+                entry.x.to(opt.device),
+                entry.z.to(opt.device),
+                entry.filenames)
+
+    def _decode(self, z: torch.Tensor) -> torch.Tensor:
+        # z: (b, nb_dims, nb_frames) -> (b, nb_samples), decoded in chunks of `pair_batch_size`
+        chunks = torch.split(z, self.pair_batch_size)
+        return torch.cat([self.lit_decoder.decoder(chunk).reshape(chunk.shape[0], -1) for chunk in chunks])
+
+    @staticmethod
+    def _pair_indices(start: int, end: int, nb_files: int, device) -> (torch.Tensor, torch.Tensor):
+        """Pairs start..end of all (i, j) pairs with i != j, in the same order as the double loop over i and j."""
+        p = torch.arange(start, end, device=device)
+        i = torch.div(p, nb_files - 1, rounding_mode='floor')
+        j = p % (nb_files - 1)
+        j = j + (j >= i).long()  # skip the diagonal
+        return i, j
 
     def compute_score(self) -> (Dict[int, float], Dict[int, float]):
+        """
+        For every pair of files (z1, z2), the top-k dimensions of z1 that differ most from z2 (on average over
+        time) are replaced by those of z2, and the decoded result is compared against decode(z2). Per pair batch the dims are ranked with a single argsort, which is reused for all k,
+        and decode(z2) is computed only once per file.
+        """
         self.lit_decoder = self.lit_decoder.to(self.opt.device)
         self.lit_decoder.eval()
 
-        _, _, z, filenames = self._get_all_data(self.opt, self.lit_decoder)  # z is a tensor
+        # z: (nb_files, nb_dims, nb_frames)
+        x_reconstructed, _, z, filenames = self._get_all_data(self.opt, self.lit_decoder)
         nb_files = len(filenames)
+        nb_pairs = nb_files * (nb_files - 1)
+
+        with torch.no_grad():
+            x_target = x_reconstructed.reshape(nb_files, -1).double()  # decode(z2) for every file
+            nb_samples = x_target.shape[1]
+
+            # max error: mean over pairs of mse(decode(z1), decode(z2)), no extra decoding needed
+            # sum_{i != j} ||a_i - a_j||^2 = 2 * N * sum_i ||a_i||^2 - 2 * ||sum_i a_i||^2
+            max_error = (2 * nb_files * (x_target ** 2).sum() - 2 * (x_target.sum(dim=0) ** 2).sum())
+            max_error = max_error / (nb_samples * nb_pairs)
+            print(f"Max error: {max_error}")
+
+            z_single_timeframe = z.mean(dim=2)  # (nb_files, nb_dims)
+            errors = {k: torch.tensor(0.0, dtype=torch.float64, device=self.opt.device)
+                      for k in self.NB_MOST_IMPORTANT_DIMS}
 
-        # calc max error
-        max_error = torch.tensor(0.0, device=self.opt.device)
-        for i in range(nb_files):
-            for j in range(nb_files):
-                if i != j:
-                    z1, z2, z1_file, z2_file = self._get_two_zs(z, filenames, idx1=i, idx2=j, print_names=False)
-                    dist = self._dist_after_interpol_important_dims(z1, z2, 512, max_err=True)
-                    max_error += dist
+            for start in range(0, nb_pairs, self.pair_batch_size):
+                i, j = self._pair_indices(start, min(start + self.pair_batch_size, nb_pairs), nb_files, z.device)
 
-        max_error /= (nb_files * (nb_files - 1))
-        print(f"Max error: {max_error}")
+                mse = (z_single_timeframe[i] - z_single_timeframe[j]) ** 2  # (b, nb_dims)
+                order = torch.argsort(mse, dim=1, descending=True)
+                rank = torch.argsort(order, dim=1)  # rank[p, d] = position of dim d in the descending order
+
+                for k in self.NB_MOST_IMPORTANT_DIMS:
+                    assert k <= self.nb_dims
+                    mask = (rank < k).unsqueeze(2)  # (b, nb_dims, 1)
+                    z_partial = torch.where(mask, z[j], z[i])
+                    x_partial = self._decode(z_partial).double()
+                    errors[k] += ((x_partial - x_target[j]) ** 2).mean(dim=1).sum()
 
         results_relative: Dict[int, float] = {}
         results_absolute: Dict[int, float] = {}
-        for nb_most_important_dims in [2, 4, 8, 16, 32, 64, 128, 256, 512]:
-            avg_error = torch.tensor(0.0, device=self.opt.device)
-            print(f"nb_most_important_dims: {nb_most_important_dims}")
-            for i in range(nb_files):
-                for j in range(nb_files):
-                    if i != j:
-                        z1, z2, z1_file, z2_file = self._get_two_zs(z, filenames, idx1=i, idx2=j, print_names=False)
-                        dist = self._dist_after_interpol_important_dims(z1, z2, nb_most_important_dims)
-                        avg_error += dist
-
-            avg_error /= (nb_files * (nb_files - 1))
-            # print(f"Unscaled average error for dim {nb_most_important_dims}: {avg_error}")
-            # print(f"Scaled average error for dim {nb_most_important_dims}: {avg_error / max_error}")
-            normalized_avg_error = avg_error / max_error
-
+        for nb_most_important_dims, error in errors.items():
+            avg_error = error / nb_pairs
             results_absolute[nb_most_important_dims] = avg_error.item()
-            results_relative[nb_most_important_dims] = normalized_avg_error.item()
+            results_relative[nb_most_important_dims] = (avg_error / max_error).item()
 
         return results_absolute, results_relative
@@ -0,0 +1,107 @@
+"""
+In-memory cache of encoder latents and decoder reconstructions, such that the decoder analyses (interpolation,
+masking, z values, contribution score) don't each re-encode the full test set.
+
+Entries are keyed by (encoder checkpoint, split, representation) and stored on the cpu. Reconstructions are stored
+per decoder inside an entry, as they also depend on the decoder weights. When the total size exceeds `max_bytes`,
+the least recently used entries are evicted.
+"""
+
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import torch
+
+from config_code.config_classes import OptionsConfig, DecoderConfig, DecoderLoss
+from data import get_dataloader
+from utils.utils import get_audio_decoder_key
+
+
+class LatentCacheEntry:
+    def __init__(self, x: torch.Tensor, z: torch.Tensor, filenames: np.ndarray, labels: np.ndarray):
+        self.x = x  # (nb_files, 1, nb_samples)
+        self.z = z  # (nb_files, nb_dims, nb_frames)
+        self.filenames = filenames  # (nb_files,)
+        self.labels = labels  # (nb_files,)
+        self.reconstructions: Dict[str, torch.Tensor] = {}  # decoder key -> (nb_files, 1, nb_samples)
+
+    def nbytes(self) -> int:
+        tensors = [self.x, self.z] + list(self.reconstructions.values())
+        return sum(t.element_size() * t.nelement() for t in tensors)
+
+
+class LatentCache:
+    def __init__(self, max_bytes: int = 4 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, LatentCacheEntry]" = OrderedDict()
+
+    @staticmethod
+    def make_key(opt: OptionsConfig, split: str = "test", representation: Optional[str] = None) -> tuple:
+        # representation: which encoder output is cached, defaults to the module/layer of the decoder config
+        decoder_config = opt.decoder_config
+        if representation is None:
+            representation = f"modul={decoder_config.encoder_module} layer={decoder_config.encoder_layer}"
+        return opt.model_path, decoder_config.encoder_num, split, representation
+
+    @staticmethod
+    def make_decoder_key(decoder_config: DecoderConfig, loss) -> str:
+        """Key of the reconstructions of a decoder. `loss`: DecoderLoss or its int value, both give the same key."""
+        return get_audio_decoder_key(decoder_config, DecoderLoss(loss).value)
+
+    def _evict(self):
+        total = sum(entry.nbytes() for entry in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:  # always keep the most recent entry
+            key, entry = self._entries.popitem(last=False)
+            total -= entry.nbytes()
+            print(f"LatentCache: evicted {key}")
+
+    def get(self, opt: OptionsConfig, encode_fn: Callable[[torch.Tensor], torch.Tensor], split: str = "test",
+            representation: Optional[str] = None) -> LatentCacheEntry:
+        """Returns the latents of the full split (shuffle off), encoding them with `encode_fn` on a cache miss."""
+        key = self.make_key(opt, split, representation)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        print("Loading data... SHUFFLE IS OFF!")
+        train_loader, _, test_loader, _ = get_dataloader.get_dataloader(opt.decoder_config.dataset, shuffle=False)
+        loader = train_loader if split == "train" else test_loader
+
+        all_x, all_z, all_filenames, all_labels = [], [], [], []
+        with torch.no_grad():
+            for (x, filename, label, _) in loader:
+                all_z.append(encode_fn(x.to(opt.device)).detach().cpu())
+                all_x.append(x.cpu())
+                all_filenames.append(np.asarray(filename))
+                all_labels.append(np.asarray(label))
+
+        entry = LatentCacheEntry(torch.cat(all_x), torch.cat(all_z),
+                                 np.concatenate(all_filenames), np.concatenate(all_labels))
+        self._entries[key] = entry
+        self._evict()
+        return entry
+
+    def get_reconstructions(self, entry: LatentCacheEntry, decoder: torch.nn.Module, decoder_key: str,
+                            device, batch_size: int = 64) -> torch.Tensor:
+        """Decodes all latents of `entry` once per `decoder_key`. Returned tensor is on the cpu."""
+        if decoder_key not in entry.reconstructions:
+            with torch.no_grad():
+                entry.reconstructions[decoder_key] = torch.cat(
+                    [decoder(z.to(device)).cpu() for z in torch.split(entry.z, batch_size)])
+            self._evict()
+        return entry.reconstructions[decoder_key]
+
+    def invalidate(self, opt: OptionsConfig, split: str = "test", representation: Optional[str] = None):
+        self._entries.pop(self.make_key(opt, split, representation), None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# shared by all analyses within the same process
+_latent_cache = LatentCache()
+
+
+def get_latent_cache() -> LatentCache:
+    return _latent_cache
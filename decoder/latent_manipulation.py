@@ -0,0 +1,125 @@
+"""
+Batched latent manipulations for the decoder analyses (interpolation, masking, preserving dimensions).
+
+A list of specs is turned into one stacked latent batch, which is decoded in memory-bounded chunks. The results are
+written in bulk: a single `decoded.npy` (nb_rows, nb_samples) and a `manifest.csv` that describes every row.
+
+Example:
+    specs = [InterpolationSpec(0, 1, nb_interpolations=10), MaskSpec(dims=[2, 7]), PreserveSpec(dims=[2, 7])]
+    decode_specs(specs, z, filenames, decoder, device, out_dir)
+"""
+
+import csv
+import os
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+
+class ManipulationSpec:
+    kind = "base"
+
+    def build(self, z: torch.Tensor, filenames) -> (torch.Tensor, List[dict]):
+        """:return: latents (n, nb_dims, nb_frames) and one description per latent"""
+        raise NotImplementedError
+
+
+class InterpolationSpec(ManipulationSpec):
+    """z1 * val + z2 * (1 - val) for `nb_interpolations` values of val between 0 and 1 (same as `_interpolate`)."""
+    kind = "interpolation"
+
+    def __init__(self, idx1: int, idx2: int, nb_interpolations: int = 10):
+        self.idx1 = idx1
+        self.idx2 = idx2
+        self.nb_interpolations = nb_interpolations
+
+    def build(self, z, filenames):
+        vals = torch.linspace(0, 1, self.nb_interpolations, dtype=z.dtype).reshape(-1, 1, 1)
+        latents = z[self.idx1].unsqueeze(0) * vals + z[self.idx2].unsqueeze(0) * (1 - vals)
+        rows = [{"kind": self.kind, "file": filenames[self.idx1], "file2": filenames[self.idx2],
+                 "val": float(val), "dims": ""} for val in vals.flatten()]
+        return latents, rows
+
+
+class _DimsSpec(ManipulationSpec):
+    def __init__(self, dims, file_indices: Optional[List[int]] = None):
+        self.dims = torch.as_tensor(np.asarray(dims), dtype=torch.long)
+        self.file_indices = file_indices  # None: all files
+
+    def _select(self, z, filenames):
+        indices = range(z.shape[0]) if self.file_indices is None else self.file_indices
+        indices = torch.as_tensor(list(indices), dtype=torch.long)
+        return z[indices], [filenames[i] for i in indices.tolist()]
+
+    def _rows(self, files):
+        dims = " ".join(str(d) for d in self.dims.tolist())
+        return [{"kind": self.kind, "file": file, "file2": "", "val": "", "dims": dims} for file in files]
+
+
+class MaskSpec(_DimsSpec):
+    """Sets `dims` to zero (same as `mask_indices`)."""
+    kind = "masked"
+
+    def build(self, z, filenames):
+        latents, files = self._select(z, filenames)
+        latents = latents.clone()
+        latents[:, self.dims, :] = 0
+        return latents, self._rows(files)
+
+
+class PreserveSpec(_DimsSpec):
+    """Sets all dims except `dims` to zero (same as `mask_all_but_indices`)."""
+    kind = "preserved"
+
+    def build(self, z, filenames):
+        selected, files = self._select(z, filenames)
+        latents = torch.zeros_like(selected)
+        latents[:, self.dims, :] = selected[:, self.dims, :]
+        return latents, self._rows(files)
+
+
+def build_batch(specs: List[ManipulationSpec], z: torch.Tensor, filenames) -> (torch.Tensor, List[dict]):
+    """Stacks the latents of all specs: (nb_rows, nb_dims, nb_frames), on the device of z."""
+    latents, rows = [], []
+    for spec in specs:
+        spec_latents, spec_rows = spec.build(z, filenames)
+        latents.append(spec_latents)
+        rows.extend(spec_rows)
+    return torch.cat(latents), rows
+
+
+def decode_specs(specs: List[ManipulationSpec], z: torch.Tensor, filenames, decoder: torch.nn.Module, device,
+                 out_dir: str, memory_budget_mb: float = 512) -> (np.ndarray, List[dict]):
+    """
+    Decodes all manipulations and writes them to `out_dir/decoded.npy` + `out_dir/manifest.csv`.
+    The chunk size is chosen such that the latents and decoded audio of one chunk fit in `memory_budget_mb`.
+    :param z: (nb_files, nb_dims, nb_frames), kept on the cpu
+    :return: memory-mapped decoded audio (nb_rows, nb_samples) and the row descriptions
+    """
+    z = z.cpu()
+    latents, rows = build_batch(specs, z, filenames)
+    nb_rows = latents.shape[0]
+
+    os.makedirs(out_dir, exist_ok=True)
+    decoder.eval()
+    with torch.no_grad():
+        first = decoder(latents[:1].to(device)).reshape(1, -1)  # to know the output size
+        bytes_per_row = latents[0].nelement() * latents.element_size() + first.nelement() * first.element_size()
+        chunk_size = int(max(1, memory_budget_mb * 1024 ** 2 // bytes_per_row))
+
+        decoded = np.lib.format.open_memmap(os.path.join(out_dir, "decoded.npy"), mode="w+", dtype=np.float32,
+                                            shape=(nb_rows, first.shape[1]))
+        for start in range(0, nb_rows, chunk_size):
+            chunk = latents[start: start + chunk_size].to(device)
+            decoded[start: start + chunk.shape[0]] = decoder(chunk).reshape(chunk.shape[0], -1).cpu().numpy()
+        decoded.flush()
+
+    with open(os.path.join(out_dir, "manifest.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["row", "kind", "file", "file2", "val", "dims"])
+        writer.writeheader()
+        for idx, row in enumerate(rows):
+            writer.writerow({"row": idx, **row})
+
+    print(f"Decoded {nb_rows} manipulated latents to {out_dir}")
+    return decoded, rows
@@ -4,24 +4,30 @@ from torch import optim
 
 from config_code.config_classes import DecoderLoss, DecoderConfig
 from decoder.decoder_losses import MSE_Loss, SpectralLoss, MSE_AND_SPECTRAL_LOSS, FFTLoss, MSE_AND_FFT_LOSS, MEL_LOSS, \
-    MSE_AND_MEL_LOSS, MEL_LOSS
+    MSE_AND_MEL_LOSS, MEL_LOSS, MSE_AND_MR_STFT_LOSS
 from decoder.decoderr import Decoder
 from models.full_model import FullModel
 from utils.utils import get_audio_decoder_key
 
 
 class LitDecoder(L.LightningModule):
-    def __init__(self, opt: DecoderConfig, encoder, decoder: Decoder, lr: float, loss: DecoderLoss):
+    def __init__(self, opt: DecoderConfig, encoder, decoder: Decoder, lr: float, loss: DecoderLoss,
+                 precomputed_latents: bool = False):
         super().__init__()
         encoder.eval()
+        # frozen: no gradients are computed for the encoder (also required by ddp, which expects all params to be used)
+        for param in encoder.parameters():
+            param.requires_grad = False
         self.dec_opt: DecoderConfig = opt
         self.encoder = encoder
 
         self.decoder = decoder
         self.lr = lr
         self.loss_enum = loss
-        self.loss = self._get_loss_from_enum(loss)
+        self.loss = self._get_loss_from_enum(loss, cache_targets=opt.cache_target_spectrograms)
         self.test_losses = []
+        # if True, batches come from `LatentDataModule` and contain z, so the encoder is not run
+        self.precomputed_latents = precomputed_latents
 
         self.save_hyperparameters(ignore=["decoder", "encoder", "opt"])
 
@@ -49,12 +55,21 @@ class LitDecoder(L.LightningModule):
 
         return z.detach()
 
+    def _unpack(self, batch, stage: str):
+        if self.precomputed_latents:
+            (x, filenames, label, z) = batch  # z was computed by `encode` in advance
+        else:
+            (x, filenames, label, _) = batch
+            z = self.encode(x)
+        # unique per split, used by the losses to cache target spectrograms (val and test share the test set)
+        sample_ids = [f"{stage}/{filename}" for filename in filenames]
+        return x, z, sample_ids
+
     def training_step(self, batch, batch_idx):
-        (x, _, label, _) = batch  # x.shape: (200, 1, 64, 64), y.shape: (200, 1, 6)
-        z = self.encode(x)
-        x_reconstructed = self.decoder(z)
+        x, z, sample_ids = self._unpack(batch, "train")  # x.shape: (200, 1, 64, 64), y.shape: (200, 1, 6)
+        x_reconstructed = self.decoder(z).float()  # losses (stft, mel) in float32, also with bf16 autocast
 
-        loss = self.loss(x_reconstructed, x)
+        loss = self.loss(x_reconstructed, x, sample_ids)
 
         section = get_audio_decoder_key(self.dec_opt, self.loss_enum)
         self.log(f"{section}/train_loss", loss, batch_size=x.size(0))
@@ -62,25 +77,23 @@ class LitDecoder(L.LightningModule):
 
     # validation step
     def validation_step(self, batch, batch_idx):
-        (x, _, label, _) = batch
-        z = self.encode(x)
+        x, z, sample_ids = self._unpack(batch, "test")
 
-        x_reconstructed = self.decoder(z)
-        loss = self.loss(x_reconstructed, x)
+        x_reconstructed = self.decoder(z).float()
+        loss = self.loss(x_reconstructed, x, sample_ids)
         section = get_audio_decoder_key(self.dec_opt, self.loss_enum)
         self.log(f"{section}/val_loss", loss, batch_size=x.size(0))
         return loss
 
     def configure_optimizers(self):
-        optimizer = optim.Adam(self.parameters(), lr=self.lr)
+        optimizer = optim.Adam(self.decoder.parameters(), lr=self.lr)
         return optimizer
 
     def test_step(self, batch, batch_idx):
-        (x, _, label, _) = batch
-        z = self.encode(x)
-        x_reconstructed = self.decoder(z)
+        x, z, sample_ids = self._unpack(batch, "test")
+        x_reconstructed = self.decoder(z).float()
 
-        loss = self.loss(x_reconstructed, x)
+        loss = self.loss(x_reconstructed, x, sample_ids)
         self.test_losses.append(loss)
         return {"test_loss": loss}
 
@@ -91,21 +104,23 @@ class LitDecoder(L.LightningModule):
         self.test_losses = []  # reset for the next epoch
 
     @staticmethod
-    def _get_loss_from_enum(loss_enum: DecoderLoss):
+    def _get_loss_from_enum(loss_enum: DecoderLoss, cache_targets: bool = False):
         if loss_enum == DecoderLoss.MSE:
             return MSE_Loss()
         elif loss_enum == DecoderLoss.SPECTRAL:
-            return SpectralLoss()
+            return SpectralLoss(cache_targets=cache_targets)
         elif loss_enum == DecoderLoss.MSE_SPECTRAL:
-            return MSE_AND_SPECTRAL_LOSS()
+            return MSE_AND_SPECTRAL_LOSS(cache_targets=cache_targets)
         elif loss_enum == DecoderLoss.FFT:
-            return FFTLoss()
+            return FFTLoss(cache_targets=cache_targets)
         elif loss_enum == DecoderLoss.MSE_FFT:
-            return MSE_AND_FFT_LOSS()
+            return MSE_AND_FFT_LOSS(cache_targets=cache_targets)
         elif loss_enum == DecoderLoss.MEL:
-            return MEL_LOSS()
+            return MEL_LOSS(cache_targets=cache_targets)
         elif loss_enum == DecoderLoss.MSE_MEL:
-            return MSE_AND_MEL_LOSS()
+            return MSE_AND_MEL_LOSS(cache_targets=cache_targets)
+        elif loss_enum == DecoderLoss.MSE_MR_STFT:
+            return MSE_AND_MR_STFT_LOSS(cache_targets=cache_targets)
         else:
             raise ValueError(f"Loss enum {loss_enum} not supported")
 
@@ -1,4 +1,15 @@
+import json
+import os
+from typing import Callable, Optional
+
 import lightning as L
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+from config_code.config_classes import OptionsConfig, DecoderConfig
+from data import get_dataloader
+from utils.streaming_accumulator import StreamingAccumulator
 
 
 class MyDataModule(L.LightningDataModule):
@@ -15,4 +26,107 @@ class MyDataModule(L.LightningDataModule):
         return self.val_loader
 
     def test_dataloader(self):
-        return self.test_loader
\ No newline at end of file
+        return self.test_loader
+
+
+class LatentDataset(Dataset):
+    """
+    Precomputed (z, x) pairs of the frozen encoder, stored as memory-mapped .npy files.
+    Items are (x, filename, label, z), same as the De Boer dataset but with z instead of the full word.
+    """
+
+    def __init__(self, store_dir: str, split: str):
+        with open(os.path.join(store_dir, f"{split}.done"), "r") as f:
+            nb_files = json.load(f)["nb_files"]
+        self.x = np.load(os.path.join(store_dir, f"{split}_x.npy"), mmap_mode="r")[:nb_files]
+        self.z = np.load(os.path.join(store_dir, f"{split}_z.npy"), mmap_mode="r")[:nb_files]
+        self.filenames = np.load(os.path.join(store_dir, f"{split}_filenames.npy"))
+        self.labels = np.load(os.path.join(store_dir, f"{split}_labels.npy"))
+
+    def __getitem__(self, index):
+        x = torch.from_numpy(np.array(self.x[index]))
+        z = torch.from_numpy(np.array(self.z[index]))
+        return x, str(self.filenames[index]), int(self.labels[index]), z
+
+    def __len__(self):
+        return self.z.shape[0]
+
+
+def get_latent_store_dir(opt: OptionsConfig) -> str:
+    decoder_config: DecoderConfig = opt.decoder_config
+    return os.path.join(opt.model_path, "latent_store",
+                        f"modul={decoder_config.encoder_module} layer={decoder_config.encoder_layer} "
+                        f"encoder_num={decoder_config.encoder_num}")
+
+
+def materialize_latents(encode_fn: Callable[[torch.Tensor], torch.Tensor], dataset, store_dir: str, split: str,
+                        batch_size: int, num_workers: int, device):
+    """Encodes every file of `dataset` once and writes (z, x) to memory-mapped files. Skipped if already done."""
+    done_path = os.path.join(store_dir, f"{split}.done")
+    if os.path.exists(done_path):
+        print(f"Using precomputed latents from {store_dir} ({split})")
+        return
+
+    print(f"Precomputing latents for {split} set to {store_dir}")
+    os.makedirs(store_dir, exist_ok=True)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, drop_last=False, num_workers=num_workers)
+
+    z_acc = StreamingAccumulator(len(dataset), memmap_path=os.path.join(store_dir, f"{split}_z.npy"))
+    x_acc = StreamingAccumulator(len(dataset), memmap_path=os.path.join(store_dir, f"{split}_x.npy"))
+    with torch.no_grad():
+        for (x, filename, label, _) in loader:
+            z_acc.append(encode_fn(x.to(device)).cpu().numpy(), np.asarray(filename))
+            x_acc.append(x.numpy(), np.asarray(label))
+
+    _, filenames = z_acc.result()
+    _, labels = x_acc.result()
+    np.save(os.path.join(store_dir, f"{split}_filenames.npy"), filenames)
+    np.save(os.path.join(store_dir, f"{split}_labels.npy"), labels)
+
+    # only written once everything is on disk, an interrupted run is redone from scratch
+    with open(done_path, "w") as f:
+        json.dump({"nb_files": len(z_acc)}, f)
+
+
+class LatentDataModule(L.LightningDataModule):
+    """
+    Serves precomputed latents, such that the Lightning loop only has to run the decoder.
+    The latents are computed in `prepare_data`, which Lightning runs on global rank 0 only, followed by a barrier.
+    `setup` then opens the store on every rank (ddp).
+    """
+
+    def __init__(self, opt: OptionsConfig, encode_fn: Callable[[torch.Tensor], torch.Tensor]):
+        super().__init__()
+        self.prepare_data_per_node = False  # the store is in model_path, shared by all nodes
+        self.opt = opt
+        self.encode_fn = encode_fn
+        self.store_dir = get_latent_store_dir(opt)
+
+        dataset_config = opt.decoder_config.dataset
+        self.batch_size = dataset_config.batch_size_multiGPU
+        self.num_workers = dataset_config.num_workers
+        self.train_dataset: Optional[LatentDataset] = None
+        self.test_dataset: Optional[LatentDataset] = None
+
+    def prepare_data(self):
+        dataset_config = self.opt.decoder_config.dataset
+        _, train_dataset, _, test_dataset = get_dataloader.get_dataloader(dataset_config)
+        for split, dataset in [("train", train_dataset), ("test", test_dataset)]:
+            materialize_latents(self.encode_fn, dataset, self.store_dir, split, dataset_config.batch_size,
+                                dataset_config.num_workers, self.opt.device)
+
+    def setup(self, stage: str):
+        if self.train_dataset is None:  # also called for `trainer.test` after `trainer.fit`
+            self.train_dataset = LatentDataset(self.store_dir, "train")
+            self.test_dataset = LatentDataset(self.store_dir, "test")
+
+    def train_dataloader(self):
+        return DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True, drop_last=True,
+                          num_workers=self.num_workers)
+
+    def val_dataloader(self):
+        return DataLoader(self.test_dataset, batch_size=self.batch_size, shuffle=False, drop_last=True,
+                          num_workers=self.num_workers)
+
+    def test_dataloader(self):
+        return self.val_dataloader()
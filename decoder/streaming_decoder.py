@@ -0,0 +1,112 @@
+"""
+Chunked / streaming decoding of long latent sequences with the transposed-conv `Decoder`.
+
+The decoder only has a local receptive field: an output sample depends on a bounded range of latent frames (the
+ReLUs are pointwise, so they don't widen it). A latent sequence can therefore be decoded in windows of frames with a
+halo of extra frames on both sides. Only the part of each window's output whose full receptive field lies inside the
+window is kept (overlap-save), which makes the stitched result identical to decoding the whole sequence at once.
+
+With the composite stride S = s1 * ... * sL, kernel K = (k1 - 1) * s2 * ... * sL + ... + kL and
+padding P = p1 * s2 * ... * sL + ... + pL, an output sample t depends on the frames n with t + P - K < n * S <= t + P.
+A halo of ceil(K / S) + 1 frames on both sides is thus always enough.
+
+Example:
+    streaming = StreamingDecoder(decoder, chunk_frames=256)
+    audio = streaming.decode(z)  # z: (b, c, nb_frames) of any length
+
+    for z_chunk in stream:  # or, when the latents arrive in chunks
+        play(streaming.feed(z_chunk))
+    play(streaming.flush())
+"""
+
+import math
+
+import torch
+import torch.nn as nn
+
+from decoder.decoderr import Decoder
+
+
+def _transposed_convs(decoder: Decoder):
+    return [layer for layer in decoder.decoder if isinstance(layer, nn.ConvTranspose1d)]
+
+
+def receptive_field(decoder: Decoder) -> (int, int, int):
+    """:return: composite stride S, kernel size K and padding P of the stack of transposed convolutions"""
+    stride, kernel, padding = 1, 1, 0
+    for conv in _transposed_convs(decoder):
+        s, k, p = conv.stride[0], conv.kernel_size[0], conv.padding[0]
+        assert conv.dilation[0] == 1, "dilated transposed convolutions are not supported"
+        kernel = (kernel - 1) * s + k
+        padding = padding * s + p
+        stride = stride * s
+    return stride, kernel, padding
+
+
+def output_length(decoder: Decoder, nb_frames: int) -> int:
+    length = nb_frames
+    for conv in _transposed_convs(decoder):
+        length = (length - 1) * conv.stride[0] - 2 * conv.padding[0] + conv.kernel_size[0] + conv.output_padding[0]
+    return length
+
+
+class StreamingDecoder:
+    def __init__(self, decoder: Decoder, chunk_frames: int = 256):
+        self.decoder = decoder
+        self.chunk_frames = chunk_frames
+        self.stride, self.kernel, self.padding = receptive_field(decoder)
+        self.halo = math.ceil(self.kernel / self.stride) + 1  # in latent frames, on both sides
+        self.reset()
+
+    def reset(self):
+        self._buffer = None  # (b, c, frames) latent frames that may still be needed
+        self._buffer_start = 0  # global index of the first frame in the buffer
+        self._nb_frames = 0  # total nb of frames fed so far
+        self._emitted = 0  # frames whose output samples were already returned
+
+    def _decode_window(self, first_owned: int, last_owned: int, final: bool) -> torch.Tensor:
+        # decodes the buffered frames and returns the output samples owned by frames [first_owned, last_owned)
+        # the output of a window that starts at global frame w0 starts at global sample w0 * S
+        local = self.decoder(self._buffer)
+        start = (first_owned - self._buffer_start) * self.stride
+        end = local.shape[-1] if final else (last_owned - self._buffer_start) * self.stride
+        return local[..., start:end]
+
+    def feed(self, z_chunk: torch.Tensor) -> torch.Tensor:
+        """
+        :param z_chunk: (b, c, nb_frames) next latent frames
+        :return: (b, out_c, nb_samples) the output samples that are final, may be empty
+        """
+        self._buffer = z_chunk if self._buffer is None else torch.cat([self._buffer, z_chunk], dim=-1)
+        self._nb_frames += z_chunk.shape[-1]
+
+        last_owned = self._nb_frames - self.halo  # frames after this don't have their right halo yet
+        if last_owned <= self._emitted:
+            return self._buffer.new_zeros(self._buffer.shape[0], self._out_channels(), 0)
+
+        out = self._decode_window(self._emitted, last_owned, final=False)
+        self._emitted = last_owned
+
+        # drop frames that are no longer in the left halo of future windows
+        keep_from = max(0, self._emitted - self.halo)
+        self._buffer = self._buffer[..., keep_from - self._buffer_start:]
+        self._buffer_start = keep_from
+        return out
+
+    def flush(self) -> torch.Tensor:
+        """Returns the remaining output samples (up to the end of the sequence) and resets the stream."""
+        assert self._buffer is not None, "Nothing was fed"
+        out = self._decode_window(self._emitted, self._nb_frames, final=True)
+        self.reset()
+        return out
+
+    def decode(self, z: torch.Tensor) -> torch.Tensor:
+        """Decodes a full latent sequence (b, c, nb_frames) in chunks of `chunk_frames` frames."""
+        self.reset()
+        outputs = [self.feed(z[..., start: start + self.chunk_frames])
+                   for start in range(0, z.shape[-1], self.chunk_frames)]
+        outputs.append(self.flush())
+        return torch.cat(outputs, dim=-1)
+
+    def _out_channels(self) -> int:
+        return _transposed_convs(self.decoder)[-1].out_channels
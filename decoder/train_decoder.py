@@ -7,6 +7,8 @@ import lightning as L
 import torch
 import wandb
 from lightning.pytorch.loggers import WandbLogger
+from lightning.pytorch.strategies import DDPStrategy
+from lightning.pytorch.utilities import rank_zero_only
 
 from arg_parser import arg_parser
 from config_code.architecture_config import DecoderArchitectureConfig
@@ -15,7 +17,7 @@ from data import get_dataloader
 from decoder.callbacks import CustomCallback
 from decoder.decoderr import Decoder
 from decoder.lit_decoder import LitDecoder
-from decoder.my_data_module import MyDataModule
+from decoder.my_data_module import MyDataModule, LatentDataModule
 from models import load_audio_model
 from models.load_audio_model import load_decoder
 from options import get_options
@@ -23,11 +25,24 @@ from utils import logger
 from utils.utils import retrieve_existing_wandb_run_id, set_seed, get_audio_decoder_key
 
 
-def main(model_type: ModelType = ModelType.ONLY_DOWNSTREAM_TASK):
-    torch.set_float32_matmul_precision('medium')
+def _get_trainer_settings(decoder_config: DecoderConfig) -> dict:
+    decoder_config.check_trainer_settings()
+    strategy = decoder_config.strategy
+    if strategy == "ddp_gloo" or (strategy == "ddp" and decoder_config.accelerator == "cpu"):
+        strategy = DDPStrategy(process_group_backend="gloo")  # nccl is gpu only
+
+    return {"accelerator": decoder_config.accelerator,
+            "devices": decoder_config.devices,
+            "strategy": strategy,
+            "precision": decoder_config.precision}
 
+
+def main(model_type: ModelType = ModelType.ONLY_DOWNSTREAM_TASK):
     opt: OptionsConfig = get_options()
     decoder_config: DecoderConfig = opt.decoder_config
+
+    if torch.cuda.is_available() and decoder_config.accelerator != "cpu":
+        torch.set_float32_matmul_precision('medium')  # tensor cores
     loss_fun: DecoderLoss = decoder_config.decoder_loss
     print(f"\nTRAINING DECODER USING LOSS: {loss_fun} \n")
 
@@ -43,7 +58,9 @@ def main(model_type: ModelType = ModelType.ONLY_DOWNSTREAM_TASK):
     # random seeds
     set_seed(opt.seed)
 
-    if opt.use_wandb:
+    # with ddp, each process runs this script: only rank 0 logs to wandb (WandbLogger is rank zero only as well)
+    use_wandb = opt.use_wandb and rank_zero_only.rank == 0
+    if use_wandb:
         run_id, project_name = retrieve_existing_wandb_run_id(opt)
         wandb.init(id=run_id, resume="allow", project=project_name)
 
@@ -62,9 +79,6 @@ def main(model_type: ModelType = ModelType.ONLY_DOWNSTREAM_TASK):
     )
     context_model.eval()
 
-    train_loader, _, test_loader, _ = get_dataloader.get_dataloader(decoder_config.dataset)
-    data = MyDataModule(train_loader, test_loader, test_loader)
-
     architecture: DecoderArchitectureConfig = DecoderConfig.retrieve_correct_decoder_architecture(decoder_config)
 
     decoder = Decoder(architecture)
@@ -74,25 +88,35 @@ def main(model_type: ModelType = ModelType.ONLY_DOWNSTREAM_TASK):
     lit = LitDecoder(decoder_config,
                      context_model, decoder,
                      decoder_config.learning_rate,
-                     decoder_config.decoder_loss)
+                     decoder_config.decoder_loss,
+                     precomputed_latents=decoder_config.precompute_latents)
+
+    if decoder_config.precompute_latents:  # encoder is only run once, then the decoder trains on the stored z's
+        data = LatentDataModule(opt, lit.encode)  # latents are computed by rank 0 in `prepare_data`
+    else:
+        train_loader, _, test_loader, _ = get_dataloader.get_dataloader(decoder_config.dataset)
+        data = MyDataModule(train_loader, test_loader, test_loader)
 
     z_dim = architecture.input_dim
     nb_frames = architecture.expected_nb_frames_latent_repr
     callback = CustomCallback(opt, z_dim=z_dim, wandb_logger=wandb_logger, nb_frames=nb_frames,
-                              plot_ever_n_epoch=10, loss_enum=loss_fun) if opt.use_wandb else None
+                              plot_ever_n_epoch=10, loss_enum=loss_fun)  # also writes wavs locally without wandb
 
     trainer = L.Trainer(limit_train_batches=decoder_config.dataset.limit_train_batches,
                         max_epochs=decoder_config.num_epochs,
-                        accelerator="gpu", devices="1",
                         log_every_n_steps=10,  # arbitrary number to avoid warning
-                        logger=wandb_logger, callbacks=[callback] if callback is not None else [])
+                        logger=wandb_logger, callbacks=[callback],
+                        **_get_trainer_settings(decoder_config))
 
     if opt.train:
         trainer.fit(model=lit, datamodule=data)
 
         # The following line doesn't overwrite the last encoder (stores to adjusted log path)
         # which was done in `arg_parser.create_log_path()`
-        logs.create_log(decoder, final_test=True, final_loss=[])
+        if trainer.is_global_zero:  # only one process writes the checkpoint when using ddp
+            logs.create_log(decoder, final_test=True, final_loss=[])
+            logs.wait()  # checkpoints are written in the background, `load_decoder` reads it below
+        trainer.strategy.barrier()  # other processes wait until the checkpoint exists
 
     # regardless of training, test the model by loading the final checkpoint
     decoder = load_decoder(opt, decoder)
@@ -100,7 +124,7 @@ def main(model_type: ModelType = ModelType.ONLY_DOWNSTREAM_TASK):
 
     trainer.test(model=lit, datamodule=data)
 
-    if opt.use_wandb:
+    if use_wandb:
         wandb.finish()
 
 
@@ -0,0 +1,214 @@
+# Example usage:
+# python -m encoder.extract temp sim_audio_de_boer_distr_true --overrides extract_config.encoder_num=9 extract_config.split=test
+# python -m encoder.extract temp sim_audio_de_boer_distr_true --overrides extract_config.targets=0:-1,2:-1 extract_config.num_processes=4
+
+"""
+Writes the embeddings of a trained encoder checkpoint for a full dataset split to disk.
+
+Output layout (in `{log_path}/embeddings/encoder_num={n}/{split}/`):
+    shard_00000_modul=0_layer=-1.npy  (nb_files_in_shard, seq_len, nb_channels), one file per target
+    shard_00000_filenames.npy         (nb_files_in_shard,)
+    shard_00000_labels.npy            (nb_files_in_shard,)
+    shard_00000.done                  json, written once all arrays of the shard are complete
+    manifest.json                     written when all shards are done
+
+Shards that have a `.done` file are skipped, so an interrupted run can be restarted with the same command.
+Arrays are written to a memory-mapped `.tmp.npy` file and only renamed once the shard is complete.
+"""
+
+import json
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from config_code.config_classes import OptionsConfig, ModelType, ExtractConfig
+from data import get_dataloader
+from models import load_audio_model
+from models.full_model import FullModel
+from utils.utils import set_seed
+
+
+def _target_name(module_idx: int, layer_idx: int) -> str:
+    return f"modul={module_idx}_layer={layer_idx}"
+
+
+def _shard_path(out_dir: str, shard_idx: int, name: str) -> str:
+    return os.path.join(out_dir, f"shard_{shard_idx:05d}_{name}.npy")
+
+
+def _done_path(out_dir: str, shard_idx: int) -> str:
+    return os.path.join(out_dir, f"shard_{shard_idx:05d}.done")
+
+
+def get_output_dir(opt: OptionsConfig) -> str:
+    extract_config: ExtractConfig = opt.extract_config
+    return os.path.join(opt.log_path, "embeddings", f"encoder_num={extract_config.encoder_num}", extract_config.split)
+
+
+def _shard_ranges(nb_files: int, shard_size: int) -> list:
+    return [(start, min(start + shard_size, nb_files)) for start in range(0, nb_files, shard_size)]
+
+
+def _get_dataset(extract_config: ExtractConfig):
+    _, train_dataset, _, test_dataset = get_dataloader.get_dataloader(extract_config.dataset, shuffle=False)
+    return train_dataset if extract_config.split == "train" else test_dataset
+
+
+def _forward(full_model: FullModel, x: torch.Tensor, targets: List[tuple]) -> Dict[str, torch.Tensor]:
+    """
+    Returns the representations of all (module, layer) targets, each with shape (batch_size, seq_len, nb_channels).
+    The modules are run once: the output of each module is tapped on the way to the last target module.
+    """
+    nb_modules = len(full_model.fullmodel)
+    outputs = {}
+    model_input = x
+    for module_idx in range(max(m for m, _ in targets) + 1):
+        module = full_model.fullmodel[module_idx]
+        for layer_idx in sorted(l for m, l in targets if m == module_idx and l != -1):
+            _, z = module.get_latents_of_intermediate_layers(model_input, layer_idx)
+            outputs[_target_name(module_idx, layer_idx)] = z
+
+        if module_idx == nb_modules - 1:  # autoregressor, output of full model
+            if (module_idx, -1) in targets:
+                context, _ = module.get_latents(model_input)
+                outputs[_target_name(module_idx, -1)] = context
+            break
+
+        _, z = module.get_latents(model_input)  # (b, l, c)
+        if (module_idx, -1) in targets:
+            outputs[_target_name(module_idx, -1)] = z
+        model_input = z.permute(0, 2, 1)
+    return outputs
+
+
+def _extract_shard(opt: OptionsConfig, full_model: FullModel, dataset, out_dir: str, shard_idx: int, start: int,
+                   end: int):
+    extract_config: ExtractConfig = opt.extract_config
+    targets = extract_config.get_targets(len(opt.encoder_config.architecture.modules))
+    loader = DataLoader(Subset(dataset, range(start, end)), batch_size=extract_config.dataset.batch_size,
+                        shuffle=False, drop_last=False, num_workers=extract_config.dataset.num_workers)
+
+    nb_files = end - start
+    arrays = {}  # target name -> memory-mapped array, allocated once the output shape is known
+    filenames = []
+    labels = []
+    offset = 0
+
+    with torch.no_grad():
+        for (audio, filename, label, _) in loader:
+            audio = audio.to(opt.device)
+            batch_size = audio.shape[0]
+
+            for name, z in _forward(full_model, audio, targets).items():
+                z = z.cpu().numpy()
+                if name not in arrays:
+                    arrays[name] = np.lib.format.open_memmap(
+                        _shard_path(out_dir, shard_idx, name + ".tmp"), mode="w+", dtype=np.float32,
+                        shape=(nb_files,) + z.shape[1:])
+                arrays[name][offset: offset + batch_size] = z
+
+            filenames.extend(filename)
+            labels.extend(np.asarray(label).tolist())
+            offset += batch_size
+
+    assert offset == nb_files, f"Expected {nb_files} files in shard {shard_idx}, got {offset}"
+
+    # Rename only after all arrays are complete, a crash before this point leaves .tmp files that are overwritten
+    for name, array in arrays.items():
+        array.flush()
+        os.replace(_shard_path(out_dir, shard_idx, name + ".tmp"), _shard_path(out_dir, shard_idx, name))
+    np.save(_shard_path(out_dir, shard_idx, "filenames"), np.array(filenames))
+    np.save(_shard_path(out_dir, shard_idx, "labels"), np.array(labels))
+
+    with open(_done_path(out_dir, shard_idx), "w") as f:
+        json.dump({"start": start, "end": end, "time": time.time()}, f)
+
+
+def _extract_worker(worker_idx: int, opt: OptionsConfig, out_dir: str):
+    """Processes every `num_processes`-th shard, starting at `worker_idx`. Entry point of each worker process."""
+    extract_config: ExtractConfig = opt.extract_config
+    num_processes = extract_config.num_processes
+    if num_processes > 1:  # avoid oversubscription of the cpu cores when running multiple workers
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_processes))
+
+    dataset = _get_dataset(extract_config)
+    shards = _shard_ranges(len(dataset), extract_config.shard_size)
+    todo = [(idx, start, end) for idx, (start, end) in enumerate(shards)
+            if idx % num_processes == worker_idx and not os.path.exists(_done_path(out_dir, idx))]
+    if len(todo) == 0:
+        print(f"[worker {worker_idx}] all shards already done")
+        return
+
+    context_model, _ = load_audio_model.load_model_and_optimizer(
+        opt,
+        extract_config,
+        reload_model=True,
+        calc_accuracy=False,
+        num_GPU=1,
+    )
+    context_model.eval()
+
+    for step, (shard_idx, start, end) in enumerate(todo):
+        starttime = time.time()
+        _extract_shard(opt, context_model.module, dataset, out_dir, shard_idx, start, end)
+        print(f"[worker {worker_idx}] shard {shard_idx} ({end - start} files) done in "
+              f"{time.time() - starttime:.1f}s, {step + 1}/{len(todo)}")
+
+
+def _write_manifest(opt: OptionsConfig, out_dir: str):
+    extract_config: ExtractConfig = opt.extract_config
+    shards = _shard_ranges(len(_get_dataset(extract_config)), extract_config.shard_size)
+    missing = [idx for idx in range(len(shards)) if not os.path.exists(_done_path(out_dir, idx))]
+    assert len(missing) == 0, f"Shards {missing} are not done, rerun the same command to resume."
+
+    targets = [_target_name(m, l)
+               for m, l in extract_config.get_targets(len(opt.encoder_config.architecture.modules))]
+    manifest = {
+        "model_path": opt.model_path,
+        "encoder_num": extract_config.encoder_num,
+        "split": extract_config.split,
+        "targets": targets,
+        "shards": [{"idx": idx, "start": start, "end": end,
+                    "files": {name: os.path.basename(_shard_path(out_dir, idx, name))
+                              for name in targets + ["filenames", "labels"]}}
+                   for idx, (start, end) in enumerate(shards)],
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_embeddings(out_dir: str, target: str, mmap_mode="r") -> list:
+    """Returns the memory-mapped shards of a target, eg: target="modul=2_layer=-1"."""
+    with open(os.path.join(out_dir, "manifest.json"), "r") as f:
+        manifest = json.load(f)
+    return [np.load(os.path.join(out_dir, shard["files"][target]), mmap_mode=mmap_mode)
+            for shard in manifest["shards"]]
+
+
+def run_extraction(opt: OptionsConfig):
+    assert opt.extract_config is not None, "Extract config is not set"
+    opt.model_type = ModelType.ONLY_DOWNSTREAM_TASK
+    set_seed(opt.seed)
+
+    out_dir = get_output_dir(opt)
+    os.makedirs(out_dir, exist_ok=True)
+    print(f"Writing embeddings to {out_dir}")
+
+    num_processes = opt.extract_config.num_processes
+    if num_processes > 1:
+        torch.multiprocessing.spawn(_extract_worker, args=(opt, out_dir), nprocs=num_processes, join=True)
+    else:
+        _extract_worker(0, opt, out_dir)
+
+    _write_manifest(opt, out_dir)
+    print("Finished")
+
+
+if __name__ == "__main__":
+    from options import get_options
+
+    run_extraction(get_options())
@@ -15,11 +15,13 @@ from models import load_audio_model
 from models.full_model import FullModel
 # own modules
 from utils import logger
+from utils.metrics import MetricsAccumulator
+from utils.metrics_sink import MetricsSink, get_metrics_sink
 from utils.utils import set_seed, initialize_wandb
 from validation.val_by_InfoNCELoss import val_by_InfoNCELoss
 
 
-def train(opt: OptionsConfig, logs, model: FullModel, optimizer, train_loader, test_loader):
+def train(opt: OptionsConfig, logs, model: FullModel, optimizer, train_loader, test_loader, sink: MetricsSink):
     '''Train the model'''
     total_step = len(train_loader)
     limit_train_batches = opt.encoder_config.dataset.limit_train_batches  # value between 0 and 1
@@ -44,8 +46,8 @@ def train(opt: OptionsConfig, logs, model: FullModel, optimizer, train_loader, t
     global_step = 0
     for epoch in range(start_epoch, num_epochs + start_epoch):
 
-        nb_modules = len(opt.encoder_config.architecture.modules)
-        loss_epoch = [0 for _ in range(nb_modules)]
+        # losses are summed on the device, synced at the end of the epoch
+        metrics = MetricsAccumulator(["loss", "nce", "kld"])
 
         for step, (audio, _, _, _) in enumerate(train_loader):
 
@@ -75,28 +77,21 @@ def train(opt: OptionsConfig, logs, model: FullModel, optimizer, train_loader, t
             overall_loss.backward()
             optimizer.step()
 
-            for idx, cur_losses in enumerate(loss):
-                print_loss = cur_losses.item()
-                loss_epoch[idx] += print_loss
+            metrics.update(loss=loss, nce=nce, kld=kld)
+            # all modules in one record (nce/nce_0, nce/nce_1, ..), converted and written in the background
+            sink.log({"nce/nce": nce, "kld/kld": kld, "loss/loss": loss, "epoch": epoch}, step=global_step)
 
-                if step % print_idx == 0:
-                    print(f"\t \t Loss: \t \t {print_loss:.4f}")
-
-            if opt.use_wandb:
-                for idx, cur_nce in enumerate(nce):
-                    wandb.log({f"nce/nce_{idx}": cur_nce}, step=global_step)
-                for idx, cur_kld in enumerate(kld):
-                    wandb.log({f"kld/kld_{idx}": cur_kld}, step=global_step)
-                for idx, cur_losses in enumerate(loss):
-                    wandb.log({f"loss/loss_{idx}": cur_losses}, step=global_step)
-
-                wandb.log({'epoch': epoch}, step=global_step)
+            if step % print_idx == 0:
+                for cur_losses in loss.detach().cpu().numpy():
+                    print(f"\t \t Loss: \t \t {cur_losses:.4f}")
 
             global_step += 1
 
             if step >= total_step:
                 break
 
+        loss_epoch = metrics.mean(count=1)["loss"]  # sums
+
         scheduler.step()
         print(f"LR: {scheduler.get_last_lr()}")
 
@@ -107,9 +102,7 @@ def train(opt: OptionsConfig, logs, model: FullModel, optimizer, train_loader, t
             validation_loss = val_by_InfoNCELoss(opt, model, test_loader)
             logs.append_val_loss(validation_loss)
 
-            if opt.use_wandb:
-                for i, val_loss in enumerate(validation_loss):
-                    wandb.log({f"val_loss/val_loss_{i}": val_loss}, step=global_step)
+            sink.log({"val_loss/val_loss": validation_loss}, step=global_step)
 
         if (epoch % opt.log_every_x_epochs == 0):
             logs.create_log(model, optimizer=optimizer, epoch=epoch)
@@ -144,15 +137,20 @@ def _main(options: OptionsConfig):
     train_loader, train_dataset, test_loader, test_dataset = get_dataloader.get_dataloader(
         config=options.encoder_config.dataset)
 
+    # per-step metrics, written to {log_path}/metrics.jsonl (and wandb) by a background thread
+    sink = get_metrics_sink(options)
     try:
         # Train the model
         if TRAIN:
-            train(options, logs, model, optimizer, train_loader, test_loader)
+            train(options, logs, model, optimizer, train_loader, test_loader, sink)
 
     except KeyboardInterrupt:
         print("Training got interrupted, saving log-files now.")
+    finally:
+        sink.close()
 
     logs.create_log(model)
+    logs.wait()  # checkpoints are written in the background
 
     if USE_WANDB:
         wandb.finish()
@@ -21,8 +21,9 @@ from models import load_audio_model
 from models.loss_supervised_syllables import Syllables_Loss
 from options import get_options
 from utils import logger
-from utils.utils import retrieve_existing_wandb_run_id, set_seed, get_audio_classific_key, get_nb_classes, \
-    get_classif_log_path
+from utils.metrics_sink import MetricsSink, get_metrics_sink
+from utils.utils import retrieve_existing_wandb_run_id, get_wandb_mode, set_seed, get_audio_classific_key, \
+    get_nb_classes, get_classif_log_path
 
 
 def _get_representation(opt: OptionsConfig, method: callable,
@@ -78,7 +79,7 @@ def get_z(opt, context_model, model_input, regression: bool, which_module: int,
 
 
 def train(opt: OptionsConfig, context_model, loss: Syllables_Loss, logs: logger.Logger, train_loader, optimizer,
-          wandb_is_on: bool, bias: bool):
+          sink: MetricsSink, bias: bool):
     # loss also contains the classifier model
 
     total_step = len(train_loader)
@@ -86,10 +87,11 @@ def train(opt: OptionsConfig, context_model, loss: Syllables_Loss, logs: logger.
 
     num_epochs = opt.syllables_classifier_config.num_epochs
     global_step = 0
+    wandb_section = get_audio_classific_key(opt, bias)
 
     for epoch in range(num_epochs):
-        loss_epoch = 0
-        acc_epoch = 0
+        loss_epoch = torch.zeros((), device=opt.device)  # summed on the device, synced at the end of the epoch
+        acc_epoch = torch.zeros((), device=opt.device)
 
         if opt.model_type == ModelType.FULLY_SUPERVISED:
             context_model.train()
@@ -119,16 +121,12 @@ def train(opt: OptionsConfig, context_model, loss: Syllables_Loss, logs: logger.
             total_loss.backward()
             optimizer.step()
 
-            sample_loss = total_loss.item()
-            accuracy = accuracies.item()
+            sample_loss = total_loss.detach()
+            accuracy = accuracies.detach().reshape(())
 
-            if wandb_is_on:
-                wandb_section = get_audio_classific_key(opt, bias)
-                wandb.log({
-                    f"{wandb_section}/Loss classification": sample_loss,
-                    f"{wandb_section}/Train accuracy": accuracy,
-                    f"{wandb_section}/Step": global_step})
-                global_step += 1
+            sink.log({f"{wandb_section}/Loss classification": sample_loss,
+                      f"{wandb_section}/Train accuracy": accuracy}, step=global_step)
+            global_step += 1
 
             if i % print_idx == 0:
                 print(
@@ -138,8 +136,8 @@ def train(opt: OptionsConfig, context_model, loss: Syllables_Loss, logs: logger.
                         i,
                         total_step,
                         time.time() - starttime,
-                        accuracy,
-                        sample_loss,
+                        accuracy.item(),
+                        sample_loss.item(),
                     )
                 )
                 starttime = time.time()
@@ -147,7 +145,7 @@ def train(opt: OptionsConfig, context_model, loss: Syllables_Loss, logs: logger.
             loss_epoch += sample_loss
             acc_epoch += accuracy
 
-        logs.append_train_loss([loss_epoch / total_step])
+        logs.append_train_loss([loss_epoch.item() / total_step])
 
 
 def test(opt, context_model, loss, data_loader, wandb_is_on: bool, bias: bool):
@@ -221,7 +219,7 @@ def main():
 
     if opt.use_wandb:
         run_id, project_name = retrieve_existing_wandb_run_id(opt)
-        wandb.init(id=run_id, resume="allow", project=project_name)
+        wandb.init(id=run_id, resume="allow", project=project_name, mode=get_wandb_mode(opt))
 
     # on which module to train the classifier (default: -1, last module)
     classif_module: int = classifier_config.encoder_module
@@ -280,16 +278,23 @@ def main():
     logs = logger.Logger(opt)
     accuracy = 0
 
+    # the run is resumed from the encoder training, so the step is logged as a metric instead of as wandb's step
+    sink = get_metrics_sink(opt, name="classifier_metrics",
+                            wandb_step_metric=f"{get_audio_classific_key(opt, bias)}/Step")
     try:
         # Train the model
         if opt.train:
-            train(opt, context_model, loss, logs, train_loader, optimizer, opt.use_wandb, bias)
+            train(opt, context_model, loss, logs, train_loader, optimizer, sink, bias)
+        # the training metrics are written before `test` logs the final results to wandb directly
+        sink.close()
 
         # Test the model
         result_loss, accuracy = test(opt, context_model, loss, test_loader, opt.use_wandb, bias)
 
     except KeyboardInterrupt:
         print("Training interrupted, saving log files")
+    finally:
+        sink.close()
 
     logs.create_log(loss, accuracy=accuracy, final_test=True, final_loss=result_loss)
 
@@ -1,7 +1,7 @@
 import torch
 
 from typing import Optional, Union
-from config_code.config_classes import Loss, ModelType, OptionsConfig, ClassifierConfig, DecoderConfig
+from config_code.config_classes import Loss, ModelType, OptionsConfig, ClassifierConfig, DecoderConfig, ExtractConfig
 from decoder.decoderr import Decoder
 from decoder.lit_decoder import LitDecoder
 from models import full_model
@@ -11,7 +11,8 @@ import os
 
 
 def load_model_and_optimizer(
-        opt: OptionsConfig, classifier_config: Union[Optional[ClassifierConfig], Optional[DecoderConfig]],
+        opt: OptionsConfig,
+        classifier_config: Union[Optional[ClassifierConfig], Optional[DecoderConfig], Optional[ExtractConfig]],
         reload_model=False, calc_accuracy=False,
         num_GPU=None) -> (FullModel, torch.optim.Optimizer):
     lr = opt.encoder_config.learning_rate
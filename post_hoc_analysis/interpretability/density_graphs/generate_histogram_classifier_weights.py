@@ -7,8 +7,8 @@ from typing import List
 import matplotlib.pyplot as plt
 import numpy as np
 import tikzplotlib
-import seaborn as sns
 
+from post_hoc_analysis.interpretability.latent_statistics import compute_kde
 from utils.helper_functions import create_dir
 
 
@@ -30,14 +30,16 @@ def load_weights_from_csv(filename):
 def histogram_from_weights(title, metas: List[Meta]):
     dir = 'graphs'
     create_dir(dir)
-    for meta in metas:
-        weights = meta.weights
-        name = meta.name
 
-        max = np.max([abs(float(x)) for x in weights])
-        data = [float(x) / max for x in weights]
+    # binned KDE (same bandwidth as sns.kdeplot(bw_adjust=.5)), computed once and stored next to the plots
+    grid = np.linspace(-1, 1, 512)
+    densities = {}
+    for meta in metas:
+        weights = np.asarray(meta.weights, dtype=np.float64)
+        data = weights / np.max(np.abs(weights))
+        densities[meta.name] = compute_kde(data[None, :], grid, bw_adjust=.5)[0]
 
-        sns.kdeplot(data, bw_adjust=.5, label=name)
+        plt.plot(grid, densities[meta.name], label=meta.name)
 
     title = f"{title} plot of 512 dimensions"
     plt.title(title)
@@ -48,6 +50,7 @@ def histogram_from_weights(title, metas: List[Meta]):
     plt.xlabel("Weight (normalized between -1 and 1)")
     plt.ylabel("Density")
 
+    np.savez_compressed(f"{dir}/{title}_kde_plot_512_dims.npz", grid=grid, **densities)
     tikzplotlib.save(f"{dir}/{title}_kde_plot_512_dims.tex")
     plt.savefig(f"{dir}/{title}_kde_plot_512_dims.pdf")
     plt.show()
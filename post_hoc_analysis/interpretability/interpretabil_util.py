@@ -1,33 +1,33 @@
+import os
 import random
-from typing import Union
+from typing import Union, Optional
 
 import numpy as np
 
 from config_code.config_classes import OptionsConfig
 
 from PIL import Image
-from sklearn.manifold import TSNE
 import matplotlib.pyplot as plt
 import wandb
-from utils.helper_functions import colour_palette_vowels, translate_vowel_number_to_vowel, histogram, scatter_syllable
+from post_hoc_analysis.interpretability.latent_statistics import LatentStatistics, render_histograms
+from post_hoc_analysis.interpretability.projection import project, get_backend, ProjectionCache
+from utils.helper_functions import colour_palette_vowels, translate_vowel_number_to_vowel, scatter_syllable
 
 
 def plot_tsne_syllable(opt: OptionsConfig, feature_space: np.ndarray, label_indices: np.ndarray, gim_name: str,
-                       lr: Union[float, str], n_iter: int, perplexity: int, wandb_is_on: bool):
+                       lr: Union[float, str], n_iter: int, perplexity: int, wandb_is_on: bool,
+                       backend: str = "sklearn", pca_components: Optional[int] = None,
+                       max_samples: Optional[int] = None, checkpoint: Optional[str] = None):
     """
     SAVES t-SNE plot to the log directory AND logs it to wandb if wandb_is_on is True
+    The projection is cached in `{opt.model_path}/projection_cache` if `checkpoint` is given (eg: "model_9").
     """
     # eg target_dir = 'analyse_hidden_repr//hidden_repr_vis/split/module=1/test/'
 
-    projection = TSNE(
-        init='random',
-        learning_rate=lr,
-        n_iter=n_iter,
-        perplexity=perplexity
-        # n_iter_without_progress=1000,
-        # perplexity=50
-        # perplexity=15
-    ).fit_transform(feature_space)
+    projection, label_indices = project(
+        feature_space, label_indices, get_backend(backend, lr, n_iter, perplexity),
+        pca_components=pca_components, max_samples=max_samples, seed=max(opt.seed, 0),
+        cache=ProjectionCache(os.path.join(opt.model_path, "projection_cache")), checkpoint=checkpoint)
 
     assert projection.shape[0] == label_indices.shape[0]
 
@@ -45,30 +45,30 @@ def plot_tsne_syllable(opt: OptionsConfig, feature_space: np.ndarray, label_indi
         wandb.log({f"LatSpace/t-SNE_latent_space_{gim_name}": [wandb.Image(f"{save_dir}/{file}")]})
 
 
-def plot_histograms(opt: OptionsConfig, feature_space_per_channel, gim_name, max_dim: int, wandb_is_on: bool):
+def plot_histograms(opt: OptionsConfig, feature_space_per_channel, gim_name, max_dim: int, wandb_is_on: bool,
+                    num_workers: Optional[int] = None):
     # feature_space_per_channel: (nb_channels, batch_size, seq_len)
+    # num_workers: nb of processes to render the figures, default: as for the data loaders of the encoder
     save_dir = opt.log_path
-    images = []
-
-    for idx, feature_space in enumerate(feature_space_per_channel):
-        # feature_space: (batch_size, seq_len)
-        if idx == max_dim:
-            break
-
-        feature_space = feature_space.flatten()
-        file = f"_ distribution_latent_space_{gim_name}_dim={idx}"
-
-        histogram(feature_space,
-                  title=f"Distributions of latent points for dimension {idx + 1} - {gim_name}", dir=save_dir,
-                  file=file, show=False)
-
-        print(f"Saved t-SNE plot to {save_dir}/{file}.png")
-
-        if wandb_is_on and idx < 32:  # max_images = 32 images
-            images.append(Image.open(f"{save_dir}/{file}.png"))
+    if num_workers is None:
+        num_workers = opt.encoder_config.dataset.num_workers
+
+    # histograms and KDEs of all channels are computed at once and stored in a single file,
+    # only the first `max_dim` figures are rendered (in parallel)
+    os.makedirs(save_dir, exist_ok=True)
+    stats_path = f"{save_dir}/_ latent_statistics_{gim_name}.npz"
+    LatentStatistics.compute(feature_space_per_channel).save(stats_path)
+    print(f"Saved latent statistics to {stats_path}")
+
+    dims = list(range(min(max_dim, feature_space_per_channel.shape[0])))
+    files = [f"_ distribution_latent_space_{gim_name}_dim={idx}" for idx in dims]
+    titles = [f"Distributions of latent points for dimension {idx + 1} - {gim_name}" for idx in dims]
+    render_histograms(stats_path, dims, titles, save_dir, files, num_workers=num_workers)
+    print(f"Saved {len(dims)} histograms to {save_dir}")
 
     # Create a collage of images and log it to wandb
     if wandb_is_on:
+        images = [Image.open(f"{save_dir}/{file}.png") for file in files[:32]]  # max_images = 32 images
         collage = Image.new('RGB', (images[0].width * len(images), images[0].height))
         for i, image in enumerate(images):
             collage.paste(image, (i * images[0].width, 0))
@@ -0,0 +1,178 @@
+"""
+Per-dimension statistics (histograms and kernel density estimates) of latent representations.
+
+All channels are processed at once with numpy instead of one matplotlib call per channel:
+- histograms: a single `np.bincount` over (channel, bin) indices
+- KDE: a binned KDE, ie the fine-grained histogram convolved with a gaussian kernel (via FFT)
+
+The statistics are written to one .npz file, after which the figures can be rendered lazily (only the dims
+you need) or in a process pool.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List
+
+import numpy as np
+from matplotlib.figure import Figure
+
+try:
+    import tikzplotlib
+except ImportError:
+    tikzplotlib = None
+
+
+def compute_histograms(data: np.ndarray, bins: int = 100, chunk_size: int = 1_000_000) -> (np.ndarray, np.ndarray):
+    """
+    :param data: (nb_channels, nb_values)
+    :return: densities (nb_channels, bins) and bin edges (nb_channels, bins + 1), each channel with its own range
+        (same as `plt.hist(x, bins=bins, density=True)` for every channel)
+    """
+    nb_channels, nb_values = data.shape
+    lo = data.min(axis=1).astype(np.float64)
+    hi = data.max(axis=1).astype(np.float64)
+    hi = np.where(hi > lo, hi, lo + 1)  # constant channel
+    width = (hi - lo) / bins
+
+    counts = np.zeros(nb_channels * bins, dtype=np.int64)
+    offsets = (np.arange(nb_channels) * bins)[:, None]
+    for start in range(0, nb_values, chunk_size):  # bound the memory of the int64 indices
+        chunk = data[:, start: start + chunk_size]
+        idx = np.clip(((chunk - lo[:, None]) / width[:, None]).astype(np.int64), 0, bins - 1)  # max goes in last bin
+        counts += np.bincount((idx + offsets).ravel(), minlength=nb_channels * bins)
+
+    edges = lo[:, None] + width[:, None] * np.arange(bins + 1)[None, :]
+    densities = counts.reshape(nb_channels, bins) / (nb_values * width[:, None])
+    return densities, edges
+
+
+def _scott_bandwidth(data: np.ndarray, bw_adjust: float) -> np.ndarray:
+    return data.std(axis=1) * data.shape[1] ** (-1 / 5) * bw_adjust  # (nb_channels,)
+
+
+def get_kde_grid(data: np.ndarray, nb_points: int = 512, bw_adjust: float = 1.) -> np.ndarray:
+    """
+    :param data: (nb_channels, nb_values)
+    :return: (nb_points,) evenly spaced grid covering the values of all channels plus 3 bandwidths on both sides,
+        such that `compute_kde` doesn't clip any values and the tails are included
+    """
+    pad = 3 * _scott_bandwidth(data, bw_adjust).max()
+    lo, hi = float(data.min()) - pad, float(data.max()) + pad
+    if hi <= lo:  # constant data
+        lo, hi = lo - 1, hi + 1
+    return np.linspace(lo, hi, nb_points)
+
+
+def compute_kde(data: np.ndarray, grid: np.ndarray, bw_adjust: float = 1.,
+                chunk_size: int = 1_000_000) -> np.ndarray:
+    """
+    Binned gaussian KDE for each channel, with Scott's rule bandwidth (as in `sns.kdeplot(x, bw_adjust=...)`).
+    :param data: (nb_channels, nb_values)
+    :param grid: (nb_points,) evenly spaced points at which the density is evaluated, values outside are clipped
+        (see `get_kde_grid` for a grid that covers the data)
+    :return: densities (nb_channels, nb_points)
+    """
+    nb_channels, nb_values = data.shape
+    nb_points = grid.shape[0]
+    step = grid[1] - grid[0]
+
+    # linear binning of the values onto the grid
+    counts = np.zeros((nb_channels, nb_points), dtype=np.float64)
+    offsets = (np.arange(nb_channels) * nb_points)[:, None]
+    for start in range(0, nb_values, chunk_size):
+        pos = np.clip((data[:, start: start + chunk_size] - grid[0]) / step, 0, nb_points - 1)
+        left = np.minimum(pos.astype(np.int64), nb_points - 2)
+        frac = pos - left
+        counts += np.bincount((left + offsets).ravel(), weights=(1 - frac).ravel(),
+                              minlength=nb_channels * nb_points).reshape(nb_channels, nb_points)
+        counts += np.bincount((left + 1 + offsets).ravel(), weights=frac.ravel(),
+                              minlength=nb_channels * nb_points).reshape(nb_channels, nb_points)
+
+    # gaussian kernel per channel, convolved with the binned counts via FFT
+    bandwidth = np.maximum(_scott_bandwidth(data, bw_adjust), step)
+    lags = np.arange(-(nb_points - 1), nb_points) * step  # (2 * nb_points - 1,)
+    kernels = np.exp(-0.5 * (lags[None, :] / bandwidth[:, None]) ** 2) / (np.sqrt(2 * np.pi) * bandwidth[:, None])
+
+    n_fft = 1 << int(np.ceil(np.log2(3 * nb_points - 2)))
+    conv = np.fft.irfft(np.fft.rfft(counts, n_fft, axis=1) * np.fft.rfft(kernels, n_fft, axis=1), n_fft, axis=1)
+    return conv[:, nb_points - 1: 2 * nb_points - 1] / nb_values
+
+
+class LatentStatistics:
+    def __init__(self, densities: np.ndarray, edges: np.ndarray, kde_grid: np.ndarray, kde: np.ndarray,
+                 mean: np.ndarray, std: np.ndarray):
+        self.densities = densities  # (nb_channels, bins)
+        self.edges = edges  # (nb_channels, bins + 1)
+        self.kde_grid = kde_grid  # (nb_points,)
+        self.kde = kde  # (nb_channels, nb_points)
+        self.mean = mean  # (nb_channels,)
+        self.std = std  # (nb_channels,)
+
+    @staticmethod
+    def compute(data_per_channel: np.ndarray, bins: int = 100, kde_range: Optional[tuple] = None,
+                kde_points: int = 512, bw_adjust: float = 1.) -> "LatentStatistics":
+        # data_per_channel: (nb_channels, ...) eg: (nb_channels, batch_size, seq_len)
+        # kde_range: (min, max) of the KDE grid, default: derived from the data (nothing is clipped)
+        data = data_per_channel.reshape(data_per_channel.shape[0], -1)
+        densities, edges = compute_histograms(data, bins)
+        if kde_range is None:
+            kde_grid = get_kde_grid(data, kde_points, bw_adjust)
+        else:
+            kde_grid = np.linspace(kde_range[0], kde_range[1], kde_points)
+        kde = compute_kde(data, kde_grid, bw_adjust)
+        return LatentStatistics(densities, edges, kde_grid, kde, data.mean(axis=1), data.std(axis=1))
+
+    def save(self, path: str):
+        np.savez_compressed(path, densities=self.densities, edges=self.edges, kde_grid=self.kde_grid,
+                            kde=self.kde, mean=self.mean, std=self.std)
+
+    @staticmethod
+    def load(path: str) -> "LatentStatistics":
+        d = np.load(path)
+        return LatentStatistics(d["densities"], d["edges"], d["kde_grid"], d["kde"], d["mean"], d["std"])
+
+
+def render_histogram(stats: LatentStatistics, dim: int, title: str, dir: str, file: str) -> str:
+    """Same figure as `helper_functions.histogram`, but drawn from the precomputed counts."""
+    import seaborn as sns
+
+    sns.set_style('whitegrid')
+    fig = Figure(figsize=(6, 4))  # no pyplot, so safe to use from worker processes
+    ax = fig.subplots()
+    colors = sns.color_palette('bright', n_colors=1)
+
+    ax.stairs(stats.densities[dim], stats.edges[dim], fill=True,
+              color=colors[0], alpha=0.8, edgecolor='k', linewidth=1.2)
+
+    # standard normal PDF
+    x = np.linspace(-4, 4, 1000)
+    ax.plot(x, np.exp(-0.5 * x ** 2) / np.sqrt(2 * np.pi), color='r', linewidth=2)
+
+    ax.set_xlabel('Value')
+    ax.set_ylabel('Frequency')
+    ax.set_title(title)
+    ax.set_ylim(0, 5)
+
+    os.makedirs(dir, exist_ok=True)
+    fig.savefig(f"{dir}/{file}.png", dpi=120)
+    if tikzplotlib is not None:
+        try:
+            tikzplotlib.save(f"{dir}/{file}.tex", figure=fig)
+        except AttributeError as e:  # tikzplotlib is not compatible with matplotlib >= 3.6 (eg: Legend._ncol)
+            print(f"Warning: could not save {dir}/{file}.tex, tikzplotlib failed: {e}")
+    return f"{dir}/{file}.png"
+
+
+def _render_worker(args):
+    stats_path, dim, title, dir, file = args
+    return render_histogram(LatentStatistics.load(stats_path), dim, title, dir, file)
+
+
+def render_histograms(stats_path: str, dims: List[int], titles: List[str], dir: str, files: List[str],
+                      num_workers: int = 0) -> List[str]:
+    """Renders the histograms of the given dims, in parallel over `num_workers` processes (sequential if <= 1)."""
+    jobs = [(stats_path, dim, title, dir, file) for dim, title, file in zip(dims, titles, files)]
+    if num_workers <= 1:
+        return [_render_worker(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(_render_worker, jobs))
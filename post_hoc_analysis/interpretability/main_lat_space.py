@@ -15,6 +15,7 @@ from models import load_audio_model
 from models.full_model import FullModel
 from options import get_options
 from utils.helper_functions import *
+from utils.streaming_accumulator import StreamingAccumulator
 from utils.utils import retrieve_existing_wandb_run_id, set_seed
 from post_hoc_analysis.interpretability.interpretabil_util import plot_tsne_syllable, plot_histograms, \
     scatter_3d_syllable
@@ -31,8 +32,7 @@ This script is used to analyze the latent space of the audio encoder.
 def _get_data_from_loader(loader, encoder: FullModel, opt: OptionsConfig, final_module: str):
     assert final_module in ["final", "final_cnn"]
 
-    all_audio = np.array([])
-    all_labels = np.array([])
+    accumulator = StreamingAccumulator(capacity=len(loader.dataset))
 
     for i, (audio, _, label, _) in enumerate(loader):
         audio = audio.to(opt.device)
@@ -44,13 +44,9 @@ def _get_data_from_loader(loader, encoder: FullModel, opt: OptionsConfig, final_
                 audio = encoder.forward_through_all_cnn_modules(audio)  # only cnn modules have kl divergence
             audio = audio.cpu().detach().numpy()  # (batch_size, seq_len, nb_channels)
 
-            # vstack the audio
-            if all_audio.size == 0:
-                all_audio = audio
-                all_labels = label
-            else:
-                all_audio = np.vstack((all_audio, audio))
-                all_labels = np.hstack((all_labels, label))
+            accumulator.append(audio, label)
+
+    all_audio, all_labels = accumulator.result()
 
     # If output from final_cnn, permute channels and seq_len
     if final_module == "final_cnn":
@@ -104,7 +100,8 @@ def main():
     all_audio_mean = np.mean(all_audio, axis=1)  # (batch_size, nb_channels)
     lr, n_iter, perplexity = ('auto', 1000, int(float(np.sqrt(n))))
     plot_tsne_syllable(opt, all_audio_mean, all_labels, f"MEAN_SIM_{lr}_{n_iter}_{perplexity}",
-                       lr=lr, n_iter=n_iter, perplexity=perplexity, wandb_is_on=opt.use_wandb)
+                       lr=lr, n_iter=n_iter, perplexity=perplexity, wandb_is_on=opt.use_wandb,
+                       checkpoint=f"model_{classifier_config.encoder_num}")
 
     data_config.labels = 'vowels'
     train_loader_syllables, _, test_loader_syllables, _ = get_dataloader.get_dataloader(data_config)
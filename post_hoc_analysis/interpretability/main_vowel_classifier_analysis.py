@@ -11,6 +11,9 @@ Warning: script only for VOWEL classifier (bias=False)!! The script is only used
 # Example: temp sim_audio_de_boer_distr_true --overrides syllables_classifier_config.encoder_num=9
 
 
+import hashlib
+import os
+
 import matplotlib.pyplot as plt
 import numpy as np
 import torch
@@ -85,31 +88,65 @@ def plot_weights(opt: OptionsConfig, weights: np.ndarray, wandb, first_dim: int
     return png_path
 
 
-def _get_predictions(classifier, device, n_features, dim1, dim2):
-    # DIM1, DIM2 ARE ZERO BASED
-    t = 100
-    min, max = -3, 3
+def _label_space_cache_path(cache_dir: str, classifier_checkpoint: str, n_features: int, dim1: int, dim2: int,
+                            t: int, min: float, max: float) -> str:
+    # the modification time of the checkpoint is part of the key, so retraining the classifier invalidates the cache
+    mtime = int(os.path.getmtime(classifier_checkpoint))
+    key = hashlib.sha1(f"{os.path.abspath(classifier_checkpoint)}_{mtime}".encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"label_space_{key}_n={n_features}_dims={dim1}_{dim2}_t={t}_{min}_{max}.npz")
+
+
+def evaluate_label_grid(classifier, device, n_features, dim1, dim2, t=100, min=-3., max=3.,
+                        memory_budget_mb: float = 256, cache_dir=None, classifier_checkpoint=None):
+    """
+    Evaluates the classifier on a (t x t) grid of latent vectors, where dimensions `dim1` and `dim2` (zero based) vary
+    between `min` and `max` and all other dimensions are zero. The grid is evaluated as a single batch,
+    split in chunks such that the latent vectors of one chunk fit in `memory_budget_mb`.
+    Results are cached in `cache_dir` if both `cache_dir` and `classifier_checkpoint` (path to the .ckpt) are given.
+    :return: softmax predictions (t, t, n_labels), with data[i, j] the prediction for (range[i], range[j]), and range
+    """
     range = np.linspace(min, max, t)
-    z = torch.zeros((1, n_features)).to(device)
 
-    # data = np.array([])
-    data = np.zeros((t, t, 3))
-    for i, val_i in enumerate(range):
-        for j, val_j in enumerate(range):
-            z[0][dim1] = val_i
-            z[0][dim2] = val_j
+    cache_path = None
+    if cache_dir is not None and classifier_checkpoint is not None:
+        cache_path = _label_space_cache_path(cache_dir, classifier_checkpoint, n_features, dim1, dim2, t, min, max)
+        if os.path.exists(cache_path):
+            return np.load(cache_path)["data"], range
+
+    values = torch.tensor(range, dtype=torch.float32, device=device)
+    # `range`, `min` and `max` shadow the builtins here, hence the numpy equivalents
+    chunk_size = int(np.clip(memory_budget_mb * 1024 ** 2 // (n_features * 4), 1, t * t))
 
-            prediction = classifier(z).detach().cpu().numpy()  # (1, 3)
-            # softmax
-            prediction = np.exp(prediction) / np.exp(prediction).sum(axis=1, keepdims=True)
-            data[i][j] = prediction[0]
+    predictions = []
+    with torch.no_grad():
+        for start in np.arange(0, t * t, chunk_size):
+            idx = torch.arange(int(start), int(np.minimum(start + chunk_size, t * t)), device=device)
+            z = torch.zeros((idx.shape[0], n_features), device=device)
+            z[:, dim1] = values[idx // t]  # row index i
+            z[:, dim2] = values[idx % t]  # column index j
+            predictions.append(torch.softmax(classifier(z), dim=1).cpu())
+
+    data = torch.cat(predictions, dim=0).reshape(t, t, -1).numpy()
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_path, data=data)
 
     return data, range
 
 
-def plot_label_space(opt: OptionsConfig, wandb, classifier, n_features, dim1, dim2):  # dim1, dim2 are zero based
+def _get_predictions(classifier, device, n_features, dim1, dim2, t=100, cache_dir=None, classifier_checkpoint=None):
+    # DIM1, DIM2 ARE ZERO BASED
+    return evaluate_label_grid(classifier, device, n_features, dim1, dim2, t=t, min=-3, max=3,
+                               cache_dir=cache_dir, classifier_checkpoint=classifier_checkpoint)
+
+
+def plot_label_space(opt: OptionsConfig, wandb, classifier, n_features, dim1, dim2,
+                     t=100, classifier_checkpoint=None):  # dim1, dim2 are zero based
     fig, ax = plt.subplots()
-    predictions, range = _get_predictions(classifier, opt.device, n_features, dim1, dim2)
+    predictions, range = _get_predictions(classifier, opt.device, n_features, dim1, dim2, t=t,
+                                          cache_dir=f"{opt.log_path}/label_space_cache",
+                                          classifier_checkpoint=classifier_checkpoint)
     im = ax.imshow(predictions)
 
     # x and y ticks are the values between `min` and `max`
@@ -242,7 +279,9 @@ def main():
     #     wandb.log({f"{wandb_section}/Vowel Classifier Weights imgs": [
     #         wandb.Image(im) for im in ims]})
 
-    # plot_label_space(opt, wandb, linear_classifier, n_features, dim1, dim2)
+    # predictions in the plane of the 2 most important dimensions (largest absolute weights, summed over the vowels)
+    dim1, dim2 = np.argsort(np.abs(weights).sum(axis=1))[::-1][:2]
+    plot_label_space(opt, wandb, linear_classifier, n_features, int(dim1), int(dim2), classifier_checkpoint=model_path)
 
     if opt.use_wandb:
         wandb.finish()
@@ -0,0 +1,188 @@
+"""
+2-D projections (t-SNE) of latent representations for the interpretability plots.
+
+The features are optionally subsampled (stratified by label) and reduced with PCA, after which a projection backend
+computes the 2-D embedding. Projections are cached on disk, keyed by the checkpoint, the projection parameters and
+fingerprints of the features, labels and sampled indices, so reruns of the same plot are instant.
+"""
+
+import hashlib
+import json
+import os
+from typing import Optional, Union
+
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.manifold import TSNE
+
+try:
+    import openTSNE  # FFT-accelerated t-SNE, optional
+except ImportError:
+    openTSNE = None
+
+
+class ProjectionBackend:
+    name = "base"
+
+    def fit_transform(self, features: np.ndarray, seed: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def params(self) -> dict:
+        """Parameters that influence the projection, used as part of the cache key."""
+        raise NotImplementedError
+
+
+class SklearnTSNEBackend(ProjectionBackend):
+    """scikit-learn t-SNE. method="barnes_hut" is O(n log n), method="exact" is O(n^2)."""
+    name = "sklearn"
+
+    def __init__(self, lr: Union[float, str] = 'auto', n_iter: int = 1000, perplexity: float = 30,
+                 method: str = "barnes_hut"):
+        self.lr = lr
+        self.n_iter = n_iter
+        self.perplexity = perplexity
+        self.method = method
+
+    def fit_transform(self, features, seed):
+        return TSNE(
+            init='random',
+            learning_rate=self.lr,
+            n_iter=self.n_iter,
+            perplexity=self.perplexity,
+            method=self.method,
+            random_state=seed,
+        ).fit_transform(features)
+
+    def params(self):
+        return {"lr": self.lr, "n_iter": self.n_iter, "perplexity": self.perplexity, "method": self.method}
+
+
+class OpenTSNEBackend(SklearnTSNEBackend):
+    """openTSNE with FFT-accelerated interpolation, much faster than Barnes-Hut for large n."""
+    name = "opentsne"
+
+    def __init__(self, lr: Union[float, str] = 'auto', n_iter: int = 1000, perplexity: float = 30):
+        assert openTSNE is not None, "openTSNE is not installed, use backend='sklearn' instead"
+        super().__init__(lr, n_iter, perplexity, method="fft")
+
+    def fit_transform(self, features, seed):
+        return np.asarray(openTSNE.TSNE(
+            initialization='random',
+            learning_rate=self.lr,
+            n_iter=self.n_iter,
+            perplexity=self.perplexity,
+            negative_gradient_method="fft",
+            random_state=seed,
+        ).fit(features))
+
+
+def get_backend(name: str, lr: Union[float, str] = 'auto', n_iter: int = 1000,
+                perplexity: float = 30) -> ProjectionBackend:
+    # "fast" picks the fastest available approximate method
+    if name == "fast":
+        name = "opentsne" if openTSNE is not None else "sklearn"
+
+    if name == "sklearn":
+        return SklearnTSNEBackend(lr, n_iter, perplexity, method="barnes_hut")
+    elif name == "exact":
+        return SklearnTSNEBackend(lr, n_iter, perplexity, method="exact")
+    elif name == "opentsne":
+        return OpenTSNEBackend(lr, n_iter, perplexity)
+    else:
+        raise ValueError(f"Unknown projection backend: {name}")
+
+
+def pca_reduce(features: np.ndarray, n_components: Optional[int], seed: int = 0) -> np.ndarray:
+    """Reduces (n_samples, n_features) to (n_samples, n_components). No-op if already small enough."""
+    n_samples, n_features = features.shape
+    if n_components is None or n_features <= n_components or n_samples <= n_components:
+        return features
+    return PCA(n_components=n_components, svd_solver="randomized", random_state=seed).fit_transform(features)
+
+
+def stratified_subsample(labels: np.ndarray, max_samples: Optional[int], seed: int = 0) -> np.ndarray:
+    """Returns sorted indices of at most `max_samples` datapoints, with each label represented proportionally."""
+    n = labels.shape[0]
+    if max_samples is None or n <= max_samples:
+        return np.arange(n)
+
+    rng = np.random.default_rng(seed)
+    classes, counts = np.unique(labels, return_counts=True)
+    per_class = np.maximum(1, np.floor(counts / n * max_samples).astype(int))
+    indices = [rng.choice(np.where(labels == c)[0], size=min(k, count), replace=False)
+               for c, k, count in zip(classes, per_class, counts)]
+    return np.sort(np.concatenate(indices))
+
+
+class ProjectionCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def _fingerprint(features: np.ndarray) -> str:
+        # hashing a strided sample of the values is enough to tell different feature sets apart
+        flat = np.ascontiguousarray(features).reshape(-1)
+        sample = flat[:: max(1, flat.shape[0] // 100_000)]
+        return hashlib.sha1(str(features.shape).encode() + sample.tobytes()).hexdigest()
+
+    @staticmethod
+    def _fingerprint_labels(labels: np.ndarray) -> str:
+        # labels can be strings (object arrays), whose bytes are pointers: hash their text instead
+        return hashlib.sha1("\n".join(map(str, np.asarray(labels).reshape(-1))).encode()).hexdigest()
+
+    def key(self, checkpoint: str, features: np.ndarray, params: dict, labels: np.ndarray,
+            indices: np.ndarray) -> str:
+        description = json.dumps({"checkpoint": checkpoint, "params": params}, sort_keys=True, default=str)
+        fingerprints = self._fingerprint(features) + self._fingerprint_labels(labels) + \
+            hashlib.sha1(np.ascontiguousarray(indices, dtype=np.int64).tobytes()).hexdigest()
+        return hashlib.sha1((description + fingerprints).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"projection_{key}.npz")
+
+    def load(self, key: str) -> Optional[tuple]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        return data["projection"], data["indices"]
+
+    def save(self, key: str, projection: np.ndarray, indices: np.ndarray):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self._path(key) + ".tmp.npz"
+        np.savez(tmp_path, projection=projection, indices=indices)
+        os.replace(tmp_path, self._path(key))
+
+
+def project(features: np.ndarray, labels: np.ndarray, backend: ProjectionBackend,
+            pca_components: Optional[int] = None, max_samples: Optional[int] = None, seed: int = 0,
+            cache: Optional[ProjectionCache] = None, checkpoint: Optional[str] = None) -> (np.ndarray, np.ndarray):
+    """
+    :param features: (n_samples, ...) will be flattened to (n_samples, n_features)
+    :param pca_components: reduce the features with PCA first (eg: 50), None: no PCA
+    :param checkpoint: identifies the encoder that produced the features, caching is only done if given
+    :return: projection (n_subsampled, 2) and the labels of the projected datapoints (n_subsampled,)
+    """
+    features = features.reshape(features.shape[0], -1)
+    labels = np.asarray(labels)
+
+    params = {"backend": backend.name, **backend.params(), "pca_components": pca_components,
+              "max_samples": max_samples, "seed": seed}
+    indices = stratified_subsample(labels, max_samples, seed)
+
+    use_cache = cache is not None and checkpoint is not None
+    if use_cache:
+        key = cache.key(checkpoint, features, params, labels, indices)
+        cached = cache.load(key)
+        if cached is not None:
+            projection, indices = cached
+            print(f"Loaded cached projection {key}")
+            return projection, labels[indices]
+
+    reduced = pca_reduce(features[indices], pca_components, seed)
+    projection = backend.fit_transform(reduced, seed)
+
+    if use_cache:
+        cache.save(key, projection, indices)
+
+    return projection, labels[indices]
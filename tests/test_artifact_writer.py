@@ -0,0 +1,20 @@
+import os
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from decoder.artifact_writer import AsyncArtifactWriter
+
+
+def test_close_waits_for_all_wav_files(tmp_path):
+    writer = AsyncArtifactWriter(str(tmp_path))
+    writer.submit("test/std normal samples", torch.randn(3, 1, 2505))
+    writer.submit("test/gt", np.random.randn(2, 2505), captions=["a.wav", "b.wav"])
+    written = writer.close()
+
+    assert len(written["test/std normal samples"]) == 3
+    assert [os.path.basename(path) for path in written["test/gt"]] == ["0_a.wav", "1_b.wav"]
+    audio, sample_rate = sf.read(written["test/gt"][0])
+    assert audio.shape == (2505,) and sample_rate == 16_000
+    assert os.path.exists(os.path.join(tmp_path, "test", "gt", "waveforms.png"))
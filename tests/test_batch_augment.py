@@ -0,0 +1,43 @@
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from vision.data.batch_augment import BatchAugment, BatchAugmentLoader
+
+
+def _images():
+    return torch.randint(0, 256, (4, 3, 8, 8), dtype=torch.uint8, generator=torch.Generator().manual_seed(0))
+
+
+def test_no_augmentation_equals_to_tensor():
+    images = _images()
+    assert torch.equal(BatchAugment(train=False)(images), images.float() / 255)
+
+
+def test_crop_and_flip_equal_slicing():
+    images = _images()
+    out = BatchAugment(crop_size=5, flip=True, train=True, seed=1)(images)
+
+    # same draws as the augmentation: offsets (top, then left), then flip bits
+    generator = BatchAugment(crop_size=5, flip=True, train=True, seed=1).generator
+    top, left = torch.randint(0, 4, (4,), generator=generator), torch.randint(0, 4, (4,), generator=generator)
+    flip = torch.rand(4, generator=generator) < 0.5
+    for i in range(4):
+        crop = images[i, :, top[i]: top[i] + 5, left[i]: left[i] + 5]
+        crop = crop.flip(-1) if flip[i] else crop
+        assert torch.equal(out[i], crop.float() / 255), i
+
+
+def test_grayscale_and_channels_last_shapes():
+    images = _images()
+    assert BatchAugment(grayscale=True)(images).shape == (4, 1, 8, 8)
+    assert BatchAugment(channels_last=True)(images.permute(0, 2, 3, 1)).shape == (4, 3, 8, 8)
+
+
+def test_loader_forwards_dataloader_attributes():
+    loader = DataLoader(TensorDataset(_images(), torch.arange(4)), batch_size=2, num_workers=0)
+    wrapped = BatchAugmentLoader(loader, BatchAugment(crop_size=4, train=False))
+
+    assert wrapped.dataset is loader.dataset and wrapped.sampler is loader.sampler
+    assert wrapped.batch_size == 2 and wrapped.num_workers == 0 and len(wrapped) == 2
+    images, targets = next(iter(wrapped))
+    assert images.shape == (2, 3, 4, 4) and images.dtype == torch.float32
@@ -0,0 +1,35 @@
+import json
+import os
+
+import torch
+
+from utils.checkpoint_manager import CheckpointManager
+
+
+def test_retention_keeps_last_best_and_archived_epochs(tmp_path):
+    manager = CheckpointManager(str(tmp_path), num_to_keep=2, keep_best=True, keep_every=10)
+    model = torch.nn.Linear(4, 2)
+    for epoch, val_loss in enumerate([5., 1., 4., 3., 2., 6., 7., 8., 9., 9., 9., 9.]):
+        manager.save(epoch, {f"model_{epoch}.ckpt": model.state_dict(),
+                             f"optim_{epoch}.ckpt": {"step": torch.tensor(epoch)}},
+                     val_loss=val_loss, archive=[f"model_{epoch}.ckpt"])
+    manager.close()
+
+    # last 2 epochs, the best epoch (1), and only the model of the archived epoch 0 (epoch 10 is one of the last 2)
+    assert set(os.listdir(tmp_path)) == {"model_0.ckpt", "model_1.ckpt", "optim_1.ckpt", "model_10.ckpt",
+                                         "optim_10.ckpt", "model_11.ckpt", "optim_11.ckpt", "checkpoints.json"}
+    assert torch.load(os.path.join(tmp_path, "optim_11.ckpt"))["step"] == 11
+    with open(os.path.join(tmp_path, "checkpoints.json")) as f:
+        assert json.load(f)["best_epoch"] == 1
+
+
+def test_snapshot_is_not_affected_by_later_updates(tmp_path):
+    manager = CheckpointManager(str(tmp_path), asynchronous=False)
+    model = torch.nn.Linear(4, 2)
+    manager.save(0, {"model_0.ckpt": model.state_dict()})
+    expected = model.weight.detach().clone()
+    with torch.no_grad():
+        model.weight.add_(1)
+    manager.close()
+
+    assert torch.equal(torch.load(os.path.join(tmp_path, "model_0.ckpt"))["weight"], expected)
@@ -0,0 +1,24 @@
+import torch
+import torch.nn.functional as F
+
+from vision.models.InfoNCE_Loss import ExpNLLLoss
+
+
+def test_fused_cross_entropy_matches_softmax_and_exp_nll_loss():
+    # (b, 1 + n, y, x) scores, the positive sample at index 0
+    torch.manual_seed(0)
+    b, n, y, x = 2 * 49, 16, 6, 7
+    scores = torch.randn(b, 1 + n, y, x) * 5
+    target = torch.zeros(b, y, x, dtype=torch.long)
+
+    legacy_scores = scores.clone().requires_grad_(True)
+    legacy = ExpNLLLoss()(torch.softmax(legacy_scores, dim=1), target)
+    legacy.backward()
+
+    fused_scores = scores.clone().requires_grad_(True)
+    fused = F.cross_entropy(fused_scores, target)
+    fused.backward()
+
+    # same value and gradients, up to the 1e-11 of the legacy path
+    assert torch.allclose(legacy, fused, atol=1e-4)
+    assert torch.allclose(legacy_scores.grad, fused_scores.grad, atol=1e-5)
@@ -0,0 +1,73 @@
+import types
+
+import numpy as np
+import torch
+
+from decoder.interpolation_contribution_score import InterpolationContributionScore
+
+
+class _LinearDecoder(torch.nn.Module):
+    # like the conv decoder, accepts (nb_dims, nb_frames) as well as (b, nb_dims, nb_frames)
+    def __init__(self, nb_dims, nb_frames):
+        super().__init__()
+        self.linear = torch.nn.Linear(nb_dims * nb_frames, 16)
+
+    def forward(self, z):
+        return self.linear(z.reshape(-1, z.shape[-2] * z.shape[-1])).unsqueeze(1)
+
+
+def _make_score(nb_files=5, nb_dims=8, nb_frames=4, pair_batch_size=7):
+    torch.manual_seed(0)
+    decoder = _LinearDecoder(nb_dims, nb_frames)
+    z = torch.randn(nb_files, nb_dims, nb_frames)
+    filenames = np.array([f"file_{i}" for i in range(nb_files)])
+    with torch.no_grad():
+        x_reconstructed = decoder(z)  # (nb_files, 1, nb_samples)
+
+    # bypasses __init__, which needs a full OptionsConfig
+    score = InterpolationContributionScore.__new__(InterpolationContributionScore)
+    score.opt = types.SimpleNamespace(device=torch.device("cpu"))
+    score.nb_dims = nb_dims
+    score.latent_nb_frames = nb_frames
+    score.lit_decoder = types.SimpleNamespace(decoder=decoder, to=lambda device: score.lit_decoder, eval=lambda: None)
+    score.pair_batch_size = pair_batch_size
+    score.NB_MOST_IMPORTANT_DIMS = [1, 2, 4, 8]
+    score._get_all_data = lambda opt, lit_decoder: (x_reconstructed, None, z, filenames)
+    return score, z, filenames, x_reconstructed
+
+
+def _compute_score_pair_by_pair(score, z, filenames, x_reconstructed):
+    # the original loop: one pair and one decoding at a time
+    nb_files = len(filenames)
+    nb_pairs = nb_files * (nb_files - 1)
+    with torch.no_grad():
+        max_error = sum(score._dist_after_interpol_important_dims(*score._get_two_zs(z, filenames, i, j, False)[:2],
+                                                                   score.nb_dims, max_err=True,
+                                                                   x2_target=x_reconstructed[j])
+                        for i in range(nb_files) for j in range(nb_files) if i != j) / nb_pairs
+
+        results_absolute, results_relative = {}, {}
+        for k in score.NB_MOST_IMPORTANT_DIMS:
+            avg_error = sum(score._dist_after_interpol_important_dims(*score._get_two_zs(z, filenames, i, j, False)[:2],
+                                                                       k, x2_target=x_reconstructed[j])
+                            for i in range(nb_files) for j in range(nb_files) if i != j) / nb_pairs
+            results_absolute[k] = avg_error.item()
+            results_relative[k] = (avg_error / max_error).item()
+    return results_absolute, results_relative
+
+
+def test_pair_indices_match_double_loop():
+    nb_files = 5
+    expected = [(i, j) for i in range(nb_files) for j in range(nb_files) if i != j]
+    i, j = InterpolationContributionScore._pair_indices(0, len(expected), nb_files, torch.device("cpu"))
+    assert list(zip(i.tolist(), j.tolist())) == expected
+
+
+def test_compute_score_matches_pair_by_pair_loop():
+    score, z, filenames, x_reconstructed = _make_score()
+    expected_absolute, expected_relative = _compute_score_pair_by_pair(score, z, filenames, x_reconstructed)
+    absolute, relative = score.compute_score()
+
+    for k in score.NB_MOST_IMPORTANT_DIMS:
+        assert np.isclose(absolute[k], expected_absolute[k], rtol=1e-4), k
+        assert np.isclose(relative[k], expected_relative[k], rtol=1e-4), k
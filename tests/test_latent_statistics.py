@@ -0,0 +1,28 @@
+import numpy as np
+
+from post_hoc_analysis.interpretability.latent_statistics import compute_histograms, compute_kde, get_kde_grid, \
+    LatentStatistics
+
+
+def test_histograms_match_numpy():
+    data = np.random.default_rng(0).standard_normal((8, 10_000)).astype(np.float32)
+    densities, edges = compute_histograms(data, bins=100)
+    for c in range(data.shape[0]):
+        expected, _ = np.histogram(data[c], bins=edges[c], density=True)
+        assert np.allclose(densities[c], expected, atol=1e-2), c
+
+
+def test_kde_integrates_to_one():
+    data = np.random.default_rng(0).standard_normal((8, 10_000))
+    grid = get_kde_grid(data)
+    kde = compute_kde(data, grid)
+    assert np.allclose(kde.sum(axis=1) * (grid[1] - grid[0]), 1, atol=1e-2)
+
+
+def test_kde_grid_covers_data_outside_of_standard_range():
+    # latents that are not ~N(0, 1): a fixed (-4, 4) grid would clip most of the values
+    data = np.random.default_rng(0).normal(loc=10, scale=3, size=(2, 5_000))
+    stats = LatentStatistics.compute(data)
+    assert stats.kde_grid[0] < data.min() and stats.kde_grid[-1] > data.max()
+    step = stats.kde_grid[1] - stats.kde_grid[0]
+    assert np.allclose(stats.kde.sum(axis=1) * step, 1, atol=1e-2)
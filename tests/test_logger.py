@@ -0,0 +1,38 @@
+import os
+import types
+
+import torch
+
+from utils.logger import Logger
+
+
+def _opt(log_path):
+    # the fields of OptionsConfig that Logger uses, for an audio decoder run
+    return types.SimpleNamespace(
+        log_path=log_path, model_path=log_path, experiment="audio", validate=False,
+        encoder_config=types.SimpleNamespace(architecture=types.SimpleNamespace(modules=[None]), start_epoch=0),
+        num_checkpoints_to_keep=1, keep_best_checkpoint=True, async_checkpoints=True)
+
+
+def _save_and_reload(log_path, decoder):
+    # same steps as `train_decoder`: final create_log, wait, then `load_decoder` reads model_0.ckpt
+    logs = Logger(_opt(log_path))
+    logs.create_log(decoder, final_test=True, final_loss=[])
+    logs.wait()
+    return torch.load(os.path.join(log_path, "model_0.ckpt"))
+
+
+def test_checkpoint_can_be_reloaded_right_after_create_log(tmp_path):
+    decoder = torch.nn.Conv1d(4, 1, 3)
+    state_dict = _save_and_reload(str(tmp_path), decoder)
+    assert all(torch.equal(state_dict[name], value) for name, value in decoder.state_dict().items())
+
+
+def test_rerun_reloads_the_new_checkpoint_not_the_previous_one(tmp_path):
+    _save_and_reload(str(tmp_path), torch.nn.Conv1d(4, 1, 3))
+
+    decoder = torch.nn.Conv1d(4, 1, 3)
+    with torch.no_grad():
+        decoder.weight.fill_(1.)
+    state_dict = _save_and_reload(str(tmp_path), decoder)
+    assert torch.equal(state_dict["weight"], decoder.weight)
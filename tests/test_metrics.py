@@ -0,0 +1,24 @@
+import numpy as np
+import torch
+
+from utils.metrics import MetricsAccumulator
+
+
+def test_mean_and_flushed_steps_match_the_values():
+    metrics = MetricsAccumulator(["loss", "nce"], track_steps=True)
+    values = torch.rand(10, 2, 3)  # (nb_steps, nb_metrics, nb_modules)
+    for step in range(10):
+        metrics.update(step, loss=values[step, 0], nce=values[step, 1])
+
+    flushed = metrics.flush_steps()
+    assert [step for step, _ in flushed] == list(range(10))
+    assert np.allclose(flushed[3][1]["nce"], values[3, 1].numpy())
+    assert metrics.flush_steps() == []
+
+    means = metrics.mean()
+    assert np.allclose(means["loss"], values[:, 0].mean(0).numpy(), atol=1e-6)
+    assert np.allclose(metrics.mean(count=5)["nce"], values[:, 1].sum(0).numpy() / 5, atol=1e-6)
+
+
+def test_mean_without_updates_is_empty():
+    assert MetricsAccumulator(["loss"]).mean() == {"loss": []}
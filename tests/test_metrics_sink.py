@@ -0,0 +1,36 @@
+import json
+import os
+
+import torch
+
+from utils.metrics_sink import JsonlBackend, MetricsSink
+
+
+def _read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_vectors_are_expanded_per_index(tmp_path):
+    path = os.path.join(tmp_path, "metrics.jsonl")
+    sink = MetricsSink([JsonlBackend(path)], flush_every=3)
+    for step in range(10):
+        sink.log({"loss/loss": torch.tensor([1., 2., 3.]) * step, "epoch": 0, "acc": torch.tensor(.5)}, step)
+    sink.close()
+
+    records = _read_records(path)
+    assert [record["step"] for record in records] == list(range(10))
+    assert records[4] == {"step": 4, "loss/loss_0": 4., "loss/loss_1": 8., "loss/loss_2": 12., "epoch": 0.,
+                          "acc": .5}
+
+
+def test_rerun_overwrites_previous_records(tmp_path):
+    path = os.path.join(tmp_path, "metrics.jsonl")
+    for _ in range(2):
+        sink = MetricsSink([JsonlBackend(path)])
+        for step in range(3):
+            sink.log({"loss": step}, step)
+        sink.close()
+        sink.close()  # closing twice is fine
+
+    assert [record["step"] for record in _read_records(path)] == [0, 1, 2]
@@ -0,0 +1,38 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+import torch
+
+from config_code.config_classes import DataSetConfig, Dataset
+from vision.data.shapes_3d_dataset import Shapes3dStreamingDataset
+
+
+@pytest.fixture
+def config(tmp_path):
+    nb_rows = 100
+    rng = np.random.default_rng(0)
+    os.makedirs(tmp_path / "3dshapes")
+    with h5py.File(tmp_path / "3dshapes" / "3dshapes.h5", "w") as f:
+        f.create_dataset("images", data=rng.integers(0, 256, (nb_rows, 4, 4, 3), dtype=np.uint8), chunks=(7, 4, 4, 3))
+        labels = np.zeros((nb_rows, 6))
+        labels[:, 4] = np.arange(nb_rows)  # shape label = row, to check which rows were read
+        f.create_dataset("labels", data=labels)
+
+    config = DataSetConfig(Dataset.SHAPES_3D, batch_size=8, streaming=True)
+    config.data_input_dir = str(tmp_path)
+    return config
+
+
+@pytest.mark.parametrize("num_workers", [0, 1, 3])
+def test_len_of_loader_matches_nb_of_batches(config, num_workers):
+    labels = Shapes3dStreamingDataset.get_labels(config)
+    indices = np.setdiff1d(np.arange(len(labels)), np.arange(0, len(labels), 3))  # a split, not block aligned
+    dataset = Shapes3dStreamingDataset(config, indices, labels, shuffle_blocks=2)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=config.batch_size_multiGPU, num_workers=num_workers)
+
+    batches = [shapes for _, shapes in loader]
+    assert len(batches) == len(loader)
+    assert all(len(shapes) == config.batch_size_multiGPU for shapes in batches[:-1])
+    assert sorted(torch.cat(batches).tolist()) == indices.tolist()
@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+from config_code.config_classes import Dataset
+from config_code.sim_setup import SIMSetup
+from decoder.decoderr import Decoder
+from decoder.streaming_decoder import StreamingDecoder, output_length
+
+
+@pytest.mark.parametrize("modul_idx", [0, 1, 2])
+def test_chunked_decoding_matches_full_sequence(modul_idx):
+    setup = SIMSetup(predict_distributions=True, dataset=Dataset.DE_BOER, config_file="", is_cpc=False)
+    architecture = setup.construct_architecture_for_module(modul_idx)
+    architecture.input_dim = architecture.hidden_dim = 16  # small, for speed
+    torch.manual_seed(0)
+    decoder = Decoder(architecture).eval()
+
+    z = torch.randn(2, 16, 1000)  # much longer than the De Boer clips
+    with torch.no_grad():
+        expected = decoder(z)
+        assert expected.shape[-1] == output_length(decoder, z.shape[-1])
+        for chunk_frames in [1, 7, 64, 300]:
+            actual = StreamingDecoder(decoder, chunk_frames=chunk_frames).decode(z)
+            assert actual.shape == expected.shape, chunk_frames
+            assert torch.allclose(actual, expected, atol=1e-5), chunk_frames
+
+
+def test_feed_and_flush_match_decode():
+    setup = SIMSetup(predict_distributions=True, dataset=Dataset.DE_BOER, config_file="", is_cpc=False)
+    architecture = setup.construct_architecture_for_module(2)
+    architecture.input_dim = architecture.hidden_dim = 16
+    decoder = Decoder(architecture).eval()
+    streaming = StreamingDecoder(decoder)
+
+    z = torch.randn(1, 16, 200)
+    with torch.no_grad():
+        chunks = [streaming.feed(z[..., start: start + 33]) for start in range(0, z.shape[-1], 33)]
+        actual = torch.cat(chunks + [streaming.flush()], dim=-1)
+        assert torch.allclose(actual, decoder(z), atol=1e-5)
@@ -0,0 +1,164 @@
+"""
+Writes checkpoints without stalling the training loop.
+
+`save` only copies the state dicts to the cpu (a snapshot, so the training can continue updating the parameters);
+serializing and writing happens in a background thread. Files are first written to `{path}.tmp` and then renamed,
+so a crash during the write never leaves a truncated `.ckpt` behind. Pending writes are finished at exit.
+
+Retention: after each save, the files of older epochs are removed, except for
+- the last `num_to_keep` epochs,
+- the epoch with the lowest validation loss (if `keep_best`),
+- every `keep_every`-th epoch (only the files passed as `archive`, eg: the model but not the optimizer).
+Only the files written by this manager are considered, files of previous runs are never removed.
+
+Example:
+    checkpoints = CheckpointManager(opt.log_path, num_to_keep=1, keep_best=True)
+    checkpoints.save(epoch, {f"model_{epoch}.ckpt": model.state_dict(), f"optim_{epoch}.ckpt": optimizer.state_dict()},
+                     val_loss=val_loss, archive=[f"model_{epoch}.ckpt"])
+    checkpoints.submit(draw_plots, train_loss)  # any other slow work, eg: plots
+    checkpoints.close()
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+from typing import Dict, Iterable, Optional
+
+import torch
+
+
+def snapshot_state_dict(state):
+    """Copy of a (nested) state dict, with all tensors copied to the cpu."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return type(state)((key, snapshot_state_dict(value)) for key, value in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot_state_dict(value) for value in state)
+    return state
+
+
+def atomic_save(obj, path: str):
+    tmp_path = f"{path}.tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)  # atomic on posix and windows
+
+
+class CheckpointManager:
+    def __init__(self, log_path: str, num_to_keep: int = 1, keep_best: bool = True, keep_every: int = 10,
+                 asynchronous: bool = True, max_pending: int = 2):
+        """
+        :param keep_every: keep the archived files of every epoch divisible by this (0: disabled)
+        :param max_pending: nb of saves that can be queued, a next `save` blocks (bounds the memory of the snapshots)
+        """
+        assert num_to_keep > 0, "Dont delete all models!!!"
+        self.log_path = log_path
+        self.num_to_keep = num_to_keep
+        self.keep_best = keep_best
+        self.keep_every = keep_every
+        self.asynchronous = asynchronous
+
+        self._files: Dict[int, Dict[str, bool]] = {}  # epoch -> {file name: archived}
+        self.best_epoch: Optional[int] = None
+        self.best_val_loss: Optional[float] = None
+        self._error = None
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        if asynchronous:
+            self._thread = threading.Thread(target=self._run, name="CheckpointManager", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def save(self, epoch: int, state_dicts: Dict[str, dict], val_loss: Optional[float] = None,
+             archive: Optional[Iterable[str]] = None):
+        """
+        :param state_dicts: {file name (relative to log_path): state dict}
+        :param val_loss: validation loss of this epoch, used to keep the best checkpoint
+        :param archive: file names that are kept on every `keep_every`-th epoch (default: all)
+        """
+        snapshots = {name: snapshot_state_dict(state) for name, state in state_dicts.items()}
+        archive = set(state_dicts) if archive is None else set(archive)
+        self.submit(self._write, epoch, snapshots, val_loss, archive)
+
+    def submit(self, fn, *args):
+        """Runs `fn(*args)` in the background thread, after the previously submitted work."""
+        self._raise_if_failed()
+        if self._thread is None or not self._thread.is_alive():  # synchronous, or already closed
+            fn(*args)
+        else:
+            self._queue.put((fn, args))
+
+    def wait(self):
+        """Blocks until all submitted work is done."""
+        if self._thread is not None:
+            self._queue.join()
+        self._raise_if_failed()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_if_failed()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                if self._error is None:
+                    fn, args = item
+                    fn(*args)
+            except Exception as e:  # raised in the training thread on the next call
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing checkpoints failed") from error
+
+    def _write(self, epoch, snapshots, val_loss, archive):
+        for name, state in snapshots.items():
+            atomic_save(state, os.path.join(self.log_path, name))
+
+        files = self._files.setdefault(epoch, {})
+        files.update({name: name in archive for name in snapshots})
+
+        if val_loss is not None and (self.best_val_loss is None or val_loss < self.best_val_loss):
+            self.best_epoch, self.best_val_loss = epoch, val_loss
+
+        self._remove_old_checkpoints(current_epoch=epoch)
+        self._write_index()
+
+    def _remove_old_checkpoints(self, current_epoch):
+        epochs = sorted(self._files)
+        keep = set(epochs[-self.num_to_keep:]) | {current_epoch}
+        if self.keep_best and self.best_epoch is not None:
+            keep.add(self.best_epoch)
+
+        for epoch in epochs:
+            if epoch in keep:
+                continue
+            is_archived_epoch = self.keep_every > 0 and epoch % self.keep_every == 0
+            for name, archived in list(self._files[epoch].items()):
+                if is_archived_epoch and archived:
+                    continue
+                try:
+                    os.remove(os.path.join(self.log_path, name))
+                except FileNotFoundError:
+                    pass
+                del self._files[epoch][name]
+            if not self._files[epoch]:
+                del self._files[epoch]
+
+    def _write_index(self):
+        path = os.path.join(self.log_path, "checkpoints.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"epochs": {str(epoch): sorted(files) for epoch, files in sorted(self._files.items())},
+                       "best_epoch": self.best_epoch, "best_val_loss": self.best_val_loss}, f, indent=2)
+        os.replace(f"{path}.tmp", path)
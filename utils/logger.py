@@ -1,6 +1,6 @@
 import os
 import torch
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 import copy
 
@@ -10,6 +10,7 @@ except:
     print("tikzplotlib not installed, will not save loss as tex")
 
 from config_code.config_classes import OptionsConfig
+from utils.checkpoint_manager import CheckpointManager
 
 
 class Logger:
@@ -54,8 +55,12 @@ class Logger:
             else:
                 self.val_loss = None
 
-        self.num_models_to_keep = 1
-        assert self.num_models_to_keep > 0, "Dont delete all models!!!"
+        # checkpoints are written in a background thread; old ones are removed, except for the last
+        # `num_checkpoints_to_keep` epochs, the best epoch (validation loss) and the model of every 10th epoch
+        self.checkpoints = CheckpointManager(opt.log_path, num_to_keep=opt.num_checkpoints_to_keep,
+                                             keep_best=opt.keep_best_checkpoint, keep_every=10,
+                                             asynchronous=opt.async_checkpoints)
+        self._nb_val_losses_saved = len(self.val_loss[0]) if self.val_loss is not None else 0  # (from last training)
 
     def np_save(self, path, data):
         np.save(path, data)
@@ -79,81 +84,20 @@ class Logger:
 
         print("Saving model and log-file to " + self.opt.log_path)
 
-        # Save the model checkpoint
+        # Save the model checkpoint (only copied to the cpu here, written in the background)
         if self.opt.experiment == "vision":
-            for idx, layer in enumerate(model.module.encoder):
-                torch.save(
-                    layer.state_dict(),
-                    os.path.join(
-                        self.opt.log_path, "model_{}_{}.ckpt".format(idx, epoch)
-                    ),
-                )
+            model_files = {f"model_{idx}_{epoch}.ckpt": layer.state_dict()
+                           for idx, layer in enumerate(model.module.encoder)}
         else:
-            torch.save(
-                model.state_dict(),
-                os.path.join(self.opt.log_path, "model_{}.ckpt".format(epoch)),
-            )
-
-        ### remove old model files to keep dir uncluttered
-        if (epoch - self.num_models_to_keep) % 10 != 0:
-            try:
-                if self.opt.experiment == "vision":
-                    for idx, _ in enumerate(model.module.encoder):
-                        os.remove(
-                            os.path.join(
-                                self.opt.log_path,
-                                "model_{}_{}.ckpt".format(
-                                    idx, epoch - self.num_models_to_keep
-                                ),
-                            )
-                        )
-                else:
-                    os.remove(
-                        os.path.join(
-                            self.opt.log_path,
-                            "model_{}.ckpt".format(epoch - self.num_models_to_keep),
-                        )
-                    )
-            except:
-                print("not enough models there yet, nothing to delete")
+            model_files = {f"model_{epoch}.ckpt": model.state_dict()}
 
+        state_dicts = dict(model_files)
         if classification_model is not None:
-            # Save the predict model checkpoint
-            torch.save(
-                classification_model.state_dict(),
-                os.path.join(
-                    self.opt.log_path, "classification_model_{}.ckpt".format(epoch)
-                ),
-            )
-
-            ### remove old model files to keep dir uncluttered
-            try:
-                os.remove(
-                    os.path.join(
-                        self.opt.log_path,
-                        "classification_model_{}.ckpt".format(
-                            epoch - self.num_models_to_keep
-                        ),
-                    )
-                )
-            except:
-                print("not enough models there yet, nothing to delete")
-
+            state_dicts[f"classification_model_{epoch}.ckpt"] = classification_model.state_dict()
         if optimizer is not None:
-            torch.save(
-                optimizer.state_dict(),
-                os.path.join(self.opt.log_path, "optim_{}.ckpt".format(epoch)),
-            )
+            state_dicts[f"optim_{epoch}.ckpt"] = optimizer.state_dict()
 
-            try:
-                os.remove(
-                    os.path.join(
-                        self.opt.log_path,
-                        "optim_{}.ckpt".format(epoch - self.num_models_to_keep),
-                    )
-                )
-            except:
-                print("not enough models there yet, nothing to delete")
+        self.checkpoints.save(epoch, state_dicts, val_loss=self._get_new_val_loss(), archive=model_files)
 
         # Save hyper-parameters
         path = os.path.join(self.opt.log_path, "log.txt")
@@ -190,6 +134,17 @@ class Logger:
             # self.np_save(os.path.join(self.opt.log_path, "final_loss"), final_loss)
             np.save(os.path.join(self.opt.log_path, "final_loss"), final_loss)
 
+    def _get_new_val_loss(self):
+        # summed over the modules, only if validated since the previous checkpoint (eg: not for the final `create_log`)
+        if self.val_loss is None or len(self.val_loss[0]) <= self._nb_val_losses_saved:
+            return None
+        self._nb_val_losses_saved = len(self.val_loss[0])
+        return float(sum(loss[-1] for loss in self.val_loss if len(loss) > 0))
+
+    def wait(self):
+        """Blocks until all checkpoints and plots are written (also happens automatically at exit)."""
+        self.checkpoints.wait()
+
     def create_decoder_log(self, decoder, epoch):
         print("Saving model and log-file to " + self.opt.log_path)
 
@@ -200,33 +155,9 @@ class Logger:
         )
 
     def draw_loss_curve(self):
-        for idx, loss in enumerate(self.train_loss):
-            lst_iter = np.arange(len(loss))
-            plt.plot(lst_iter, np.array(loss), "-b", label="train loss")
-
-            if (
-                    self.loss_last_training is not None
-                    and len(self.loss_last_training) > idx
-            ):
-                lst_iter = np.arange(len(self.loss_last_training[idx]))
-                plt.plot(lst_iter, self.loss_last_training[idx], "-g")
-
-            if self.val_loss is not None and len(self.val_loss) > idx:
-                lst_iter = np.arange(len(self.val_loss[idx]))
-                plt.plot(lst_iter, np.array(self.val_loss[idx]), "-r", label="val loss")
-
-            plt.xlabel("epoch")
-            plt.ylabel("loss")
-            plt.legend(loc="upper right")
-            # plt.axis([0, max(200,len(loss)+self.opt.encoder_config.start_epoch), 0, -round(np.log(1/(self.opt["negative_samples"]+1)),1)])
-
-            # save image
-            plt.savefig(os.path.join(self.opt.log_path, f"loss_{idx}.png"))
-            try:
-                tikzplotlib.save(os.path.join(self.opt.log_path, f"loss_{idx}.tex"))
-            except:
-                pass
-            plt.close()
+        # rendered in the background thread of the checkpoints, on copies of the losses
+        self.checkpoints.submit(_draw_loss_curves, self.opt.log_path, copy.deepcopy(self.train_loss),
+                                copy.deepcopy(self.loss_last_training), copy.deepcopy(self.val_loss))
 
     def append_train_loss(self, train_loss):
         for idx, elem in enumerate(train_loss):
@@ -235,3 +166,34 @@ class Logger:
     def append_val_loss(self, val_loss):
         for idx, elem in enumerate(val_loss):
             self.val_loss[idx].append(elem)
+
+
+def _draw_loss_curves(log_path, train_loss, loss_last_training, val_loss):
+    # Figure instead of pyplot: pyplot keeps global state and is not thread safe
+    for idx, loss in enumerate(train_loss):
+        fig = Figure()
+        ax = fig.add_subplot()
+        lst_iter = np.arange(len(loss))
+        ax.plot(lst_iter, np.array(loss), "-b", label="train loss")
+
+        if (
+                loss_last_training is not None
+                and len(loss_last_training) > idx
+        ):
+            lst_iter = np.arange(len(loss_last_training[idx]))
+            ax.plot(lst_iter, loss_last_training[idx], "-g")
+
+        if val_loss is not None and len(val_loss) > idx:
+            lst_iter = np.arange(len(val_loss[idx]))
+            ax.plot(lst_iter, np.array(val_loss[idx]), "-r", label="val loss")
+
+        ax.set_xlabel("epoch")
+        ax.set_ylabel("loss")
+        ax.legend(loc="upper right")
+
+        # save image
+        fig.savefig(os.path.join(log_path, f"loss_{idx}.png"))
+        try:
+            tikzplotlib.save(os.path.join(log_path, f"loss_{idx}.tex"), figure=fig)
+        except:
+            pass
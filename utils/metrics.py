@@ -0,0 +1,61 @@
+from typing import Dict, List, Optional
+
+import torch
+
+
+class MetricsAccumulator:
+    """
+    Running sums of per-module metrics (eg: loss, nce, kld), kept on the device of the metrics. Calling `.item()` or
+    `.cpu()` on every step forces a host sync, which serializes the gpu pipeline; here the values are only copied to
+    the host in `mean` (once per epoch) and in `flush_steps` (eg: every `print_idx` steps, for logging).
+
+    Example:
+        metrics = MetricsAccumulator(["loss", "nce", "kld"], track_steps=opt.use_wandb)
+        for step, batch in enumerate(loader):
+            loss, nce, kld = model(batch)
+            metrics.update(step, loss=loss, nce=nce, kld=kld)  # each: (nb_modules,) tensor
+        epoch_means = metrics.mean()  # {"loss": [...], "nce": [...], "kld": [...]}, one sync
+    """
+
+    def __init__(self, names: List[str], track_steps: bool = False):
+        """:param track_steps: also keep the values of each step, until `flush_steps` (for per-step logging)"""
+        self.names = names
+        self.track_steps = track_steps
+        self.reset()
+
+    def reset(self):
+        self.sums: Dict[str, Optional[torch.Tensor]] = {name: None for name in self.names}
+        self.count = 0
+        self._steps: List[int] = []
+        self._step_values: List[torch.Tensor] = []  # (nb_metrics, nb_modules) per step, on the device
+
+    def update(self, step: int = None, **metrics: torch.Tensor):
+        for name in self.names:
+            value = metrics[name].detach()
+            self.sums[name] = value.clone() if self.sums[name] is None else self.sums[name] + value
+        self.count += 1
+
+        if self.track_steps:
+            self._steps.append(step if step is not None else self.count - 1)
+            self._step_values.append(torch.stack([metrics[name].detach() for name in self.names]))
+
+    def mean(self, count: int = None) -> Dict[str, List[float]]:
+        """
+        :param count: divide by this instead of the nb of updates (eg: `total_step`, as in the original loops)
+        :return: per metric, the mean value per module. One host sync for all metrics.
+        """
+        count = count if count is not None else self.count
+        if self.count == 0 or count == 0:
+            return {name: [] for name in self.names}
+        sums = torch.stack([self.sums[name] for name in self.names]).cpu().numpy()
+        return {name: list(sums[i] / count) for i, name in enumerate(self.names)}
+
+    def flush_steps(self) -> List[tuple]:
+        """:return: [(step, {name: np.ndarray (nb_modules,)}), ...] of the steps since the last flush, one sync"""
+        if not self._step_values:
+            return []
+        values = torch.stack(self._step_values).cpu().numpy()  # (nb_steps, nb_metrics, nb_modules)
+        flushed = [(step, {name: values[i, j] for j, name in enumerate(self.names)})
+                   for i, step in enumerate(self._steps)]
+        self._steps, self._step_values = [], []
+        return flushed
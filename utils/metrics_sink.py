@@ -0,0 +1,173 @@
+"""
+Buffered, asynchronous logging of scalar metrics.
+
+`log` only stores references to the (detached) tensors; no host sync and no backend call happens during the step.
+Every `flush_every` steps, all buffered tensor values are copied to the host at once (one transfer per device,
+regardless of the nb of modules or metrics) and a background thread writes the records to the backends:
+a local JSONL file (always works, also without network access), optionally Parquet, and wandb (one `wandb.log`
+call per step with all keys; without network access use the override `wandb_offline=True`).
+
+Example:
+    sink = MetricsSink([JsonlBackend(f"{opt.log_path}/metrics.jsonl"), WandbBackend()])
+    for step, batch in enumerate(loader):
+        ...
+        sink.log({"loss/loss": loss, "epoch": epoch}, step=step)  # loss: (nb_modules,) -> loss/loss_0, loss/loss_1..
+    sink.close()
+"""
+
+import json
+import os
+import queue
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+_STOP = None  # sentinel that ends the worker thread
+
+
+class SinkBackend:
+    def write(self, records: List[dict]):
+        """:param records: [{"step": int, key: float, ...}, ...] in order of steps"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonlBackend(SinkBackend):
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "w")  # a rerun in the same log_path starts over, as the steps start over as well
+
+    def write(self, records):
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetBackend(SinkBackend):
+    """Keeps all records and writes them once on `close` (parquet files can't be appended to). Requires pandas."""
+
+    def __init__(self, path: str):
+        import pandas  # optional dependency, only needed for this backend
+        self.pandas = pandas
+        self.path = path
+        self.records = []
+
+    def write(self, records):
+        self.records.extend(records)
+
+    def close(self):
+        if self.records:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.pandas.DataFrame.from_records(self.records).to_parquet(self.path)
+
+
+class WandbBackend(SinkBackend):
+    def __init__(self, step_metric: Optional[str] = None):
+        """
+        :param step_metric: log the step as this metric instead of as wandb's step (eg: for resumed runs, where
+        wandb would drop steps that are lower than the steps of the encoder training)
+        """
+        self.step_metric = step_metric
+
+    def write(self, records):
+        import wandb
+        for record in records:
+            record = dict(record)
+            step = record.pop("step")
+            if self.step_metric is None:
+                wandb.log(record, step=step)
+            else:
+                record[self.step_metric] = step
+                wandb.log(record)
+
+
+class MetricsSink:
+    def __init__(self, backends: List[SinkBackend], flush_every: int = 100):
+        self.backends = backends
+        self.flush_every = flush_every
+        self._buffer: List[tuple] = []  # (step, {key: value}), values not converted yet
+        self._queue = queue.Queue()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="MetricsSink", daemon=True)
+        self._thread.start()
+
+    def log(self, metrics: Dict[str, object], step: int):
+        """
+        :param metrics: scalars, or 1-d tensors/arrays/lists, which are expanded to `{key}_{idx}` (eg: per module)
+        """
+        self._buffer.append((step, {key: value.detach() if isinstance(value, torch.Tensor) else value
+                                    for key, value in metrics.items()}))
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Converts the buffered values (one host copy per device) and hands them to the background thread."""
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, []
+
+        # gather all tensors per device, flatten + concatenate + copy once
+        tensors: Dict[torch.device, List[torch.Tensor]] = {}
+        for _, metrics in buffer:
+            for value in metrics.values():
+                if isinstance(value, torch.Tensor):
+                    tensors.setdefault(value.device, []).append(value.reshape(-1).float())
+        host = {device: iter(torch.cat(values).cpu().numpy().tolist()) for device, values in tensors.items()}
+
+        records = []
+        for step, metrics in buffer:
+            record = {"step": step}
+            for key, value in metrics.items():
+                if isinstance(value, torch.Tensor):
+                    values = [next(host[value.device]) for _ in range(value.numel())]
+                    is_vector = value.dim() > 0
+                else:
+                    values = np.asarray(value, dtype=np.float64).reshape(-1).tolist()
+                    is_vector = np.ndim(value) > 0
+                if is_vector:
+                    record.update({f"{key}_{idx}": v for idx, v in enumerate(values)})
+                else:
+                    record[key] = values[0]
+            records.append(record)
+        self._queue.put(records)
+
+    def close(self):
+        """Writes the remaining metrics and closes the backends. Can be called more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        for backend in self.backends:
+            backend.close()
+        if self._error is not None:
+            print(f"MetricsSink: failed to write metrics: {self._error}")
+
+    def _run(self):
+        while True:
+            records = self._queue.get()
+            if records is _STOP:
+                break
+            for backend in self.backends:
+                try:
+                    backend.write(records)
+                except Exception as e:  # a failing backend (eg: no network) doesn't stop the training
+                    self._error = e
+
+
+def get_metrics_sink(opt, name: str = "metrics", use_wandb: Optional[bool] = None,
+                     wandb_step_metric: Optional[str] = None, flush_every: int = 100) -> MetricsSink:
+    """JSONL in the log directory, + wandb if `use_wandb` (default: `opt.use_wandb`)."""
+    backends: List[SinkBackend] = [JsonlBackend(os.path.join(opt.log_path, f"{name}.jsonl"))]
+    if opt.use_wandb if use_wandb is None else use_wandb:
+        backends.append(WandbBackend(step_metric=wandb_step_metric))
+    return MetricsSink(backends, flush_every=flush_every)
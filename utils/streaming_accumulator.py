@@ -0,0 +1,77 @@
+from typing import Optional
+
+import numpy as np
+
+
+class StreamingAccumulator:
+    """
+    Collects batches of data and labels into a preallocated array, instead of growing an array with
+    `np.vstack` on every batch (which copies everything gathered so far on each iteration).
+
+    The buffer is allocated on the first call to `append`, when the shape of a single datapoint is known.
+    If `memmap_path` is given, the data is written to a memory-mapped .npy file instead of RAM.
+
+    Example:
+        acc = StreamingAccumulator(capacity=len(loader.dataset))
+        for x, label in loader:
+            acc.append(encoder(x).cpu().numpy(), label)
+        all_data, all_labels = acc.result()
+    """
+
+    def __init__(self, capacity: int, dtype=np.float32, memmap_path: Optional[str] = None):
+        assert capacity > 0, f"capacity must be positive. Got {capacity}"
+        self.capacity = capacity
+        self.dtype = dtype
+        self.memmap_path = memmap_path
+
+        self.data: Optional[np.ndarray] = None
+        self.labels: Optional[np.ndarray] = None
+        self.size = 0
+
+    def _allocate(self, sample_shape, label_dtype):
+        shape = (self.capacity,) + tuple(sample_shape)
+        if self.memmap_path is not None:
+            self.data = np.lib.format.open_memmap(self.memmap_path, mode="w+", dtype=self.dtype, shape=shape)
+        else:
+            self.data = np.empty(shape, dtype=self.dtype)
+        self.labels = np.empty((self.capacity,), dtype=label_dtype)
+
+    def _grow(self, min_capacity: int):
+        # only needed when the capacity hint was too small (eg: len(loader.dataset) vs. a sampler)
+        if self.memmap_path is not None:
+            raise ValueError(f"Memory-mapped accumulator is full (capacity={self.capacity}), "
+                             f"cannot append {min_capacity - self.size} more datapoints.")
+        self.capacity = max(min_capacity, 2 * self.capacity)
+        data = np.empty((self.capacity,) + self.data.shape[1:], dtype=self.dtype)
+        labels = np.empty((self.capacity,), dtype=self.labels.dtype)
+        data[:self.size] = self.data[:self.size]
+        labels[:self.size] = self.labels[:self.size]
+        self.data, self.labels = data, labels
+
+    def append(self, data, labels):
+        # data: (batch_size, ...), labels: (batch_size,), either numpy arrays or cpu tensors
+        data = np.asarray(data)
+        labels = np.asarray(labels)
+        batch_size = data.shape[0]
+        assert labels.shape[0] == batch_size, f"Got {batch_size} datapoints but {labels.shape[0]} labels"
+
+        if self.data is None:
+            self._allocate(data.shape[1:], labels.dtype)
+        elif np.result_type(self.labels.dtype, labels.dtype) != self.labels.dtype:  # eg: longer string labels
+            self.labels = self.labels.astype(np.result_type(self.labels.dtype, labels.dtype))
+        if self.size + batch_size > self.capacity:
+            self._grow(self.size + batch_size)
+
+        self.data[self.size: self.size + batch_size] = data
+        self.labels[self.size: self.size + batch_size] = labels
+        self.size += batch_size
+
+    def __len__(self):
+        return self.size
+
+    def result(self) -> (np.ndarray, np.ndarray):
+        """Returns views of the filled part of the buffers: (data, labels)."""
+        assert self.data is not None, "Nothing was appended"
+        if self.memmap_path is not None:
+            self.data.flush()
+        return self.data[:self.size], self.labels[:self.size]
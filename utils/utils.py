@@ -2,7 +2,6 @@ import os
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
-from sklearn.manifold import TSNE
 import torch
 
 from config_code.config_classes import OptionsConfig, Dataset, DecoderConfig, ClassifierConfig
@@ -79,10 +78,14 @@ def scatter(opt, x, colors, label):
     plt.close()
 
 
-def fit_TSNE_and_plot(opt, feature_space, speaker_labels, label):
-    projection = TSNE(init='random',
-                      learning_rate=200.0,
-                      perplexity=30).fit_transform(feature_space)
+def fit_TSNE_and_plot(opt, feature_space, speaker_labels, label, backend="sklearn", pca_components=None,
+                      max_samples=None):
+    from post_hoc_analysis.interpretability.projection import project, get_backend  # avoid circular import
+
+    projection, speaker_labels = project(feature_space, speaker_labels,
+                                         get_backend(backend, lr=200.0, perplexity=30),
+                                         pca_components=pca_components, max_samples=max_samples,
+                                         seed=max(opt.seed, 0))
 
     scatter(opt, projection, speaker_labels, label)
 
@@ -144,8 +147,13 @@ def get_nb_classes(dataset: Dataset, args: None):
     return nb_classes
 
 
+def get_wandb_mode(options: OptionsConfig):
+    # offline runs are stored in ./wandb and can be uploaded later with `wandb sync`
+    return "offline" if options.wandb_offline else None
+
+
 def initialize_wandb(options: OptionsConfig, project_name, run_name):
-    wandb.init(project=project_name, name=run_name, config=vars(options))
+    wandb.init(project=project_name, name=run_name, config=vars(options), mode=get_wandb_mode(options))
     # After initializing the wandb run, get the run id
     run_id = wandb.run.id
     # Save the run id to a file in the logs directory
@@ -2,6 +2,7 @@ import time
 import torch
 
 from config_code.config_classes import OptionsConfig
+from utils.metrics import MetricsAccumulator
 
 
 def val_by_InfoNCELoss(opt: OptionsConfig, model, test_loader):
@@ -12,20 +13,20 @@ def val_by_InfoNCELoss(opt: OptionsConfig, model, test_loader):
 
     nb_modules = len(opt.encoder_config.architecture.modules)
 
-    loss_epoch = [0 for i in range(nb_modules)]
+    metrics = MetricsAccumulator(["loss"])  # summed on the device, one sync at the end
     starttime = time.time()
 
     for step, (audio, _, _, _) in enumerate(test_loader):
         model_input = audio.to(opt.device)
 
         loss, nce, kld = model(model_input)
-        loss = torch.mean(loss, 0)
-
-        loss_epoch += loss.data.cpu().numpy()
+        metrics.update(loss=torch.mean(loss, 0))
 
         if step >= total_step:
             break
 
+    loss_epoch = metrics.mean(count=1)["loss"] or [0 for _ in range(nb_modules)]  # sums
+
     # TODO: added, temporary
     for i in range(nb_modules):
         if total_step != 0:
@@ -0,0 +1,69 @@
+# Example usage:
+# python -m vision.benchmark_contrastive_loss
+# python -m vision.benchmark_contrastive_loss --batch_size 64 --negative_samples 16 --iters 50
+
+"""
+Times the two contrastive loss paths of `InfoNCE_Loss` (forward + backward) on (b, 1+n, y, x) scores:
+- softmax followed by `ExpNLLLoss` (log(p + 1e-11)), `fused_contrastive_loss=False`
+- `F.cross_entropy` (log-softmax + nll in one pass), `fused_contrastive_loss=True`
+The default shape is that of k=1 for a 7x7 grid of patches: y = 7 - 2, x = 7.
+"""
+
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from vision.models.InfoNCE_Loss import ExpNLLLoss
+
+
+def _time(loss_fn, scores: torch.Tensor, iters: int, warmup: int = 3) -> (float, torch.Tensor):
+    """:return: ms per iteration (forward + backward) and the last loss"""
+    scores = scores.clone().requires_grad_(True)
+    for _ in range(warmup):
+        loss_fn(scores).backward()
+    if scores.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(iters):
+        loss = loss_fn(scores)
+        loss.backward()
+    if scores.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / iters * 1000, loss.detach()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark softmax + ExpNLLLoss vs F.cross_entropy")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--negative_samples", type=int, default=16)
+    parser.add_argument("--y", type=int, default=5)
+    parser.add_argument("--x", type=int, default=7)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    b, n, y, x = args.batch_size, args.negative_samples, args.y, args.x
+    scores = torch.randn(b, 1 + n, y, x, device=device) * 5
+    target = torch.zeros(b, y, x, dtype=torch.long, device=device)
+    expnll = ExpNLLLoss()
+
+    def legacy(s):
+        return expnll(torch.softmax(s, dim=1), target)
+
+    def fused(s):
+        return F.cross_entropy(s, target)
+
+    print(f"scores: (b, 1+n, y, x) = {tuple(scores.shape)} on {device}")
+    results = {}
+    for name, loss_fn in [("softmax + ExpNLLLoss", legacy), ("F.cross_entropy", fused)]:
+        ms, loss = _time(loss_fn, scores, args.iters)
+        results[name] = ms
+        print(f"{name}: {ms:.3f} ms/iter (fwd + bwd), loss={loss.item():.6f}")
+    print(f"speedup: {results['softmax + ExpNLLLoss'] / results['F.cross_entropy']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,58 @@
+import json
 import os
 from glob import glob
+from multiprocessing import Pool
 
+import numpy as np
 import torch
 from PIL import Image
 from torch.utils.data import Dataset
 
 from config_code.config_classes import DataSetConfig
 
+RESIZED_CACHE_SIZE = 96  # side of the cached images, random crops of 64x64 are taken from these
+
+
+def _load_resized(args):
+    # shorter side resized to `size`, then center crop to size x size
+    file_name, size = args
+    with Image.open(file_name) as im:
+        im = im.convert('RGB')
+        scale = size / min(im.size)
+        width, height = max(size, round(im.width * scale)), max(size, round(im.height * scale))
+        im = im.resize((width, height), Image.BILINEAR)
+        left, top = (width - size) // 2, (height - size) // 2
+        return np.asarray(im.crop((left, top, left + size, top + size)), dtype=np.uint8)
+
+
+def build_resized_cache(img_names, img_index, cache_dir: str, size: int, num_workers: int = 0):
+    """
+    Decodes + resizes all images once and stores them in `cache_dir`:
+    images.npy (nb_images, size, size, 3) uint8 (memory-mapped), labels.npy (nb_images,) and files.txt.
+    """
+    print(f"Building resized cache ({size}x{size}) of {len(img_names)} AwA2 images in {cache_dir}")
+    os.makedirs(cache_dir, exist_ok=True)
+    images = np.lib.format.open_memmap(os.path.join(cache_dir, "images.npy"), mode="w+", dtype=np.uint8,
+                                       shape=(len(img_names), size, size, 3))
+
+    args = [(file_name, size) for file_name in img_names]
+    if num_workers > 0:
+        with Pool(num_workers) as pool:
+            for idx, im in enumerate(pool.imap(_load_resized, args, chunksize=64)):
+                images[idx] = im
+    else:
+        for idx, arg in enumerate(args):
+            images[idx] = _load_resized(arg)
+    images.flush()
+
+    np.save(os.path.join(cache_dir, "labels.npy"), np.asarray(img_index, dtype=np.int64))
+    with open(os.path.join(cache_dir, "files.txt"), "w") as f:
+        f.write("\n".join(img_names))
+
+    # only written once everything is on disk, an interrupted run is redone from scratch
+    with open(os.path.join(cache_dir, "done.json"), "w") as f:
+        json.dump({"nb_images": len(img_names), "size": size}, f)
+
 
 class AnimalsWithAttributesDataset(Dataset):
     # https://github.com/dfan/awa2-zero-shot-learning/blob/master/AnimalDataset.py
@@ -14,6 +60,21 @@ class AnimalsWithAttributesDataset(Dataset):
         data_dir = f"{config.data_input_dir}/awa2-dataset/AwA2-data/Animals_with_Attributes2/"
         self.transform = None
 
+        self.resized_images = None  # (nb_images, size, size, 3) uint8 memmap, if `use_resized_cache`
+        if config.use_resized_cache:
+            cache_dir = os.path.join(data_dir, f"resized_{RESIZED_CACHE_SIZE}")
+            if not os.path.exists(os.path.join(cache_dir, "done.json")):
+                img_names, img_index = self._find_images(data_dir)
+                build_resized_cache(img_names, img_index, cache_dir, RESIZED_CACHE_SIZE, config.num_workers)
+            self.resized_images = np.load(os.path.join(cache_dir, "images.npy"), mmap_mode="r")
+            self.img_index = np.load(os.path.join(cache_dir, "labels.npy")).tolist()
+            with open(os.path.join(cache_dir, "files.txt")) as f:
+                self.img_names = f.read().splitlines()
+        else:
+            self.img_names, self.img_index = self._find_images(data_dir)
+
+    @staticmethod
+    def _find_images(data_dir: str):
         class_to_index = dict()
         # Build dictionary of indices to classes
         with open(f'{data_dir}/classes.txt') as f:
@@ -22,7 +83,6 @@ class AnimalsWithAttributesDataset(Dataset):
                 class_name = line.split('\t')[1].strip()
                 class_to_index[class_name] = index
                 index += 1
-        self.class_to_index = class_to_index
 
         img_names = []
         img_index = []
@@ -37,13 +97,17 @@ class AnimalsWithAttributesDataset(Dataset):
                 for file_name in files:
                     img_names.append(file_name)
                     img_index.append(class_index)
-        self.img_names = img_names
-        self.img_index = img_index
+        return img_names, img_index
 
     def __getitem__(self, index):
-        im = Image.open(self.img_names[index])
-        if im.getbands()[0] == 'L':
-            im = im.convert('RGB')
+        if self.resized_images is not None:
+            im = np.array(self.resized_images[index])  # (size, size, 3) uint8, already decoded
+            # without transform: uint8 (3, size, size) tensor, for `batch_augment`
+            im = Image.fromarray(im) if self.transform else torch.from_numpy(im).permute(2, 0, 1)
+        else:
+            im = Image.open(self.img_names[index])
+            if im.getbands()[0] == 'L':
+                im = im.convert('RGB')
         if self.transform:
             im = self.transform(im)
 
@@ -0,0 +1,91 @@
+"""
+Batched augmentation on uint8 tensors, applied after collation instead of per image with PIL in the workers.
+
+Random crop + horizontal flip are done with a single gather over the batch (per-sample offsets and flip bits),
+grayscale with a weighted sum over the channels. The random parameters are drawn from a `torch.Generator` seeded
+with `seed`, so a run is reproducible (given the same order of batches).
+
+Example:
+    augment = BatchAugment(crop_size=64, flip=True, grayscale=False, train=True, seed=opt.seed)
+    train_loader = BatchAugmentLoader(train_loader, augment)  # yields (float images in [0, 1], targets)
+"""
+
+from typing import Optional
+
+import torch
+import torchvision.transforms.functional as TF
+
+
+class BatchAugment:
+    def __init__(self, crop_size: Optional[int] = None, flip: bool = False, grayscale: bool = False,
+                 train: bool = True, seed: int = 0, channels_last: bool = False):
+        """
+        :param crop_size: random crop when train, center crop otherwise. None: no crop
+        :param flip: random horizontal flip (only when train)
+        :param channels_last: input batches are (b, h, w, c) instead of (b, c, h, w)
+        """
+        self.crop_size = crop_size
+        self.flip = flip
+        self.grayscale = grayscale
+        self.train = train
+        self.channels_last = channels_last
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        """:param images: uint8 (b, c, h, w) (or (b, h, w, c)). :return: float (b, c', crop, crop) in [0, 1]"""
+        if self.channels_last:
+            images = images.permute(0, 3, 1, 2)
+        b, _, h, w = images.shape
+        crop_h = self.crop_size if self.crop_size is not None else h
+        crop_w = self.crop_size if self.crop_size is not None else w
+
+        # per-sample parameters, drawn on the cpu such that they don't depend on the device
+        if self.train:
+            top = torch.randint(0, h - crop_h + 1, (b,), generator=self.generator)
+            left = torch.randint(0, w - crop_w + 1, (b,), generator=self.generator)
+        else:  # center crop
+            top = torch.full((b,), (h - crop_h) // 2, dtype=torch.long)
+            left = torch.full((b,), (w - crop_w) // 2, dtype=torch.long)
+        flip = torch.rand(b, generator=self.generator) < 0.5 if self.flip and self.train \
+            else torch.zeros(b, dtype=torch.bool)
+
+        # crop + flip as one gather: flipped samples read their columns from right to left
+        device = images.device
+        offsets_h = torch.arange(crop_h)
+        offsets_w = torch.arange(crop_w)
+        rows = top[:, None] + offsets_h  # (b, crop_h)
+        cols = left[:, None] + torch.where(flip[:, None], crop_w - 1 - offsets_w, offsets_w)  # (b, crop_w)
+        batch_idx = torch.arange(b)[:, None, None]
+        images = images[batch_idx.to(device), :, rows[:, :, None].to(device), cols[:, None, :].to(device)]
+        images = images.permute(0, 3, 1, 2)  # advanced indexing puts the channels last: (b, crop_h, crop_w, c)
+
+        if self.grayscale and images.shape[1] == 3:
+            images = TF.rgb_to_grayscale(images)
+        return images.float().div_(255)
+
+
+class BatchAugmentLoader:
+    """
+    Wraps a DataLoader that yields uint8 (images, targets) batches and applies `augment` to the images.
+    Other attributes (`dataset`, `batch_size`, `sampler`, `num_workers`, ...) are those of the wrapped loader.
+    """
+
+    def __init__(self, loader, augment: BatchAugment, device: Optional[torch.device] = None):
+        self.loader = loader
+        self.augment = augment
+        self.device = device  # eg: augment on the gpu, also transfers 4x less data than float images
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the wrapper itself
+        if name == "loader":  # not set yet (eg: while unpickling), avoid infinite recursion
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def __iter__(self):
+        for images, targets in self.loader:
+            if self.device is not None:
+                images = images.to(self.device, non_blocking=True)
+            yield self.augment(images), targets
+
+    def __len__(self):
+        return len(self.loader)
@@ -0,0 +1,88 @@
+"""
+Precomputed features of the frozen vision encoder for the downstream (linear) classifier.
+
+The encoder is run once over the classifier's train and test loader, in eval mode and with deterministic
+reparametrization (mu instead of a sample), and its output `h` is written to memory-mapped .npy files in
+`{model_path}/feature_store`. The classifier then trains on `(h, target)` batches without touching the ResNet.
+Note that the augmentations of the train loader (if any) are frozen as well: every image is encoded once.
+
+Example:
+    train_loader, test_loader = get_feature_loaders(opt, context_model, train_loader, test_loader)
+    for h, target in train_loader:
+        prediction = classification_model(h.to(opt.device))
+"""
+
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+from config_code.config_classes import OptionsConfig, ClassifierConfig
+from utils.streaming_accumulator import StreamingAccumulator
+
+
+class FeatureDataset(Dataset):
+    """Items are (h, target), same as the image datasets but with the encoder output instead of the image."""
+
+    def __init__(self, store_dir: str, split: str):
+        with open(os.path.join(store_dir, f"{split}.done"), "r") as f:
+            nb_images = json.load(f)["nb_images"]
+        self.h = np.load(os.path.join(store_dir, f"{split}_h.npy"), mmap_mode="r")[:nb_images]
+        self.targets = np.load(os.path.join(store_dir, f"{split}_targets.npy"))
+
+    def __getitem__(self, index):
+        return torch.from_numpy(np.array(self.h[index])), int(self.targets[index])
+
+    def __len__(self):
+        return self.h.shape[0]
+
+
+def get_feature_store_dir(opt: OptionsConfig) -> str:
+    classifier_config: ClassifierConfig = opt.vision_classifier_config
+    dataset_config = classifier_config.dataset
+    return os.path.join(opt.model_path, "feature_store",
+                        f"dataset={dataset_config.dataset.name} grayscale={dataset_config.grayscale} "
+                        f"encoder_num={classifier_config.encoder_num}")
+
+
+def materialize_features(context_model, loader: DataLoader, store_dir: str, split: str, device):
+    """Encodes every image of `loader` once and writes h to a memory-mapped file. Skipped if already done."""
+    done_path = os.path.join(store_dir, f"{split}.done")
+    if os.path.exists(done_path):
+        print(f"Using precomputed features from {store_dir} ({split})")
+        return
+
+    print(f"Precomputing features for {split} set to {store_dir}")
+    os.makedirs(store_dir, exist_ok=True)
+    context_model.eval()  # `_reparametrize` only returns mu in eval mode
+
+    # capacity: len(dataset) is an upper bound when the loader uses a (validation) sampler
+    h_acc = StreamingAccumulator(len(loader.dataset), memmap_path=os.path.join(store_dir, f"{split}_h.npy"))
+    with torch.no_grad():
+        for img, target in loader:
+            _, _, _, _, h, _ = context_model(img.to(device), target)
+            h_acc.append(h.cpu().numpy(), np.asarray(target))
+
+    _, targets = h_acc.result()
+    np.save(os.path.join(store_dir, f"{split}_targets.npy"), targets)
+
+    # only written once everything is on disk, an interrupted run is redone from scratch
+    with open(done_path, "w") as f:
+        json.dump({"nb_images": len(h_acc)}, f)
+
+
+def get_feature_loaders(opt: OptionsConfig, context_model, train_loader: DataLoader, test_loader: DataLoader):
+    """:return: train and test loaders over the precomputed features, same batch size as the image loaders"""
+    assert opt.encoder_config.deterministic, "Precomputed features require a deterministic encoder"
+    store_dir = get_feature_store_dir(opt)
+    for split, loader in [("train", train_loader), ("test", test_loader)]:
+        materialize_features(context_model, loader, store_dir, split, opt.device)
+
+    num_workers = opt.vision_classifier_config.dataset.num_workers
+    feature_train_loader = DataLoader(FeatureDataset(store_dir, "train"), batch_size=train_loader.batch_size,
+                                      shuffle=True, num_workers=num_workers)
+    feature_test_loader = DataLoader(FeatureDataset(store_dir, "test"), batch_size=test_loader.batch_size,
+                                     shuffle=False, num_workers=num_workers)
+    return feature_train_loader, feature_test_loader
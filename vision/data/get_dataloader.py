@@ -6,10 +6,11 @@ import numpy as np
 from torchvision.transforms import transforms
 
 from config_code.config_classes import DataSetConfig, Dataset
-from vision.data.animals_with_attributes_dataset import AnimalsWithAttributesDataset
+from vision.data.animals_with_attributes_dataset import AnimalsWithAttributesDataset, RESIZED_CACHE_SIZE
+from vision.data.batch_augment import BatchAugment, BatchAugmentLoader
 from torch.utils.data import random_split
 
-from vision.data.shapes_3d_dataset import Shapes3dDataset
+from vision.data.shapes_3d_dataset import Shapes3dDataset, Shapes3dStreamingDataset
 
 
 def get_dataloader(config: DataSetConfig, purpose_is_unsupervised_learning: bool):
@@ -35,7 +36,38 @@ def get_dataloader(config: DataSetConfig, purpose_is_unsupervised_learning: bool
     )
 
 
+def get_shapes_3d_streaming_dataloader(config: DataSetConfig):
+    # images are read from the h5 file on the fly, only the labels are loaded in memory
+    labels = Shapes3dStreamingDataset.get_labels(config)
+    train_indices, val_indices = create_validation_indices(len(labels))
+
+    train_dataset = Shapes3dStreamingDataset(config, train_indices, labels, train=True,
+                                             batch_size=config.batch_size_multiGPU)
+    test_dataset = Shapes3dStreamingDataset(config, val_indices, labels, train=False,
+                                            batch_size=config.batch_size_multiGPU)
+
+    # no sampler/shuffle: the datasets shuffle themselves
+    train_loader = torch.utils.data.DataLoader(
+        train_dataset, batch_size=config.batch_size_multiGPU, num_workers=config.num_workers,
+    )
+    test_loader = torch.utils.data.DataLoader(
+        test_dataset, batch_size=config.batch_size_multiGPU, num_workers=config.num_workers,
+    )
+
+    return (
+        train_loader,
+        train_dataset,
+        train_loader,
+        train_dataset,
+        test_loader,
+        test_dataset,
+    )
+
+
 def get_shapes_3d_dataloader(config: DataSetConfig, _: bool):
+    if config.streaming:
+        return get_shapes_3d_streaming_dataloader(config)
+
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
     images, labels, length = Shapes3dDataset.get_data(config)
@@ -58,6 +90,13 @@ def get_shapes_3d_dataloader(config: DataSetConfig, _: bool):
         num_workers=config.num_workers,
     )
 
+    if config.batched_augmentation:  # dataset returns uint8 (64, 64, 3) images, augmented per batch
+        train_augment = BatchAugment(flip=True, grayscale=config.grayscale, train=True, seed=torch.initial_seed(),
+                                     channels_last=True)
+        test_augment = BatchAugment(grayscale=config.grayscale, train=False, channels_last=True)
+        train_loader = BatchAugmentLoader(train_loader, train_augment, device)
+        test_loader = BatchAugmentLoader(test_loader, test_augment, device)
+
     return (
         train_loader,
         dataset,
@@ -98,6 +137,15 @@ def get_animal_with_attributes_dataloader(config: DataSetConfig, _: bool):
     train_dataset.dataset.transform = transform_train
     val_dataset.dataset.transform = transform_valid
 
+    if config.batched_augmentation and config.use_resized_cache:
+        # images are already uint8 arrays of the same size, everything happens per batch
+        awa.transform = None
+    elif config.batched_augmentation:
+        # per image only the (cheap) center crop to a common size, larger than the random crop, + conversion to a
+        # uint8 tensor. The random crop, flip and grayscale are applied per batch
+        awa.transform = transforms.Compose([transforms.CenterCrop(RESIZED_CACHE_SIZE), transforms.PILToTensor()])
+    batch_crop_size = aug["animal_with_attributes"]["randcrop"]
+
     NUM_WORKERS = config.num_workers
     # default dataset loaders
     train_loader = torch.utils.data.DataLoader(
@@ -108,6 +156,14 @@ def get_animal_with_attributes_dataloader(config: DataSetConfig, _: bool):
         test_dataset, batch_size=config.batch_size_multiGPU, shuffle=False, num_workers=NUM_WORKERS
     )
 
+    if config.batched_augmentation:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        train_augment = BatchAugment(crop_size=batch_crop_size, flip=True, grayscale=config.grayscale, train=True,
+                                     seed=torch.initial_seed())
+        test_augment = BatchAugment(crop_size=batch_crop_size, grayscale=config.grayscale, train=False)
+        train_loader = BatchAugmentLoader(train_loader, train_augment, device)
+        test_loader = BatchAugmentLoader(test_loader, test_augment, device)
+
     return (
         train_loader,
         train_dataset,
@@ -221,7 +277,7 @@ def get_stl10_dataloader(config: DataSetConfig, purpose_is_unsupervised_learning
     )
 
 
-def create_validation_sampler(dataset_size):
+def create_validation_indices(dataset_size):
     # Creating data indices for training and validation splits:
     validation_split = 0.2
     shuffle_dataset = True
@@ -231,6 +287,11 @@ def create_validation_sampler(dataset_size):
     if shuffle_dataset:
         np.random.shuffle(indices)
     train_indices, val_indices = indices[split:], indices[:split]
+    return train_indices, val_indices
+
+
+def create_validation_sampler(dataset_size):
+    train_indices, val_indices = create_validation_indices(dataset_size)
 
     # Creating data samplers and loaders:
     train_sampler = torch.utils.data.sampler.SubsetRandomSampler(train_indices)
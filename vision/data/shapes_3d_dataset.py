@@ -2,8 +2,9 @@
 
 import h5py
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 from torchvision import transforms
+import torchvision.transforms.functional as TF
 import numpy as np
 
 import config_code.config_classes as config_classes
@@ -19,6 +20,8 @@ class Shapes3dDataset(Dataset):
         self.len = len
 
         self.grayscale = config.grayscale
+        # batched augmentation: images are returned as uint8 tensors and augmented after collation (`batch_augment`)
+        self.batched_augmentation = config.batched_augmentation
         self.transform = transforms.Compose([transforms.ToPILImage()])
 
         # append grayscale if needed
@@ -56,7 +59,10 @@ class Shapes3dDataset(Dataset):
 
     def __getitem__(self, index):
         img = self.images[index]
-        img = self.transform(img)
+        if self.batched_augmentation:
+            img = torch.from_numpy(img)  # (64, 64, 3) uint8
+        else:
+            img = self.transform(img)
 
         label = self.labels[index]  # (6,): 0: floor_hue, 1: wall_hue, 2: object_hue, 3: scale, 4: shape, 5: orientation
         shape = label[4]  # double to int
@@ -67,6 +73,108 @@ class Shapes3dDataset(Dataset):
         return self.len
 
 
+class Shapes3dStreamingDataset(IterableDataset):
+    """
+    Reads the images straight from `3dshapes.h5` instead of loading the whole array in memory (~6 GB, + a shuffled
+    copy in `Shapes3dDataset.get_data`). Each worker opens its own file handle and reads contiguous, chunk-aligned
+    blocks of rows, in random order. `shuffle_blocks` blocks are read at once and shuffled together, such that a
+    batch isn't limited to neighbouring rows of the file (which share most factors of variation).
+    Transforms are applied on tensors, without the PIL round trip.
+
+    The rows (in random block order) are split over the workers in whole batches of `batch_size`: only the last
+    batch can be partial, so `len(loader)` is exact for any nb of workers (as long as the loader uses `batch_size`).
+    """
+
+    def __init__(self, config: DataSetConfig, indices: np.ndarray, labels: np.ndarray, train=True,
+                 block_size: int = None, shuffle_blocks: int = 8, batch_size: int = None):
+        """
+        :param indices: rows of the h5 file that belong to this split (eg: train or validation)
+        :param labels: labels of all rows of the h5 file, (nb_rows, 6)
+        :param block_size: nb of rows read at once, defaults to the chunk size of the h5 file
+        :param batch_size: batch size of the DataLoader, defaults to `config.batch_size_multiGPU`
+        """
+        self.path = f"{config.data_input_dir}/3dshapes/3dshapes.h5"
+        self.grayscale = config.grayscale
+        self.train = train
+        self.shuffle_blocks = shuffle_blocks
+        self.batch_size = batch_size if batch_size is not None else config.batch_size_multiGPU
+        self.indices = np.sort(np.asarray(indices))
+        self.shapes = torch.as_tensor(labels[:, 4], dtype=torch.long)  # 4: shape, the label that is predicted
+
+        if block_size is None:
+            with h5py.File(self.path, 'r') as data:
+                chunks = data['images'].chunks
+            block_size = chunks[0] if chunks is not None else 1024
+        self.block_size = block_size
+        self._images = None  # h5 dataset, opened lazily in each worker
+
+    @staticmethod
+    def get_labels(config: DataSetConfig) -> np.ndarray:
+        with h5py.File(f"{config.data_input_dir}/3dshapes/3dshapes.h5", 'r') as data:
+            labels = data['labels']
+            if config.dataset == config_classes.Dataset.SHAPES_3D_SUBSET:
+                return np.array(labels[:800])
+            return np.array(labels)
+
+    def _transform(self, images: torch.Tensor) -> torch.Tensor:
+        # (n, 64, 64, 3) uint8 -> (n, c, 64, 64) float in [0, 1], same as ToPILImage + Grayscale + ToTensor
+        images = images.permute(0, 3, 1, 2)
+        if self.grayscale:
+            images = TF.rgb_to_grayscale(images)
+        images = images.float().div_(255)
+        if self.train:  # random horizontal flip, per image
+            flip = torch.rand(images.shape[0]) < 0.5
+            images[flip] = images[flip].flip(-1)
+        return images
+
+    def __iter__(self):
+        worker = get_worker_info()
+        if worker is None:
+            worker_id, num_workers = 0, 1
+            seed = int(torch.randint(2 ** 31, (1,)).item())
+        else:
+            worker_id, num_workers = worker.id, worker.num_workers
+            seed = worker.seed - worker.id  # base seed: identical for all workers, different every epoch
+
+        if self._images is None:
+            self._images = h5py.File(self.path, 'r')['images']
+
+        # same block order in all workers: the rows of the split, block by block
+        rng = np.random.default_rng(seed)
+        block_ids = rng.permutation(np.unique(self.indices // self.block_size))
+        bounds = np.searchsorted(self.indices, np.stack([block_ids, block_ids + 1]) * self.block_size)
+        rows = np.concatenate([self.indices[lo:hi] for lo, hi in bounds.T])
+
+        # each worker takes a contiguous range of whole batches
+        nb_batches = -(-len(rows) // self.batch_size)
+        first_batch = nb_batches * worker_id // num_workers
+        last_batch = nb_batches * (worker_id + 1) // num_workers
+        rows = rows[first_batch * self.batch_size: last_batch * self.batch_size]
+        rng = np.random.default_rng(seed + 1 + worker_id)
+
+        # start of each block within `rows` (a block is only cut at the boundaries of the range of a worker)
+        block_starts = np.flatnonzero(np.diff(rows // self.block_size, prepend=-1))
+        block_ends = np.append(block_starts[1:], len(rows))
+        for group_start in range(0, len(block_starts), self.shuffle_blocks):
+            images = []
+            group = slice(group_start, group_start + self.shuffle_blocks)
+            for lo, hi in zip(block_starts[group], block_ends[group]):
+                block_rows = rows[lo:hi]  # sorted
+                block = self._images[block_rows[0]: block_rows[-1] + 1]  # one contiguous read
+                images.append(block[block_rows - block_rows[0]])
+            group_rows = rows[block_starts[group][0]: block_ends[group][-1]]
+
+            images = torch.from_numpy(np.concatenate(images))
+            order = torch.from_numpy(rng.permutation(len(group_rows)))
+            images = self._transform(images[order])
+            shapes = self.shapes[torch.from_numpy(group_rows)[order]]
+            for img, shape in zip(images, shapes):
+                yield img, shape
+
+    def __len__(self):
+        return len(self.indices)
+
+
 if __name__ == '__main__':
     config = DataSetConfig(config_classes.Dataset.SHAPES_3D_SUBSET, batch_size=32, grayscale=False, num_workers=8)
 
@@ -79,3 +187,10 @@ if __name__ == '__main__':
         print(labels.shape)  # (32, 6); 6 is the number of factors of variation
         print(labels)  # 0.0
         break
+
+    # streaming: no full copy of the images in memory
+    labels = Shapes3dStreamingDataset.get_labels(config)
+    streaming_dataset = Shapes3dStreamingDataset(config, np.arange(len(labels)), labels, batch_size=32)
+    dataloader = torch.utils.data.DataLoader(streaming_dataset, batch_size=32, num_workers=2)
+    nb_images = sum(images.shape[0] for images, _ in dataloader)
+    assert nb_images == len(labels), f"{nb_images} != {len(labels)}"
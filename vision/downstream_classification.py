@@ -12,7 +12,8 @@ import time
 
 import os
 
-from utils.utils import retrieve_existing_wandb_run_id
+from utils.metrics_sink import MetricsSink, get_metrics_sink
+from utils.utils import retrieve_existing_wandb_run_id, get_wandb_mode
 from vision.models.ClassificationModel import ClassificationModel
 
 os.environ['CUDA_LAUNCH_BLOCKING'] = "1"
@@ -20,7 +21,7 @@ os.environ['CUDA_LAUNCH_BLOCKING'] = "1"
 from config_code.config_classes import OptionsConfig, ModelType, ClassifierConfig, Loss
 from options import get_options
 ## own modules
-from vision.data import get_dataloader
+from vision.data import get_dataloader, feature_store
 from vision.arg_parser import arg_parser
 from vision.models import load_vision_model
 from utils import logger, utils
@@ -28,7 +29,22 @@ from utils import logger, utils
 import wandb
 
 
-def train_logistic_regression(opt: OptionsConfig, context_model, classification_model, train_loader, wandb_is_on):
+def _get_representation(opt: OptionsConfig, context_model, model_input, target):
+    if opt.vision_classifier_config.precompute_features:  # loader already returns h (see `feature_store`)
+        return model_input
+
+    if opt.model_type == 2:  ## fully supervised training
+        _, _, _, _, z = context_model(model_input)
+    else:
+        with torch.no_grad():
+            _, _, _, _, z, _ = context_model(model_input, target)
+        z = z.detach()  # double security that no gradients go to representation learning part of model
+    return z
+
+
+def train_logistic_regression(opt: OptionsConfig, context_model, classification_model, train_loader,
+                              sink: MetricsSink) -> int:
+    """:return: the nb of training steps"""
     total_step = len(train_loader)
     classification_model.train()
 
@@ -39,7 +55,7 @@ def train_logistic_regression(opt: OptionsConfig, context_model, classification_
         epoch_acc1 = 0
         epoch_acc5 = 0
 
-        loss_epoch = 0
+        loss_epoch = torch.zeros((), device=opt.device)  # summed on the device
         for step, (img, target) in enumerate(train_loader):
 
             classification_model.zero_grad()
@@ -47,12 +63,7 @@ def train_logistic_regression(opt: OptionsConfig, context_model, classification_
             model_input = img.to(opt.device)
 
             # TODO: IS THIS == 2 CORRECT?
-            if opt.model_type == 2:  ## fully supervised training
-                _, _, _, _, z = context_model(model_input)
-            else:
-                with torch.no_grad():
-                    _, _, _, _, z, _ = context_model(model_input, target)
-                z = z.detach()  # double security that no gradients go to representation learning part of model
+            z = _get_representation(opt, context_model, model_input, target)
 
             prediction = classification_model(z)
 
@@ -69,18 +80,16 @@ def train_logistic_regression(opt: OptionsConfig, context_model, classification_
             epoch_acc1 += acc1
             epoch_acc5 += acc5
 
-            sample_loss = loss.item()
+            sample_loss = loss.detach()
             loss_epoch += sample_loss
 
-            if wandb_is_on and USE_WANDB:
-                bias = opt.vision_classifier_config.bias
-                deterministic_encoder = opt.encoder_config.deterministic
-                wandb.log({f"C_bias={bias}_determistic_enc={deterministic_encoder}/Loss classification": sample_loss,
-                           f"C_bias={bias}_determistic_enc={deterministic_encoder}/Train accuracy": acc1,
-                           f"C_bias={bias}_determistic_enc={deterministic_encoder}/Train accuracy5": acc5,
-                           f"C_bias={bias}_determistic_enc={deterministic_encoder}/Step": global_step,
-                           f"C_bias={bias}_determistic_enc={deterministic_encoder}/Epoch": epoch})
-                global_step += 1
+            bias = opt.vision_classifier_config.bias
+            deterministic_encoder = opt.encoder_config.deterministic
+            sink.log({f"C_bias={bias}_determistic_enc={deterministic_encoder}/Loss classification": sample_loss,
+                      f"C_bias={bias}_determistic_enc={deterministic_encoder}/Train accuracy": acc1,
+                      f"C_bias={bias}_determistic_enc={deterministic_encoder}/Train accuracy5": acc5,
+                      f"C_bias={bias}_determistic_enc={deterministic_encoder}/Epoch": epoch}, step=global_step)
+            global_step += 1
 
             if step % 10 == 0:
                 print(
@@ -92,7 +101,7 @@ def train_logistic_regression(opt: OptionsConfig, context_model, classification_
                         time.time() - starttime,
                         acc1,
                         acc5,
-                        sample_loss,
+                        sample_loss.item(),
                     )
                 )
                 starttime = time.time()
@@ -100,20 +109,22 @@ def train_logistic_regression(opt: OptionsConfig, context_model, classification_
         if opt.validate:
             # validate the model - in this case, test_loader loads validation data
             val_acc1, _, val_loss = test_logistic_regression(
-                opt, context_model, classification_model, test_loader, wandb_is_on
+                opt, context_model, classification_model, test_loader, sink, global_step
             )
 
-            if wandb_is_on and USE_WANDB:
-                bias = opt.vision_classifier_config.bias
-                deterministic_encoder = opt.encoder_config.deterministic
-                wandb.log({f"C_bias={bias}_determistic_enc={deterministic_encoder}/Validation accuracy": val_acc1,
-                           f"C_bias={bias}_determistic_enc={deterministic_encoder}/Validation loss": val_loss,
-                           f"C_bias={bias}_determistic_enc={deterministic_encoder}/Epoch": epoch})
+            # through the sink, so the values are written in order with the training steps
+            bias = opt.vision_classifier_config.bias
+            deterministic_encoder = opt.encoder_config.deterministic
+            sink.log({f"C_bias={bias}_determistic_enc={deterministic_encoder}/Validation accuracy": val_acc1,
+                      f"C_bias={bias}_determistic_enc={deterministic_encoder}/Validation loss": val_loss,
+                      f"C_bias={bias}_determistic_enc={deterministic_encoder}/Epoch": epoch}, step=global_step)
 
         print("Overall accuracy for this epoch: ", epoch_acc1 / total_step)
 
+    return global_step
+
 
-def test_logistic_regression(opt, context_model, classification_model, test_loader, wandb_is_on):
+def test_logistic_regression(opt, context_model, classification_model, test_loader, sink: MetricsSink, step: int):
     total_step = len(test_loader)
     context_model.eval()
     classification_model.eval()
@@ -130,12 +141,7 @@ def test_logistic_regression(opt, context_model, classification_model, test_load
 
         model_input = img.to(opt.device)
 
-        if opt.model_type == 2:  ## fully supervised training
-            _, _, _, _, z = context_model(model_input)
-        else:
-            with torch.no_grad():
-                _, _, _, _, z, _ = context_model(model_input, target)
-            z = z.detach()  # double security that no gradients go to representation learning part of model
+        z = _get_representation(opt, context_model, model_input, target)
 
         prediction = classification_model(z)
 
@@ -160,12 +166,11 @@ def test_logistic_regression(opt, context_model, classification_model, test_load
 
     print("Testing Accuracy: ", epoch_acc1 / total_step)
 
-    if wandb_is_on and USE_WANDB:
-        bias = opt.vision_classifier_config.bias
-        deterministic_encoder = opt.encoder_config.deterministic
-        wandb.log({f"C_bias={bias}_determistic_enc={deterministic_encoder}/Test accuracy": epoch_acc1 / total_step,
-                   f"C_bias={bias}_determistic_enc={deterministic_encoder}/Test accuracy5": epoch_acc5 / total_step,
-                   f"C_bias={bias}_determistic_enc={deterministic_encoder}/Test loss": loss_epoch / total_step})
+    bias = opt.vision_classifier_config.bias
+    deterministic_encoder = opt.encoder_config.deterministic
+    sink.log({f"C_bias={bias}_determistic_enc={deterministic_encoder}/Test accuracy": epoch_acc1 / total_step,
+              f"C_bias={bias}_determistic_enc={deterministic_encoder}/Test accuracy5": epoch_acc5 / total_step,
+              f"C_bias={bias}_determistic_enc={deterministic_encoder}/Test loss": loss_epoch / total_step}, step=step)
 
     return epoch_acc1 / total_step, epoch_acc5 / total_step, loss_epoch / total_step
 
@@ -188,11 +193,17 @@ if __name__ == "__main__":
         run_id, project_name = retrieve_existing_wandb_run_id(opt)
         if run_id is not None:
             # Initialize a wandb run with the same run id
-            wandb.init(id=run_id, resume="allow", project=project_name)
+            wandb.init(id=run_id, resume="allow", project=project_name, mode=get_wandb_mode(opt))
             wandb_is_on = True
 
     dataset = opt.vision_classifier_config.dataset.dataset
 
+    if opt.vision_classifier_config.precompute_features:
+        assert opt.model_type != 2, "Precomputed features require a frozen encoder"
+        # features are only computed once, so sampling from the posterior would freeze a single sample
+        print("Precomputing features: using deterministic encoder (mode of the posterior)")
+        opt.encoder_config.deterministic = True
+
     # order is important! first wandb.init, then create log path
     # Warning: doesnt consider module or layer, so is overwritten. (Saves storage as don't need to save them really)
     add_path_var = f"linear_model_vision_bias={opt.vision_classifier_config.bias}_deterministic_enc={opt.encoder_config.deterministic}"
@@ -214,6 +225,9 @@ if __name__ == "__main__":
     _, _, train_loader, _, test_loader, _ = get_dataloader.get_dataloader(opt.vision_classifier_config.dataset,
                                                                           purpose_is_unsupervised_learning=False)
 
+    if opt.vision_classifier_config.precompute_features:  # run the encoder once, then only the classifier
+        train_loader, test_loader = feature_store.get_feature_loaders(opt, context_model, train_loader, test_loader)
+
     classification_model: ClassificationModel = load_vision_model.load_classification_model(opt)
 
     if opt.model_type == 2:
@@ -226,19 +240,26 @@ if __name__ == "__main__":
 
     logs = logger.Logger(opt)
 
+    # the run is resumed from the encoder training, so the step is logged as a metric instead of as wandb's step
+    bias, deterministic_encoder = opt.vision_classifier_config.bias, opt.encoder_config.deterministic
+    sink = get_metrics_sink(opt, name="classifier_metrics", use_wandb=wandb_is_on,
+                            wandb_step_metric=f"C_bias={bias}_determistic_enc={deterministic_encoder}/Step")
+
     #### TRAINING ####
-    if TRAIN:
-        try:
+    try:
+        if TRAIN:
             # Train the model
-            train_logistic_regression(opt, context_model, classification_model, train_loader, wandb_is_on)
+            nb_steps = train_logistic_regression(opt, context_model, classification_model, train_loader, sink)
 
             # Test the model
             acc1, acc5, _ = test_logistic_regression(
-                opt, context_model, classification_model, test_loader, wandb_is_on
+                opt, context_model, classification_model, test_loader, sink, nb_steps
             )
 
-        except KeyboardInterrupt:
-            print("Training got interrupted")
+    except KeyboardInterrupt:
+        print("Training got interrupted")
+    finally:
+        sink.close()
 
     logs.create_log(
         context_model,
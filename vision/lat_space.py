@@ -5,16 +5,17 @@ import matplotlib.pyplot as plt
 import numpy as np
 import torch
 import wandb
-from sklearn.manifold import TSNE
 
 from arg_parser import arg_parser
 ## own modules
 from config_code.config_classes import OptionsConfig, Loss, Dataset
 from options import get_options
+from post_hoc_analysis.interpretability.projection import project, get_backend, ProjectionCache
 from post_hoc_analysis.interpretability.interpretabil_util import scatter_3d_generic, plot_histograms
 from utils import logger
 from utils.helper_functions import create_log_dir, translate_stl_number_to_class_label, \
     translate_shapes3d_number_to_class_label, translate_awa2_number_to_class_label
+from utils.streaming_accumulator import StreamingAccumulator
 from utils.utils import set_seed, retrieve_existing_wandb_run_id
 from vision.data import get_dataloader
 from vision.models import load_vision_model
@@ -28,9 +29,10 @@ except:
 
 def _get_data_from_loader(train_loader: torch.utils.data.DataLoader,
                           context_model: FullVisionModel, opt: OptionsConfig, num_datapoints: Optional[int] = None):
-    all_data = np.array([])
-    all_labels = np.array([])
-    datapoints_processed = 0
+    capacity = len(train_loader.dataset)
+    if num_datapoints is not None:  # the last batch may go over num_datapoints
+        capacity = min(capacity, num_datapoints + train_loader.batch_size)
+    accumulator = StreamingAccumulator(capacity=capacity)
 
     for i, (data, label) in enumerate(train_loader):
         data = data.to(opt.device)
@@ -39,21 +41,13 @@ def _get_data_from_loader(train_loader: torch.utils.data.DataLoader,
             _, _, _, _, data, _ = context_model(data, label)  # no clue why also label is passed here
             data = data.cpu().detach().numpy()  # (batch_size, seq_len, nb_channels)
 
-            # vstack the data
-            if all_data.size == 0:
-                all_data = data
-                all_labels = label
-            else:
-                all_data = np.vstack((all_data, data))
-                all_labels = np.hstack((all_labels, label))
-
-            datapoints_processed += data.shape[0]
+            accumulator.append(data, label)
 
             # If num_datapoints is not None and we have processed enough datapoints, break the loop
-            if num_datapoints is not None and datapoints_processed >= num_datapoints:
+            if num_datapoints is not None and len(accumulator) >= num_datapoints:
                 break
 
-    return all_data, all_labels
+    return accumulator.result()
 
 
 def scatter_generic(x, labels, title, translate_idx_to_label_fn: callable, dir=None, file=None, show=True, n=100):
@@ -110,17 +104,16 @@ def scatter_generic(x, labels, title, translate_idx_to_label_fn: callable, dir=N
 
 
 def plot_tsne_vision(opt, all_data_mean, all_labels, param, lr, n_iter, perplexity, wandb_is_on,
-                     translate_idx_to_label_fn: callable):
+                     translate_idx_to_label_fn: callable, backend: str = "sklearn", pca_components: Optional[int] = None,
+                     max_samples: Optional[int] = None, checkpoint: Optional[str] = None):
     # flatten the dataset
     n_samples, n_features, n_channels = all_data_mean.shape
     all_data_mean = all_data_mean.reshape((n_samples, n_features * n_channels))
 
-    projection = TSNE(
-        init='random',
-        learning_rate=lr,
-        n_iter=n_iter,
-        perplexity=perplexity
-    ).fit_transform(all_data_mean)
+    projection, all_labels = project(
+        all_data_mean, all_labels, get_backend(backend, lr, n_iter, perplexity),
+        pca_components=pca_components, max_samples=max_samples, seed=max(opt.seed, 0),
+        cache=ProjectionCache(os.path.join(opt.model_path, "projection_cache")), checkpoint=checkpoint)
 
     assert projection.shape[0] == all_labels.shape[0]
 
@@ -189,7 +182,8 @@ def main():
     lr, n_iter, perplexity = ('auto', 1000, int(float(np.sqrt(n))))
     plot_tsne_vision(opt, all_data_mean, all_labels, f"MEAN_SIM_{lr}_{n_iter}_{perplexity}",
                      lr=lr, n_iter=n_iter, perplexity=perplexity, wandb_is_on=wandb_is_on,
-                     translate_idx_to_label_fn=translate_idx_to_label_fn)
+                     translate_idx_to_label_fn=translate_idx_to_label_fn,
+                     checkpoint=f"model_{opt.vision_classifier_config.encoder_num}")
 
     ### 3D scatter plot
     _, _, train_loader, _, test_loader, _ = get_dataloader.get_dataloader(dataset,
@@ -10,9 +10,11 @@ import os
 
 from config_code.config_classes import ModelType, OptionsConfig
 from vision.models.FullModel import FullVisionModel
+from vision.models.greedy_training import get_prefix_loaders, StageOptimizers, PipelinedTrainer
 
 #### own modules
 from utils import logger
+from utils.metrics import MetricsAccumulator
 from utils.utils import set_seed, initialize_wandb
 from vision.arg_parser import arg_parser
 from vision.models import load_vision_model
@@ -22,44 +24,38 @@ from options import get_options
 import wandb
 
 
-def validate(opt: OptionsConfig, model: FullVisionModel, test_loader):
+def validate(opt: OptionsConfig, model: FullVisionModel, test_loader, start_module: int = 0):
+    """:param start_module: first module to run, the loader yields the outputs of the module before (cached_prefix)"""
     total_step = len(test_loader)
-    model_splits = 3  # TODO
-    # model_splits = opt.model_splits
+    model_splits = opt.encoder_config.architecture.model_splits
 
-    loss_epoch = [0 for i in range(model_splits)]
-    nce_loss_epoch = [0 for i in range(model_splits)]
-    kld_loss_epoch = [0 for i in range(model_splits)]
+    metrics = MetricsAccumulator(["loss", "nce_loss", "kld_loss"])  # summed on the device, one sync at the end
     starttime = time.time()
 
     for step, (img, label) in enumerate(test_loader):
         model_input = img.to(opt.device)
         label = label.to(opt.device)
 
-        loss, nce_loss, kld_loss, _, _, _ = model(model_input, label, n=opt.encoder_config.architecture.train_module)
-        loss = torch.mean(loss, 0)
-        nce_loss = torch.mean(nce_loss, 0)
-        kld_loss = torch.mean(kld_loss, 0)
+        loss, nce_loss, kld_loss, _, _, _ = model(model_input, label, n=opt.encoder_config.architecture.train_module,
+                                                  start_module=start_module)
+        metrics.update(loss=torch.mean(loss, 0), nce_loss=torch.mean(nce_loss, 0), kld_loss=torch.mean(kld_loss, 0))
 
-        loss_epoch += loss.data.cpu().numpy()
-        nce_loss_epoch += nce_loss.data.cpu().numpy()
-        kld_loss_epoch += kld_loss.data.cpu().numpy()
+    means = metrics.mean(count=total_step)
+    validation_loss = means["loss"]
+    validation_nce_loss = means["nce_loss"]
+    validation_kld_loss = means["kld_loss"]
 
-    for i in range(opt.encoder_config.architecture.model_splits):
+    for i in range(model_splits):
         print(
             "Validation Loss Model {}: Time (s): {:.1f} --- {:.4f}".format(
-                i, time.time() - starttime, loss_epoch[i] / total_step
+                i, time.time() - starttime, validation_loss[i]
             )
         )
 
-    validation_loss = [x / total_step for x in loss_epoch]
-    validation_nce_loss = [x / total_step for x in nce_loss_epoch]
-    validation_kld_loss = [x / total_step for x in kld_loss_epoch]
-
     return validation_loss, validation_nce_loss, validation_kld_loss
 
 
-def train(opt: OptionsConfig, model: FullVisionModel):
+def train(opt: OptionsConfig, model: FullVisionModel, start_module: int = 0):
     total_step = len(train_loader)
     model.module.switch_calc_loss(True)
 
@@ -96,7 +92,8 @@ def train(opt: OptionsConfig, model: FullVisionModel):
             model_input = img.to(opt.device)
             label = label.to(opt.device)
 
-            loss, nce_loss, kld_loss, _, _, accuracy = model(model_input, label, n=cur_train_module)
+            loss, nce_loss, kld_loss, _, _, accuracy = model(model_input, label, n=cur_train_module,
+                                                             start_module=start_module)
             loss = torch.mean(loss, 0)  # Take mean over outputs of different GPUs.
             nce_loss = torch.mean(nce_loss, 0)
             kld_loss = torch.mean(kld_loss, 0)
@@ -133,7 +130,8 @@ def train(opt: OptionsConfig, model: FullVisionModel):
 
         if opt.validate:
             validation_loss, validation_nce_loss, validation_kld_loss = \
-                validate(opt, model, test_loader)  # Test_loader corresponds to validation set here.
+                validate(opt, model, test_loader, start_module)  # Test_loader corresponds to validation set here.
+            logs.append_val_loss(validation_loss)  # plotted, and used to keep the best checkpoint
 
             for i, val_loss in enumerate(validation_loss):
                 if USE_WANDB:
@@ -144,6 +142,70 @@ def train(opt: OptionsConfig, model: FullVisionModel):
         logs.create_log(model, epoch=epoch, optimizer=optimizer)
 
 
+def _log_train_step(opt: OptionsConfig, epoch, step, loss, nce_loss, kld_loss, accuracy, loss_epoch, print_step):
+    for idx, cur_losses in enumerate(loss):
+        loss_epoch[idx] += cur_losses.item()
+        if print_step:
+            print("\t \t Loss: \t \t {:.4f}".format(cur_losses.item()))
+            if opt.loss == 1:
+                print("\t \t Accuracy: \t \t {:.4f}".format(accuracy[idx].item()))
+
+        if USE_WANDB:
+            wandb.log({f"loss_{idx}": cur_losses, f"nce_loss_{idx}": nce_loss[idx], f"kld_loss_{idx}": kld_loss[idx],
+                       "epoch": epoch}, step=step)
+
+
+def train_pipelined(opt: OptionsConfig, model: FullVisionModel):
+    """Same as `train`, but all modules are trained concurrently, see `greedy_training.PipelinedTrainer`."""
+    total_step = len(train_loader)
+    model_splits = opt.encoder_config.architecture.model_splits
+    assert opt.encoder_config.architecture.train_module == model_splits, \
+        "pipelined training trains all modules (train_module == model_splits)"
+    model.module.switch_calc_loss(True)
+
+    print_idx = 100
+    stage_optimizers = StageOptimizers(optimizer, list(model.module.encoder))
+    global_step = 0
+
+    for epoch in range(opt.encoder_config.start_epoch, opt.encoder_config.num_epochs + opt.encoder_config.start_epoch):
+        loss_epoch = [0 for _ in range(model_splits)]
+        starttime = time.time()
+        trainer = PipelinedTrainer(model.module, stage_optimizers)
+
+        def log_finished(results):
+            for step, loss, nce_loss, kld_loss, accuracy in results:
+                _log_train_step(opt, epoch, global_step + step, loss, nce_loss, kld_loss, accuracy, loss_epoch,
+                                print_step=step % print_idx == 0)
+
+        try:
+            for step, (img, label) in enumerate(train_loader):
+                if step % print_idx == 0:
+                    print("Epoch [{}/{}], Step [{}/{}], Pipelined, Time (s): {:.1f}".format(
+                        epoch + 1, opt.encoder_config.num_epochs + opt.encoder_config.start_epoch,
+                        step, total_step, time.time() - starttime))
+                    starttime = time.time()
+
+                trainer.submit(step, img.to(opt.device), label.to(opt.device))
+                log_finished(trainer.collect())
+            log_finished(trainer.collect(wait_for_all=True))
+        finally:
+            trainer.close()
+        global_step += total_step
+
+        if opt.validate:
+            validation_loss, validation_nce_loss, validation_kld_loss = \
+                validate(opt, model, test_loader)  # Test_loader corresponds to validation set here.
+            logs.append_val_loss(validation_loss)  # plotted, and used to keep the best checkpoint
+
+            for i, val_loss in enumerate(validation_loss):
+                if USE_WANDB:
+                    wandb.log({f"val_loss_{i}": val_loss, f"val_nce_loss_{i}": validation_nce_loss[i],
+                               f"val_kld_loss_{i}": validation_kld_loss[i]},
+                              step=global_step)
+
+        logs.create_log(model, epoch=epoch, optimizer=stage_optimizers)
+
+
 if __name__ == "__main__":
 
     opt: OptionsConfig = get_options()
@@ -184,15 +246,28 @@ if __name__ == "__main__":
     if opt.loss == 1:
         train_loader = supervised_loader
 
+    training_mode = opt.encoder_config.architecture.training_mode
+    start_module = 0
+    if training_mode == "cached_prefix":
+        # modules before train_module are frozen: run them once and train on their stored outputs
+        start_module = opt.encoder_config.architecture.train_module
+        assert 0 < start_module < opt.encoder_config.architecture.model_splits, \
+            "cached_prefix requires a single module to be trained, after the first module"
+        model.module.switch_calc_loss(True)
+        train_loader, test_loader = get_prefix_loaders(opt, model, train_loader, test_loader, start_module)
+
     try:
         # Train the model
-        if TRAIN:
-            train(opt, model)
+        if TRAIN and training_mode == "pipelined":
+            train_pipelined(opt, model)
+        elif TRAIN:
+            train(opt, model, start_module)
 
     except KeyboardInterrupt:
         print("Training got interrupted, saving log-files now.")
 
     logs.create_log(model)
+    logs.wait()  # checkpoints are written in the background
 
     if USE_WANDB:
         wandb.finish()
@@ -92,18 +92,25 @@ class FullVisionModel(torch.nn.Module):
 
         return full_model, encoder, autoregressor
 
-    def forward(self, x, label, n=3):
+    def forward(self, x, label, n=3, start_module=0):
+        """
+        :param start_module: > 0 if x is the stored output of modules 0..start_module-1 (`greedy_training`),
+            shape (batch_size, n_patches_x, n_patches_y, c, h, w)
+        """
         model_input = x
         cur_device = self.opt.device
 
         n_patches_x, n_patches_y = None, None
+        if start_module > 0:
+            n_patches_x, n_patches_y = x.shape[1], x.shape[2]
+            model_input = x.reshape(-1, *x.shape[3:])  # (batch_size * 7 * 7, c, h, w)
         model_splits = self.opt.encoder_config.architecture.model_splits
         loss = torch.zeros(1, model_splits, device=cur_device)  # first dimension for multi-GPU training
         nce_loss = torch.zeros(1, model_splits, device=cur_device)
         kld_loss = torch.zeros(1, model_splits, device=cur_device)
         accuracies = torch.zeros(1, model_splits, device=cur_device)
 
-        for idx, module in enumerate(self.encoder[: n + 1]):
+        for idx, module in enumerate(self.encoder[start_module: n + 1], start=start_module):
             h, z, cur_loss, cur_nce_loss, cur_kld_loss, cur_accuracy, n_patches_x, n_patches_y = \
                 module(model_input, n_patches_x, n_patches_y, label)
             # Detach z to make sure no gradients are flowing in between modules
@@ -128,6 +135,15 @@ class FullVisionModel(torch.nn.Module):
 
         return loss, nce_loss, kld_loss, c, h, accuracies
 
+    def forward_prefix(self, x, label, end_module):
+        """:return: output of modules 0..end_module-1, (batch_size, n_patches_x, n_patches_y, c, h, w)"""
+        model_input = x
+        n_patches_x, n_patches_y = None, None
+        for module in self.encoder[:end_module]:
+            _, z, _, _, _, _, n_patches_x, n_patches_y = module(model_input, n_patches_x, n_patches_y, label)
+            model_input = z.detach()
+        return model_input.reshape(-1, n_patches_x, n_patches_y, *model_input.shape[1:])
+
     def switch_calc_loss(self, calc_loss):
         ## by default models are set to not calculate the loss as it is costly
         ## this function can enable the calculation of the loss for training
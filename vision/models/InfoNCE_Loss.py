@@ -13,6 +13,8 @@ class InfoNCE_Loss(nn.Module):
         self.opt = opt
         self.negative_samples = self.opt.encoder_config.negative_samples
         self.k_predictions = 5
+        self.share_negatives = self.opt.encoder_config.architecture.share_negatives
+        self.fused_contrastive_loss = self.opt.encoder_config.architecture.fused_contrastive_loss
 
         self.W_k = nn.ModuleList(
             nn.Conv2d(in_channels, out_channels, 1, bias=False)
@@ -50,6 +52,12 @@ class InfoNCE_Loss(nn.Module):
         else:
             cur_device = self.opt.device
 
+        shared_draw = None
+        if self.share_negatives:
+            # one draw for all k, sized for k=1 (most rows). Scaled to the nb of rows of each k in `_negative_indices`
+            max_rows = (z.shape[2] - (1 + skip_step)) * z.shape[3] * batch_size
+            shared_draw = torch.rand(max_rows * self.negative_samples, device=cur_device)
+
         # For each element in c, contrast with elements below
         for k in range(1, self.k_predictions + 1):
             ### compute log f(c_t, x_{t+k}) = z^T_{t+k} W_k c_t
@@ -64,18 +72,10 @@ class InfoNCE_Loss(nn.Module):
             ztwk_shuf = ztwk.view(
                 ztwk.shape[0] * ztwk.shape[1] * ztwk.shape[2], ztwk.shape[3]
             )  # y * x * batch, c
-            rand_index = torch.randint(
-                ztwk_shuf.shape[0],  # y *  x * batch
-                (ztwk_shuf.shape[0] * self.negative_samples, 1),
-                dtype=torch.long,
-                device=cur_device,
-            )
-            # Sample more
-            rand_index = rand_index.repeat(1, ztwk_shuf.shape[1])
+            rand_index = self._negative_indices(ztwk_shuf.shape[0], shared_draw, cur_device)  # y * x * b * n
 
-            ztwk_shuf = torch.gather(
-                ztwk_shuf, dim=0, index=rand_index, out=None
-            )  # y * x * b * n, c
+            # index the rows directly, instead of gathering with an index repeated over all c channels
+            ztwk_shuf = ztwk_shuf.index_select(0, rand_index)  # y * x * b * n, c
 
             ztwk_shuf = ztwk_shuf.view(
                 ztwk.shape[0],
@@ -101,20 +101,29 @@ class InfoNCE_Loss(nn.Module):
             log_fk = torch.cat((log_fk_main, log_fk_shuf), 3)  # y, x, b, 1+n
             log_fk = log_fk.permute(2, 3, 0, 1)  # b, 1+n, y, x
 
-            log_fk = torch.softmax(log_fk, dim=1)
-
             true_f = torch.zeros(
                 (batch_size, log_fk.shape[-2], log_fk.shape[-1]),
                 dtype=torch.long,
                 device=cur_device,
             )  # b, y, x
 
-            total_loss += self.contrast_loss(input=log_fk, target=true_f)
+            if self.fused_contrastive_loss:  # log-softmax + nll in one pass, no 1e-11 needed
+                total_loss += F.cross_entropy(log_fk, true_f)
+            else:
+                log_fk = torch.softmax(log_fk, dim=1)
+                total_loss += self.contrast_loss(input=log_fk, target=true_f)
 
         total_loss /= self.k_predictions
 
         return total_loss
 
+    def _negative_indices(self, nb_rows, shared_draw, device):
+        # uniform random rows, self.negative_samples per row
+        if shared_draw is None:
+            return torch.randint(nb_rows, (nb_rows * self.negative_samples,), dtype=torch.long, device=device)
+        rand_index = (shared_draw[: nb_rows * self.negative_samples] * nb_rows).long()
+        return rand_index.clamp_(max=nb_rows - 1)  # float rounding
+
 
 class ExpNLLLoss(_WeightedLoss):
 
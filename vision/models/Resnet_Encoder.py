@@ -3,6 +3,7 @@ from typing import Type, Union
 import torch.nn as nn
 import torch.nn.functional as F
 import torch
+from torch.utils.checkpoint import checkpoint
 
 from config_code.config_classes import OptionsConfig, Loss
 from vision.models import InfoNCE_Loss, Supervised_Loss
@@ -91,6 +92,9 @@ class ResNet_Encoder(nn.Module):
 
         self.patchify = True
         self.overlap = 2  # 2x overlap: 50% overlap
+        # "reshape": copy all patches at once, "chunked": per `patch_chunk_size` images, see `_forward_patches_chunked`
+        self.patch_mode = opt.encoder_config.architecture.patch_mode
+        self.patch_chunk_size = opt.encoder_config.architecture.patch_chunk_size
 
         self.calc_loss = calc_loss
         self.patch_size = patch_size
@@ -175,26 +179,54 @@ class ResNet_Encoder(nn.Module):
             eps = torch.randn_like(std)
             return mu + (eps * std)
 
+    def _patchify(self, x: torch.Tensor):
+        x = (  # x.shape = (batch_size, 3, 64, 64) -> (batch_size, 7, 7, 3, 16, 16)
+            x.unfold(2, self.patch_size, self.patch_size // self.overlap)
+            .unfold(3, self.patch_size, self.patch_size // self.overlap)
+            .permute(0, 2, 3, 1, 4, 5)
+        )
+        n_patches_x = x.shape[1]  # 7
+        n_patches_y = x.shape[2]  # 7
+        x = x.reshape(  # (batch_size, 7, 7, 3, 16, 16) -> (batch_size * 7 * 7, 3, 16, 16), copies the patches
+            x.shape[0] * x.shape[1] * x.shape[2], x.shape[3], x.shape[4], x.shape[5]
+        )
+        return x, n_patches_x, n_patches_y
+
+    def _patchify_and_encode(self, x: torch.Tensor):
+        return self.model(self._patchify(x)[0])
+
+    def _forward_patches_chunked(self, x: torch.Tensor):
+        # The patches overlap (and conv1 zero-pads each patch), so the first conv can't simply be applied to the full
+        # image. Instead, the patches of `patch_chunk_size` images at a time are copied and encoded. During training,
+        # the chunks are checkpointed: only the image slice is kept for the backward pass (a view, no patch copy) and
+        # the activations of the chunk are recomputed.
+        checkpointing = self.training and torch.is_grad_enabled()
+        zs = []
+        for start in range(0, x.shape[0], self.patch_chunk_size):
+            x_chunk = x[start: start + self.patch_chunk_size]
+            if checkpointing:
+                zs.append(checkpoint(self._patchify_and_encode, x_chunk, use_reentrant=False))
+            else:
+                zs.append(self._patchify_and_encode(x_chunk))
+
+        n_patches_x = (x.shape[2] - self.patch_size) // (self.patch_size // self.overlap) + 1  # 7
+        n_patches_y = (x.shape[3] - self.patch_size) // (self.patch_size // self.overlap) + 1  # 7
+        return torch.cat(zs), n_patches_x, n_patches_y  # (batch_size * 7 * 7, 64, 16, 16), same order as `_patchify`
+
     def forward(self, x: torch.Tensor, n_patches_x, n_patches_y, label, patchify_right_now=True):
         # x in module 1: (batch_size, 3, 64, 64)
         # x in module 2: (batch_size * 7 * 7, 3, 16, 16)
         # x in module 3: (batch_size * 7 * 7, 64, 8, 8)
 
-        if self.patchify and self.encoder_num == 0 and patchify_right_now:
-            x = (  # x.shape = (batch_size, 3, 64, 64) -> (batch_size, 7, 7, 3, 16, 16)
-                x.unfold(2, self.patch_size, self.patch_size // self.overlap)
-                .unfold(3, self.patch_size, self.patch_size // self.overlap)
-                .permute(0, 2, 3, 1, 4, 5)
-            )
-            n_patches_x = x.shape[1]  # 7
-            n_patches_y = x.shape[2]  # 7
-            x = x.reshape(  # (batch_size, 7, 7, 3, 16, 16) -> (batch_size * 7 * 7, 3, 16, 16)
-                x.shape[0] * x.shape[1] * x.shape[2], x.shape[3], x.shape[4], x.shape[5]
-            )
+        if self.patchify and self.encoder_num == 0 and patchify_right_now and self.patch_mode == "chunked":
+            z, n_patches_x, n_patches_y = self._forward_patches_chunked(x)
+        else:
+            if self.patchify and self.encoder_num == 0 and patchify_right_now:
+                x, n_patches_x, n_patches_y = self._patchify(x)
 
-        # x.shape = (batch_size * 7 * 7, 3, 16, 16)
-        # z.shape = (batch_size * 7 * 7, 64, 16, 16)
-        z = self.model(x)
+            # x.shape = (batch_size * 7 * 7, 3, 16, 16)
+            # z.shape = (batch_size * 7 * 7, 64, 16, 16)
+            z = self.model(x)
 
         # preserve batch, # channels but avg pool the spatial dimensions
         out = F.adaptive_avg_pool2d(z, 1)  # (batch_size * 7 * 7, 64, 1, 1)
@@ -0,0 +1,267 @@
+"""
+Faster greedy (module-wise) training of the vision encoder. Both modes exploit that the modules are trained
+independently: a module only receives the detached output of the module before it.
+
+- cached prefix (`training_mode="cached_prefix"`): when only `train_module` = k is trained, modules 0..k-1 are
+  frozen. Their output is computed once (eval mode) and stored memory-mapped in `{log_path}/prefix_store`, after which
+  every epoch only runs the modules from k onwards. As for `feature_store`, the augmentations of the first pass are
+  frozen. The store is recomputed when the weights of modules 0..k-1 or the dataset config change. The stored
+  outputs are large (eg: 49 patches x 512 x 8 x 8 for module 1 of the ResNet50), they are kept in float16.
+- pipelined (`training_mode="pipelined"`): all modules are trained at the same time, each by its own thread (and cuda
+  stream) with its own optimizer. Queues connect the stages: module i works on batch t while module i+1 works on
+  batch t-1. Each module sees the same batches and the same (detached) inputs as in the sequential loop.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+from typing import List
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+from utils.streaming_accumulator import StreamingAccumulator
+
+### Cached prefix
+
+
+class PrefixDataset(Dataset):
+    """Items are (z, label): the output of the frozen modules, (n_patches_x, n_patches_y, c, h, w)."""
+
+    def __init__(self, store_dir: str, split: str):
+        with open(os.path.join(store_dir, f"{split}.done"), "r") as f:
+            nb_images = json.load(f)["nb_images"]
+        self.z = np.load(os.path.join(store_dir, f"{split}_z.npy"), mmap_mode="r")[:nb_images]
+        self.labels = np.load(os.path.join(store_dir, f"{split}_labels.npy"))
+
+    def __getitem__(self, index):
+        return torch.from_numpy(np.array(self.z[index], dtype=np.float32)), int(self.labels[index])
+
+    def __len__(self):
+        return self.z.shape[0]
+
+
+def get_prefix_fingerprint(model, end_module: int, dataset_config) -> str:
+    """Hash of the weights of modules 0..end_module-1 and of the dataset config: the stored outputs are only valid
+    for exactly these."""
+    digest = hashlib.sha1()
+    for module in list(model.module.encoder)[:end_module]:
+        for name, value in module.state_dict().items():
+            digest.update(name.encode())
+            digest.update(value.detach().cpu().contiguous().numpy().tobytes())
+    digest.update(repr(sorted((key, repr(value)) for key, value in vars(dataset_config).items())).encode())
+    return digest.hexdigest()
+
+
+def materialize_prefix(model, loader: DataLoader, store_dir: str, split: str, end_module: int, device,
+                       fingerprint: str):
+    """
+    Runs modules 0..end_module-1 once over `loader` and stores their output.
+    Skipped if already done with the same weights and dataset (`fingerprint`), otherwise recomputed.
+    """
+    done_path = os.path.join(store_dir, f"{split}.done")
+    if os.path.exists(done_path):
+        with open(done_path, "r") as f:
+            stored_fingerprint = json.load(f).get("fingerprint")
+        if stored_fingerprint == fingerprint:
+            print(f"Using precomputed outputs of modules 0..{end_module - 1} from {store_dir} ({split})")
+            return
+        print(f"Precomputed outputs in {store_dir} ({split}) are from other weights or another dataset config, "
+              f"recomputing")
+        os.remove(done_path)
+
+    print(f"Precomputing outputs of modules 0..{end_module - 1} for {split} set to {store_dir}")
+    os.makedirs(store_dir, exist_ok=True)
+    was_training = model.training
+    model.eval()
+
+    acc = StreamingAccumulator(len(loader.dataset), dtype=np.float16,
+                               memmap_path=os.path.join(store_dir, f"{split}_z.npy"))
+    with torch.no_grad():
+        for img, label in loader:
+            z = model.module.forward_prefix(img.to(device), label.to(device), end_module)
+            acc.append(z.cpu().numpy(), np.asarray(label))
+
+    _, labels = acc.result()
+    np.save(os.path.join(store_dir, f"{split}_labels.npy"), labels)
+    with open(done_path, "w") as f:
+        json.dump({"nb_images": len(acc), "fingerprint": fingerprint}, f)
+    model.train(was_training)
+
+
+def get_prefix_loaders(opt, model, train_loader: DataLoader, test_loader: DataLoader, end_module: int):
+    """:return: train and test loaders over the stored outputs of modules 0..end_module-1"""
+    store_dir = os.path.join(opt.log_path, "prefix_store", f"end_module={end_module}")
+    fingerprint = get_prefix_fingerprint(model, end_module, opt.encoder_config.dataset)
+    for split, loader in [("train", train_loader), ("test", test_loader)]:
+        materialize_prefix(model, loader, store_dir, split, end_module, opt.device, fingerprint)
+
+    num_workers = opt.encoder_config.dataset.num_workers
+    prefix_train_loader = DataLoader(PrefixDataset(store_dir, "train"), batch_size=train_loader.batch_size,
+                                     shuffle=True, num_workers=num_workers)
+    prefix_test_loader = DataLoader(PrefixDataset(store_dir, "test"), batch_size=test_loader.batch_size,
+                                    shuffle=False, num_workers=num_workers)
+    return prefix_train_loader, prefix_test_loader
+
+
+### Pipelined
+
+
+class StageOptimizers:
+    """
+    One optimizer per module, such that the stages can step independently (and concurrently).
+    The per-parameter states are shared with `optimizer`, so checkpoints (`optimizer.state_dict()`) keep the
+    same format as in the sequential loop.
+    """
+
+    def __init__(self, optimizer: torch.optim.Optimizer, modules: List[torch.nn.Module]):
+        self.optimizer = optimizer
+        group = {key: value for key, value in optimizer.param_groups[0].items() if key != "params"}
+        self.stages = []
+        for module in modules:
+            params = list(module.parameters())
+            stage = type(optimizer)(params, lr=group["lr"])
+            stage.param_groups[0].update(group)  # same hyperparameters (betas, eps, ...)
+            for param in params:
+                stage.state[param] = optimizer.state[param]  # same dict object, updated in place by `step`
+            self.stages.append(stage)
+
+    def zero_grad(self, stage_idx: int):
+        self.stages[stage_idx].zero_grad()
+
+    def step(self, stage_idx: int):
+        self.stages[stage_idx].step()
+
+    def state_dict(self):
+        return self.optimizer.state_dict()
+
+
+class PipelinedTrainer:
+    """
+    Example:
+        trainer = PipelinedTrainer(model.module, StageOptimizers(optimizer, model.module.encoder))
+        for step, (img, label) in enumerate(train_loader):
+            trainer.submit(step, img.to(device), label.to(device))
+            for result in trainer.collect():  # finished steps, (step, loss, nce_loss, kld_loss, accuracy)
+                ...
+        results = trainer.collect(wait_for_all=True)
+        trainer.close()
+    """
+
+    def __init__(self, model, optimizers: StageOptimizers, max_in_flight: int = 2):
+        self.encoder = model.encoder
+        self.optimizers = optimizers
+        self.nb_stages = len(self.encoder)
+        self.use_streams = torch.cuda.is_available() and next(model.parameters()).is_cuda
+
+        # bounded queues: a stage that runs ahead blocks instead of filling the memory
+        self._inputs = [queue.Queue(maxsize=max_in_flight) for _ in range(self.nb_stages)]
+        self._results = queue.Queue()
+        self._partial = {}  # step -> {stage_idx: (loss, nce_loss, kld_loss, accuracy)}
+        self._nb_submitted = 0
+        self._nb_collected = 0
+        self._error = None
+
+        self._threads = [threading.Thread(target=self._run_stage, args=(idx,), name=f"stage_{idx}", daemon=True)
+                         for idx in range(self.nb_stages)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, step: int, img: torch.Tensor, label: torch.Tensor):
+        self._raise_if_failed()
+        self._inputs[0].put((step, img, None, None, label, self._record_event()))
+        self._nb_submitted += 1
+
+    def collect(self, wait_for_all=False) -> list:
+        """:return: the steps for which all stages are done, as (step, loss, nce_loss, kld_loss, accuracy)"""
+        finished = []
+        while self._nb_collected < self._nb_submitted:
+            try:
+                step, stage_idx, values, event = self._results.get(block=wait_for_all,
+                                                                   timeout=1 if wait_for_all else None)
+            except queue.Empty:
+                self._raise_if_failed()
+                if wait_for_all:
+                    continue
+                break
+            if event is not None:  # the values (and the `optimizer.step`) were produced on the stage's stream
+                torch.cuda.current_stream().wait_event(event)
+            self._partial.setdefault(step, {})[stage_idx] = values
+            if len(self._partial[step]) == self.nb_stages:
+                stages = self._partial.pop(step)
+                loss, nce_loss, kld_loss, accuracy = [torch.stack([stages[idx][i] for idx in range(self.nb_stages)])
+                                                      for i in range(4)]
+                finished.append((step, loss, nce_loss, kld_loss, accuracy))
+                self._nb_collected += 1
+        return finished
+
+    def close(self):
+        self._inputs[0].put(None)  # propagated through all stages
+        for thread in self._threads:
+            thread.join()
+        if self.use_streams:
+            # the last `optimizer.step` of each stage must be done before anything else reads the parameters
+            torch.cuda.synchronize()
+        self._raise_if_failed()
+
+    def _record_event(self):
+        if not self.use_streams:
+            return None
+        event = torch.cuda.Event()
+        event.record()
+        return event
+
+    def _run_stage(self, idx: int):
+        module = self.encoder[idx]
+        stream = torch.cuda.Stream() if self.use_streams else None
+        while True:
+            item = self._inputs[idx].get()
+            if item is None:
+                if idx + 1 < self.nb_stages:
+                    self._inputs[idx + 1].put(None)
+                if stream is not None:
+                    stream.synchronize()
+                break
+            if self._error is not None:
+                continue  # drain the queue, the error is raised in the main thread
+
+            step, model_input, n_patches_x, n_patches_y, label, event = item
+            try:
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        stream.wait_event(event)  # input was produced on another stream
+                        model_input.record_stream(stream)
+                        outputs = self._train_step(idx, module, model_input, n_patches_x, n_patches_y, label)
+                else:
+                    outputs = self._train_step(idx, module, model_input, n_patches_x, n_patches_y, label)
+            except Exception as e:
+                self._error = e
+                continue
+
+            z, n_patches_x, n_patches_y, values = outputs
+            event = None
+            if stream is not None:
+                with torch.cuda.stream(stream):
+                    event = self._record_event()  # after `optimizer.step`: the next stage and `collect` wait on it
+            if idx + 1 < self.nb_stages:
+                self._inputs[idx + 1].put((step, z, n_patches_x, n_patches_y, label, event))
+            self._results.put((step, idx, values, event))
+
+    def _train_step(self, idx, module, model_input, n_patches_x, n_patches_y, label):
+        _, z, loss, nce_loss, kld_loss, accuracy, n_patches_x, n_patches_y = \
+            module(model_input, n_patches_x, n_patches_y, label)
+
+        self.optimizers.zero_grad(idx)
+        loss.backward()
+        self.optimizers.step(idx)
+
+        values = (loss.detach().reshape(()), nce_loss.detach().reshape(()), kld_loss.detach().reshape(()),
+                  accuracy.detach().to(loss.device).reshape(()))
+        return z.detach(), n_patches_x, n_patches_y, values
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError("A pipeline stage failed") from self._error